@@ -1,19 +1,35 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from flask_login import LoginManager, login_user, logout_user, login_required
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash
 from config import Config
-from models import db, User, Book, IssuedBook, Notification, Category
+from models import db, User, Book, Category, LibraryStats
 from routes import main
+from commands import register_commands
+from scheduler import Scheduler
+from jobs import JobRunner
+from sweep import sweep_due_notifications
+from migrations import upgrade_database
+from engine import configure_engine, apply_sqlite_pragmas
+from replica import ReadReplica, is_sqlite_file_copy, replica_configured, sync_replica
+from stats import reconcile_stats
+from profiler import SQLProfiler
+from covers import cover_url
+from unread import UnreadCountCache
+from identity import IdentityCache, load_identity
+from push import create_broker
+from fines import accrue_fines
 import os
-from datetime import datetime, timedelta, timezone
 
-def create_app():
+def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
     
     # Initialize extensions
+    configure_engine(app)
     db.init_app(app)
+    with app.app_context():
+        apply_sqlite_pragmas(app)
     
     # Initialize Flask-Login
     login_manager = LoginManager()
@@ -22,68 +38,43 @@ def create_app():
     login_manager.login_message = 'Please log in to access this page.'
     login_manager.login_message_category = 'info'
     
-    @login_manager.user_loader
-    def load_user(user_id):
-        return User.query.get(int(user_id))
+    # Sessions resolve to cached user snapshots instead of a query per request
+    IdentityCache(app)
+    login_manager.user_loader(load_identity)
     
     # Register blueprints
     app.register_blueprint(main)
+    app.jinja_env.globals['cover_url'] = cover_url
+    UnreadCountCache(app)
+    if replica_configured(app):
+        ReadReplica(app)
+    create_broker(app)
+    
+    # Optional per-request SQL instrumentation
+    if app.config['SQL_PROFILER_ENABLED']:
+        SQLProfiler(app)
     
-    # Create database tables
+    # Create database tables and upgrade existing ones
     with app.app_context():
-        db.create_all()
+        upgrade_database()
         create_sample_data()
+        if LibraryStats.get() is None:
+            reconcile_stats()
+        if is_sqlite_file_copy(app):
+            sync_replica()
     
-    # Background task to check for due books and create notifications
-    @app.before_request
-    def check_due_books():
-        if current_user.is_authenticated:
-            # Check for books due tomorrow
-            tomorrow = datetime.now(timezone.utc) + timedelta(days=1)
-            due_tomorrow = IssuedBook.query.filter(
-                IssuedBook.user_id == current_user.id,
-                IssuedBook.return_date.is_(None),
-                db.func.date(IssuedBook.due_date) == tomorrow.date()
-            ).all()
-            
-            for issued_book in due_tomorrow:
-                # Check if notification already exists
-                existing_notification = Notification.query.filter_by(
-                    user_id=current_user.id,
-                    message=f"Book '{issued_book.book.title}' is due tomorrow!"
-                ).first()
-                
-                if not existing_notification:
-                    Notification.create_notification(
-                        current_user.id,
-                        f"Book '{issued_book.book.title}' is due tomorrow!",
-                        'warning'
-                    )
-            
-            # Check for overdue books
-            overdue_books = IssuedBook.query.filter(
-                IssuedBook.user_id == current_user.id,
-                IssuedBook.return_date.is_(None),
-                IssuedBook.due_date < datetime.now(timezone.utc)
-            ).all()
-            
-            for issued_book in overdue_books:
-                days_overdue = (datetime.now(timezone.utc) - issued_book.due_date).days
-                # Check if notification already exists for today
-                today = datetime.now(timezone.utc).date()
-                existing_notification = Notification.query.filter(
-                    Notification.user_id == current_user.id,
-                    Notification.message.like(f"%{issued_book.book.title}% is overdue%"),
-                    db.func.date(Notification.created_at) == today
-                ).first()
-                
-                if not existing_notification:
-                    fine = days_overdue * app.config['FINE_PER_DAY']
-                    Notification.create_notification(
-                        current_user.id,
-                        f"Book '{issued_book.book.title}' is overdue by {days_overdue} days. Fine: ₹{fine}",
-                        'danger'
-                    )
+    # Due/overdue notifications are created by a periodic batch sweep
+    # instead of on every request. The jobs are only registered here; they
+    # run in `flask run-scheduler` (or the `python app.py` dev server)
+    register_commands(app)
+    jobs = JobRunner(app)
+    scheduler = Scheduler(app)
+    scheduler.add_job('notification_sweep', sweep_due_notifications, app.config['NOTIFICATION_SWEEP_INTERVAL'])
+    scheduler.add_job('job_cleanup', jobs.purge_expired, app.config['JOB_CLEANUP_INTERVAL'])
+    scheduler.add_job('stats_reconcile', reconcile_stats, app.config['STATS_RECONCILE_INTERVAL'])
+    scheduler.add_job('fine_accrual', accrue_fines, app.config['FINE_ACCRUAL_INTERVAL'])
+    if is_sqlite_file_copy(app):
+        scheduler.add_job('replica_sync', sync_replica, app.config['REPLICA_SYNC_INTERVAL'])
     
     return app
 
@@ -113,41 +104,39 @@ def create_sample_data():
         db.session.add(admin)
         db.session.add(student)
         
+        # Create default categories
+        categories = {
+            name: Category(name=name, book_count=0) for name in [
+                'Fiction', 'Science Fiction', 'Romance', 'Political Fiction', 'Mystery',
+                'Biography', 'History', 'Science', 'Technology', 'Philosophy'
+            ]
+        }
+        
+        for category in categories.values():
+            db.session.add(category)
+        
         # Create sample books
         books = [
-            Book(title='The Great Gatsby', author='F. Scott Fitzgerald', category='Fiction', total_copies=3, available_copies=3),
-            Book(title='To Kill a Mockingbird', author='Harper Lee', category='Fiction', total_copies=2, available_copies=2),
-            Book(title='1984', author='George Orwell', category='Science Fiction', total_copies=4, available_copies=4),
-            Book(title='Pride and Prejudice', author='Jane Austen', category='Romance', total_copies=2, available_copies=2),
-            Book(title='The Catcher in the Rye', author='J.D. Salinger', category='Fiction', total_copies=3, available_copies=3),
-            Book(title='Lord of the Flies', author='William Golding', category='Fiction', total_copies=2, available_copies=2),
-            Book(title='Animal Farm', author='George Orwell', category='Political Fiction', total_copies=3, available_copies=3),
-            Book(title='Brave New World', author='Aldous Huxley', category='Science Fiction', total_copies=2, available_copies=2),
+            Book(title='The Great Gatsby', author='F. Scott Fitzgerald', category=categories['Fiction'], total_copies=3, available_copies=3),
+            Book(title='To Kill a Mockingbird', author='Harper Lee', category=categories['Fiction'], total_copies=2, available_copies=2),
+            Book(title='1984', author='George Orwell', category=categories['Science Fiction'], total_copies=4, available_copies=4),
+            Book(title='Pride and Prejudice', author='Jane Austen', category=categories['Romance'], total_copies=2, available_copies=2),
+            Book(title='The Catcher in the Rye', author='J.D. Salinger', category=categories['Fiction'], total_copies=3, available_copies=3),
+            Book(title='Lord of the Flies', author='William Golding', category=categories['Fiction'], total_copies=2, available_copies=2),
+            Book(title='Animal Farm', author='George Orwell', category=categories['Political Fiction'], total_copies=3, available_copies=3),
+            Book(title='Brave New World', author='Aldous Huxley', category=categories['Science Fiction'], total_copies=2, available_copies=2),
         ]
         
         for book in books:
             db.session.add(book)
-        
-        # Create default categories
-        categories = [
-            Category(name='Fiction'),
-            Category(name='Science Fiction'),
-            Category(name='Romance'),
-            Category(name='Political Fiction'),
-            Category(name='Mystery'),
-            Category(name='Biography'),
-            Category(name='History'),
-            Category(name='Science'),
-            Category(name='Technology'),
-            Category(name='Philosophy')
-        ]
-        
-        for category in categories:
-            db.session.add(category)
+            book.category.book_count += 1
         
         db.session.commit()
         print("Sample data created successfully!")
 
 if __name__ == '__main__':
     app = create_app()
+    # Only the reloader's serving child runs the jobs, not its watcher
+    if app.config['SCHEDULER_ENABLED'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        app.extensions['scheduler'].start()
     app.run(debug=True)
@@ -0,0 +1,465 @@
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from collections import Counter
+from http.cookiejar import CookieJar
+from werkzeug.security import generate_password_hash
+from models import db, User, Book, IssuedBook, Notification, Category
+from config import Config
+from profiler import count_queries
+from search import rebuild_search_index, has_search_index
+from stats import adjust_category_counts, reconcile_stats, refresh_unread_counts
+
+# Dataset sizes: users, books, loans, notifications
+PRESETS = {
+    'small': {'users': 2000, 'books': 10000, 'loans': 50000, 'notifications': 200000},
+    'medium': {'users': 20000, 'books': 100000, 'loans': 1000000, 'notifications': 5000000},
+    'large': {'users': 200000, 'books': 1000000, 'loans': 10000000, 'notifications': 50000000},
+}
+
+INSERT_BATCH_SIZE = 10000
+
+WORDS = [
+    'history', 'garden', 'river', 'empire', 'silent', 'winter', 'shadow', 'science', 'journey', 'ocean',
+    'mountain', 'secret', 'modern', 'ancient', 'city', 'light', 'theory', 'machine', 'forest', 'island',
+    'war', 'peace', 'stars', 'code', 'dream', 'fire', 'glass', 'iron', 'memory', 'storm'
+]
+SURNAMES = ['Smith', 'Rao', 'Garcia', 'Chen', 'Okafor', 'Müller', 'Sato', 'Silva', 'Kumar', 'Novak']
+
+BENCH_PASSWORD = 'bench123'
+ADMIN = ('admin@library.com', 'admin123')
+
+
+def _insert_batches(model, rows, progress=None):
+    """Bulk insert an iterable of row dicts, committing every batch"""
+    batch = []
+    inserted = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            db.session.execute(db.insert(model), batch)
+            db.session.commit()
+            inserted += len(batch)
+            batch = []
+            if progress:
+                progress(model.__tablename__, inserted)
+    if batch:
+        db.session.execute(db.insert(model), batch)
+        db.session.commit()
+        inserted += len(batch)
+    if progress:
+        progress(model.__tablename__, inserted)
+    return inserted
+
+
+def generate_dataset(users, books, loans, notifications, seed=0, progress=None):
+    """Add a synthetic dataset of the given size with batched bulk inserts.
+
+    Loans are spread over the last two years; about one in ten is still
+    open (some overdue). Available copies, category book counts and the
+    library statistics are recomputed at the end so the data is consistent.
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    categories = [category_id for category_id, in db.session.query(Category.id)]
+    if not categories:
+        fiction = Category(name='Fiction', book_count=0)
+        db.session.add(fiction)
+        db.session.flush()
+        categories = [fiction.id]
+    first_user = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    first_book = (db.session.query(db.func.max(Book.id)).scalar() or 0) + 1
+    run_id = f'{seed}-{int(time.time())}'
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+
+    _insert_batches(User, ({
+        'name': f'{rng.choice(WORDS).title()} {rng.choice(SURNAMES)}',
+        'email': f'bench{index}.{run_id}@bench.local',
+        'mobile': f'9{rng.randrange(10 ** 9):09d}',
+        'password_hash': password_hash,
+        'role': 'student',
+        'membership_type': rng.choice(['basic', '3month', '6month', 'lifetime']),
+        'created_at': now - timedelta(days=rng.randrange(730))
+    } for index in range(users)), progress)
+
+    _insert_batches(Book, ({
+        'title': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title() + f' {index}',
+        'author': f'{rng.choice(WORDS).title()} {rng.choice(SURNAMES)}',
+        'category_id': rng.choice(categories),
+        'total_copies': 5,
+        'available_copies': 5,
+        'created_at': now - timedelta(days=rng.randrange(730))
+    } for index in range(books)), progress)
+
+    open_pairs = set()
+
+    def loan_rows():
+        for _ in range(loans):
+            user_id = first_user + rng.randrange(users)
+            book_id = first_book + rng.randrange(books)
+            issue_date = now - timedelta(days=rng.randrange(730), minutes=rng.randrange(1440))
+            due_date = issue_date + timedelta(days=10)
+            returned = rng.random() > 0.1 or (user_id, book_id) in open_pairs
+            if not returned:
+                open_pairs.add((user_id, book_id))
+                # Open loans are recent so that only some are overdue
+                issue_date = now - timedelta(days=rng.randrange(20))
+                due_date = issue_date + timedelta(days=10)
+            yield {
+                'user_id': user_id,
+                'book_id': book_id,
+                'issue_date': issue_date,
+                'due_date': due_date,
+                'return_date': issue_date + timedelta(days=rng.randrange(15)) if returned else None,
+                'fine': 0.0
+            }
+
+    if users and books:
+        _insert_batches(IssuedBook, loan_rows(), progress)
+
+    messages = ["Book '{}' has been issued to you.", "Book '{}' has been returned.", 'Your membership has been updated.']
+    if users:
+        _insert_batches(Notification, ({
+            'user_id': first_user + rng.randrange(users),
+            'message': rng.choice(messages).format(rng.choice(WORDS).title()),
+            'notification_type': 'info',
+            'is_read': rng.random() > 0.2,
+            'created_at': now - timedelta(minutes=rng.randrange(730 * 1440))
+        } for _ in range(notifications)), progress)
+
+    # Make copy counts agree with the open loans just created
+    open_loans = db.select(db.func.count()).where(
+        IssuedBook.book_id == Book.id, IssuedBook.return_date.is_(None)
+    ).scalar_subquery()
+    total_copies = db.case((open_loans > Book.total_copies, open_loans), else_=Book.total_copies)
+    db.session.execute(db.update(Book).where(Book.id >= first_book).values(
+        total_copies=total_copies,
+        available_copies=total_copies - open_loans
+    ))
+    refresh_unread_counts(user_id for user_id, in db.session.query(User.id).filter(User.id >= first_user))
+    db.session.commit()
+
+    if has_search_index():
+        rebuild_search_index()
+    reconcile_stats()
+    return run_id
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(name, latencies, errors, elapsed, queries=None):
+    latencies = sorted(round(latency, 3) for latency in latencies)
+    result = {
+        'scenario': name,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': _percentile(latencies, 0.50),
+        'p90_ms': _percentile(latencies, 0.90),
+        'p99_ms': _percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else None
+    }
+    if queries:
+        result['avg_queries'] = round(sum(queries) / len(queries), 2)
+        result['max_queries'] = max(queries)
+    return result
+
+
+class BenchmarkData:
+    """Ids sampled up front so scenarios do not query while being timed"""
+
+    def __init__(self, sample=1000, seed=0):
+        rng = random.Random(seed)
+        self.students = [email for email, in db.session.query(User.email).filter(
+            User.email.like('%@bench.local')).limit(sample)] or ['student@library.com']
+        self.student_ids = [user_id for user_id, in db.session.query(User.id).filter(
+            User.role == 'student').limit(sample)]
+        self.book_ids = [book_id for book_id, in db.session.query(Book.id).filter(
+            Book.available_copies > 0).limit(sample)]
+        self.open_loans = [loan_id for loan_id, in db.session.query(IssuedBook.id).filter(
+            IssuedBook.return_date.is_(None)).limit(sample)]
+        rng.shuffle(self.open_loans)
+        self._lock = threading.Lock()
+        self.rng = rng
+
+    def password_for(self, email):
+        return 'student123' if email == 'student@library.com' else BENCH_PASSWORD
+
+    def pop_open_loan(self):
+        with self._lock:
+            return self.open_loans.pop() if self.open_loans else None
+
+
+# name -> (login as, method, path builder, form builder)
+def scenarios(data):
+    rng = data.rng
+
+    def student():
+        email = rng.choice(data.students)
+        return email, data.password_for(email)
+
+    return {
+        'login': (None, 'POST', lambda: '/login',
+                  lambda: dict(zip(('email', 'password'), student()))),
+        'student_dashboard_search': (student, 'GET',
+                                     lambda: '/student/dashboard?' + urllib.parse.urlencode({'search': rng.choice(WORDS)}),
+                                     None),
+        'issue_book': (lambda: ADMIN, 'POST', lambda: '/issue-book',
+                       lambda: {'student_id': rng.choice(data.student_ids), 'book_id': rng.choice(data.book_ids)}),
+        'return_book': (lambda: ADMIN, 'POST', lambda: '/return-book',
+                        lambda: {'issued_book_id': data.pop_open_loan() or 0}),
+        'admin_dashboard': (lambda: ADMIN, 'GET', lambda: '/admin/dashboard', None),
+        'export_database': (lambda: ADMIN, 'GET', lambda: '/admin/database/export', None),
+        'notification_count': (student, 'GET', lambda: '/api/notifications/count', None),
+    }
+
+
+# Full exports are far slower than page views; run them sparingly
+ITERATION_OVERRIDES = {'export_database': 1}
+
+
+def run_in_process(app, data, iterations, names=None):
+    """Drive the routes through the Flask test client, counting queries"""
+    results = []
+    for name, (credentials, method, path, form) in scenarios(data).items():
+        if names and name not in names:
+            continue
+        client = app.test_client()
+        if credentials:
+            email, password = credentials()
+            client.post('/login', data={'email': email, 'password': password})
+
+        latencies, queries, errors = [], [], 0
+        count = ITERATION_OVERRIDES.get(name, iterations)
+        started = time.perf_counter()
+        for _ in range(count):
+            url, body = path(), form() if form else None
+            with app.app_context(), count_queries() as counter:
+                request_started = time.perf_counter()
+                response = client.open(url, method=method, data=body)
+                response.get_data()
+                latencies.append((time.perf_counter() - request_started) * 1000)
+            queries.append(counter.count)
+            if response.status_code >= 400:
+                errors += 1
+        results.append(summarize(name, latencies, errors, time.perf_counter() - started, queries))
+    return results
+
+
+def _http_session(base_url, credentials):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    if credentials:
+        email, password = credentials()
+        body = urllib.parse.urlencode({'email': email, 'password': password}).encode()
+        opener.open(base_url + '/login', body).read()
+    return opener
+
+
+def run_http(base_url, data, iterations, concurrency, names=None):
+    """Drive a running server over HTTP from `concurrency` threads.
+
+    Each thread logs in with its own cookie jar and sends `iterations`
+    requests per scenario. Query counts are not available in this mode.
+    """
+    base_url = base_url.rstrip('/')
+    results = []
+    for name, (credentials, method, path, form) in scenarios(data).items():
+        if names and name not in names:
+            continue
+        count = ITERATION_OVERRIDES.get(name, iterations)
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+
+        def worker():
+            opener = _http_session(base_url, credentials)
+            for _ in range(count):
+                body = urllib.parse.urlencode(form()).encode() if form else None
+                request_started = time.perf_counter()
+                try:
+                    opener.open(base_url + path(), body if method == 'POST' else None).read()
+                    failed = False
+                except (urllib.error.URLError, OSError):
+                    failed = True
+                elapsed = (time.perf_counter() - request_started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    errors[0] += failed
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results.append(summarize(name, latencies, errors[0], time.perf_counter() - started))
+    return results
+
+
+# SQLite settings compared by the concurrent write benchmark. `default` is
+# what SQLite and the driver do untuned; `tuned` is the Config profile.
+WRITE_PROFILES = {
+    'default': {'SQLITE_JOURNAL_MODE': 'delete', 'SQLITE_SYNCHRONOUS': 'full', 'SQLITE_BUSY_TIMEOUT': 5000,
+                'SQLITE_MMAP_SIZE': 0, 'SQLITE_CACHE_SIZE': 2000},
+    'tuned': {},
+}
+
+
+def _write_benchmark_config(folder, **settings):
+    """Config for a throwaway app on a fresh SQLite file in `folder`, with
+    its job, upload and cache folders there too"""
+    class WriteBenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(folder, 'writes.db')}"
+        SQLALCHEMY_BINDS = {}
+        SQL_PROFILER_ENABLED = False
+        JOB_FOLDER = os.path.join(folder, 'jobs')
+        UPLOAD_FOLDER = os.path.join(folder, 'uploads')
+        IDENTITY_CACHE_FOLDER = os.path.join(folder, 'identity')
+    for name, value in settings.items():
+        setattr(WriteBenchmarkConfig, name, value)
+    return WriteBenchmarkConfig
+
+
+def _seed_write_pairs(count):
+    """One student and one single-copy book per thread, so threads contend
+    only for the database lock, not for copies"""
+    category = Category.query.filter_by(name='Fiction').one()
+    books = [Book(title=f'Write Benchmark {index}', author='Benchmark', category=category,
+                  total_copies=1, available_copies=1) for index in range(count)]
+    students = [User(name=f'Write Benchmark {index}', email=f'writes{index}@bench.local', role='student',
+                     password_hash='-') for index in range(count)]
+    db.session.add_all(books + students)
+    db.session.flush()
+    adjust_category_counts(Counter(book.category_id for book in books))
+    db.session.commit()
+    reconcile_stats()
+    return [(student.id, book.id) for student, book in zip(students, books)]
+
+
+def run_write_benchmark(create_app, threads=8, operations=50, profiles=None):
+    """Concurrent write throughput on a fresh SQLite file per profile.
+
+    Every thread logs in as the admin and alternately issues and returns
+    its own book through the circulation API, one operation per request.
+    Requests that fail ("database is locked" and the like) count as errors.
+    Returns one summary per profile, named `writes_<profile>`.
+    """
+    results = []
+    for profile in profiles or WRITE_PROFILES:
+        folder = tempfile.mkdtemp(prefix='library_writes_')
+        app = create_app(_write_benchmark_config(folder, **WRITE_PROFILES[profile]))
+        with app.app_context():
+            pairs = _seed_write_pairs(threads)
+
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads + 1)
+
+        def worker(student_id, book_id):
+            client = app.test_client()
+            client.post('/login', data={'email': ADMIN[0], 'password': ADMIN[1]})
+            barrier.wait()
+            for index in range(operations):
+                operation = {'op': 'issue' if index % 2 == 0 else 'return',
+                             'student_id': student_id, 'book_id': book_id}
+                started = time.perf_counter()
+                try:
+                    response = client.post('/api/circulation/batch', json={'operations': [operation]})
+                    failed = response.status_code != 200 or 'error' in response.get_json()['results'][0]
+                except Exception:
+                    failed = True
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    errors[0] += failed
+
+        workers = [threading.Thread(target=worker, args=pair) for pair in pairs]
+        for thread in workers:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        results.append(summarize(f'writes_{profile}', latencies, errors[0], time.perf_counter() - started))
+
+        app.extensions['jobs'].executor.shutdown(wait=True)
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        shutil.rmtree(folder)
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def dataset_size():
+    return {
+        'users': User.query.count(),
+        'books': Book.query.count(),
+        'loans': IssuedBook.query.count(),
+        'notifications': Notification.query.count()
+    }
+
+
+def save_results(path, record):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def compare_results(base, head):
+    """Per-scenario deltas of head versus base as printable rows"""
+    base_results = {result['scenario']: result for result in base['results']}
+    rows = []
+    for result in head['results']:
+        previous = base_results.get(result['scenario'])
+        row = {'scenario': result['scenario']}
+        for metric in ('throughput', 'p50_ms', 'p99_ms', 'avg_queries'):
+            value = result.get(metric)
+            old = previous.get(metric) if previous else None
+            row[metric] = value
+            row[f'{metric}_change'] = (
+                f'{(value - old) / old * 100:+.1f}%' if value is not None and old else 'n/a'
+            )
+        rows.append(row)
+    return rows
+
+
+def format_results(results):
+    columns = ['scenario', 'requests', 'errors', 'throughput', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'avg_queries']
+    lines = ['  '.join(f'{column:>14}' for column in columns)]
+    for result in results:
+        values = []
+        for column in columns:
+            value = result.get(column)
+            values.append(f'{value:>14.2f}' if isinstance(value, float) else f'{str(value if value is not None else "-"):>14}')
+        lines.append('  '.join(values))
+    return '\n'.join(lines)
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe in-process LRU whose entries expire after `ttl` seconds"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FillGuard:
+    """Keeps a cache from storing a value read before an invalidation.
+
+    Take a `token()` before reading the database and fill the cache only if
+    `still_valid(token)`: every `invalidate()` in between (a concurrent
+    commit) makes the value possibly stale, so it is not cached.
+    """
+
+    def __init__(self):
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def token(self):
+        with self._lock:
+            return self._generation
+
+    def still_valid(self, token):
+        with self._lock:
+            return token == self._generation
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
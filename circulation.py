@@ -0,0 +1,240 @@
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Book, IssuedBook
+from outbox import queue_notification
+from fines import post_return_fines
+from stats import adjust_stats
+
+OP_ISSUE = 'issue'
+OP_RETURN = 'return'
+
+
+class BatchError(ValueError):
+    """The batch request itself is malformed"""
+
+
+class BatchConflict(Exception):
+    """A concurrent change invalidated the batch; nothing was written"""
+
+
+def take_copy(book_id):
+    """Atomically take one available copy; False if none is left"""
+    return db.session.execute(
+        db.update(Book).where(Book.id == book_id, Book.available_copies > 0).values(
+            available_copies=Book.available_copies - 1
+        ).execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+
+def release_copy(book_id):
+    db.session.execute(
+        db.update(Book).where(Book.id == book_id).values(
+            available_copies=Book.available_copies + 1
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def close_loan(loan_id, return_date, fine):
+    """Mark a loan returned if it is still open; False if it was not"""
+    return db.session.execute(
+        db.update(IssuedBook).where(IssuedBook.id == loan_id, IssuedBook.return_date.is_(None)).values(
+            return_date=return_date, fine=fine
+        ).execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+
+def _int_field(operation, name):
+    value = operation.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'{name} must be an integer')
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def parse_operations(payload, limit):
+    """Validate the request body into a list of (op, fields) or errors.
+
+    Each entry is either ('issue', {'student_id', 'book_id'}),
+    ('return', {'issued_book_id'} or {'student_id', 'book_id'}) or
+    (None, error message). Raises BatchError if the body is unusable.
+    """
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise BatchError('Provide a non-empty "operations" list.')
+    if len(operations) > limit:
+        raise BatchError(f'At most {limit} operations per batch.')
+
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict):
+            parsed.append((None, 'Operation must be an object'))
+            continue
+        op = operation.get('op')
+        try:
+            fields = {name: _int_field(operation, name)
+                      for name in ('student_id', 'book_id', 'issued_book_id')}
+        except ValueError as error:
+            parsed.append((None, str(error)))
+            continue
+
+        if op == OP_ISSUE and fields['student_id'] is not None and fields['book_id'] is not None:
+            parsed.append((op, fields))
+        elif op == OP_RETURN and (fields['issued_book_id'] is not None or
+                                  (fields['student_id'] is not None and fields['book_id'] is not None)):
+            parsed.append((op, fields))
+        elif op in (OP_ISSUE, OP_RETURN):
+            parsed.append((None, 'issue needs student_id and book_id; return needs issued_book_id '
+                                 'or student_id and book_id'))
+        else:
+            parsed.append((None, f'Unknown op {op!r}'))
+    return parsed
+
+
+def _load(operations):
+    """Fetch every student, book and open loan the batch refers to, with
+    one query per table"""
+    student_ids = {fields['student_id'] for op, fields in operations if op and fields['student_id'] is not None}
+    book_ids = {fields['book_id'] for op, fields in operations if op and fields['book_id'] is not None}
+    loan_ids = {fields['issued_book_id'] for op, fields in operations
+                if op == OP_RETURN and fields['issued_book_id'] is not None}
+
+    criteria = []
+    if loan_ids:
+        criteria.append(IssuedBook.id.in_(loan_ids))
+    if student_ids and book_ids:
+        criteria.append(db.and_(IssuedBook.user_id.in_(student_ids), IssuedBook.book_id.in_(book_ids)))
+    loans = IssuedBook.query.filter(IssuedBook.return_date.is_(None), db.or_(*criteria)).all() if criteria else []
+
+    book_ids |= {loan.book_id for loan in loans}
+    students = {user.id: user for user in User.query.filter(User.id.in_(student_ids), User.role == 'student')} \
+        if student_ids else {}
+    books = {book.id: book for book in Book.query.filter(Book.id.in_(book_ids))} if book_ids else {}
+    return students, books, loans
+
+
+def apply_batch(operations, now=None):
+    """Apply parsed issue/return operations in one transaction.
+
+    Operations run in list order against an in-memory view of the loaded
+    rows, so a return earlier in the batch frees a copy for a later issue.
+    Failed operations are skipped and reported; the rest are written with
+    one statement per kind of change: an executemany adjusting
+    available_copies by each book's net delta, one batched insert of new
+    loans, one batched update of returned loans and one bulk insert of
+    notifications (queued in the outbox and written at commit). Returns
+    one result dict per operation.
+
+    The writes are conditional (copies never go negative, loans are only
+    closed while open, open loans are unique per student and book); if a
+    concurrent request got there first the whole batch is rolled back and
+    BatchConflict raised, so the caller can retry it.
+    """
+    now = now or datetime.now(timezone.utc)
+    fine_per_day = current_app.config['FINE_PER_DAY']
+    students, books, loans = _load(operations)
+    loans_by_id = {loan.id: loan for loan in loans}
+    open_loans = {(loan.user_id, loan.book_id): loan for loan in loans}
+    available = {book_id: book.available_copies for book_id, book in books.items()}
+
+    results = []
+    issued, returned, notifications = [], [], []
+    return_fines = []
+    for index, (op, fields) in enumerate(operations):
+        result = {'index': index, 'op': op, 'ok': False}
+        results.append(result)
+        if op is None:
+            result['error'] = fields
+            continue
+
+        if op == OP_ISSUE:
+            student_id, book_id = fields['student_id'], fields['book_id']
+            if student_id not in students or book_id not in books:
+                result['error'] = 'Invalid student or book'
+            elif available[book_id] <= 0:
+                result['error'] = 'Book is not available for issue'
+            elif (student_id, book_id) in open_loans:
+                result['error'] = 'Student already has this book issued'
+            else:
+                loan = IssuedBook(user_id=student_id, book_id=book_id, issue_date=now)
+                available[book_id] -= 1
+                open_loans[(student_id, book_id)] = loan
+                issued.append((result, loan))
+                notifications.append((student_id, f"Book '{books[book_id].title}' has been issued to you. "
+                                                  f"Due date: {loan.due_date.strftime('%Y-%m-%d')}"))
+            continue
+
+        if fields['issued_book_id'] is not None:
+            loan = loans_by_id.get(fields['issued_book_id'])
+        else:
+            loan = open_loans.get((fields['student_id'], fields['book_id']))
+        if loan is None or loan.id not in loans_by_id:
+            # Unknown, already returned, or issued earlier in this batch
+            result['error'] = 'Invalid book return request'
+            continue
+
+        fine = loan.fine or 0.0
+        if loan.is_overdue():
+            fine = loan.days_overdue() * fine_per_day
+        available[loan.book_id] += 1
+        open_loans.pop((loan.user_id, loan.book_id), None)
+        loans_by_id.pop(loan.id)
+        returned.append({'loan_id': loan.id, 'return_date': now, 'fine': fine})
+        return_fines.append((loan.id, loan.user_id, fine))
+        result.update(ok=True, issued_book_id=loan.id, fine=fine)
+        message = f"Book '{books[loan.book_id].title}' has been returned."
+        if fine > 0:
+            message += f" Fine: ₹{fine}"
+        notifications.append((loan.user_id, message))
+
+    connection = db.session.connection()
+    deltas = [{'book_id': book_id, 'delta': available[book_id] - book.available_copies}
+              for book_id, book in books.items() if available[book_id] != book.available_copies]
+    books_table, loans_table = Book.__table__, IssuedBook.__table__
+    try:
+        if deltas:
+            changed = connection.execute(
+                db.update(books_table).where(
+                    books_table.c.id == db.bindparam('book_id'),
+                    books_table.c.available_copies + db.bindparam('delta') >= 0
+                ).values(available_copies=books_table.c.available_copies + db.bindparam('delta')),
+                deltas
+            ).rowcount
+            if changed != len(deltas):
+                raise BatchConflict('Copies were issued elsewhere while the batch ran; retry it.')
+        if returned:
+            closed = connection.execute(
+                db.update(loans_table).where(
+                    loans_table.c.id == db.bindparam('loan_id'),
+                    loans_table.c.return_date.is_(None)
+                ).values(return_date=db.bindparam('return_date'), fine=db.bindparam('fine')),
+                returned
+            ).rowcount
+            if closed != len(returned):
+                raise BatchConflict('Loans were returned elsewhere while the batch ran; retry it.')
+        db.session.add_all([loan for _, loan in issued])
+        db.session.flush()  # one batched INSERT of the new loans
+    except IntegrityError:
+        db.session.rollback()
+        raise BatchConflict('Books were issued elsewhere while the batch ran; retry it.')
+    except BatchConflict:
+        db.session.rollback()
+        raise
+
+    for result, loan in issued:
+        result.update(ok=True, issued_book_id=loan.id, due_date=loan.due_date.isoformat())
+
+    if return_fines:
+        post_return_fines(return_fines, now)
+
+    # Queued in operation order; the outbox writes them with one insert at commit
+    for user_id, message in notifications:
+        queue_notification(user_id, message, 'info')
+    adjust_stats(available_copies=len(returned) - len(issued),
+                 open_loans=len(issued) - len(returned))
+    db.session.commit()
+    return results
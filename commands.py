@@ -0,0 +1,184 @@
+from sweep import sweep_due_notifications
+from fines import PaymentError, accrue_fines, record_payment
+from search import ensure_search_index, rebuild_search_index
+from stats import reconcile_stats
+from covers import process_legacy_covers
+from importer import ImportFileError, import_books
+from replica import is_sqlite_file_copy, sync_replica
+from models import db
+from benchmark import (PRESETS, BenchmarkData, compare_results, current_commit, dataset_size,
+                       format_results, generate_dataset, load_results, run_http, run_in_process,
+                       run_write_benchmark, save_results, WRITE_PROFILES)
+from datetime import datetime, timezone
+import click
+import sys
+
+
+def register_commands(app):
+    """Register the maintenance commands on the `flask` CLI"""
+
+    @app.cli.command('run-scheduler')
+    def run_scheduler_command():
+        """Run the periodic jobs (sweeps, fines, cleanup) in the foreground.
+
+        Run one per deployment; the web processes do not run the jobs.
+        """
+        scheduler = app.extensions['scheduler']
+        print(f"Scheduler running {', '.join(scheduler.job_names())}. Press Ctrl+C to stop.")
+        scheduler.run_forever()
+
+    @app.cli.command('sweep-notifications')
+    def sweep_notifications_command():
+        """Create due-tomorrow and overdue notifications for all users."""
+        created = sweep_due_notifications()
+        print(f"Created {created} notifications.")
+
+    @app.cli.command('accrue-fines')
+    def accrue_fines_command():
+        """Accrue fines on all overdue loans into the fine ledger."""
+        result = accrue_fines()
+        print(f"Accrued ₹{result['amount']:g} on {result['accrued_loans']} of {result['overdue_loans']} "
+              f"overdue loans for {result['users']} users.")
+
+    @app.cli.command('record-payment')
+    @click.argument('user_id', type=int)
+    @click.argument('amount', type=float)
+    def record_payment_command(user_id, amount):
+        """Book a fine payment against a user's outstanding balance."""
+        try:
+            entries = record_payment(user_id, amount)
+        except PaymentError as error:
+            db.session.rollback()
+            print(error)
+            sys.exit(1)
+        db.session.commit()
+        print(f"Booked ₹{amount:g} against {len(entries)} loans; the balance is now ₹{entries['balance'].iloc[-1]:g}.")
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Repopulate the full-text catalog search index."""
+        if not ensure_search_index():
+            print("Full-text search is not available on this database.")
+            return
+        rebuild_search_index()
+        print("Search index rebuilt.")
+
+    @app.cli.command('reconcile-stats')
+    def reconcile_stats_command():
+        """Recompute the library statistics and report any drift."""
+        drift = reconcile_stats()
+        for name, (stored, actual) in drift.items():
+            print(f"{name}: stored {stored}, actual {actual}")
+        print(f"Statistics reconciled, {len(drift)} counters drifted.")
+
+    @app.cli.command('sync-replica')
+    def sync_replica_command():
+        """Copy the primary SQLite database onto the local replica file."""
+        if not is_sqlite_file_copy(app):
+            print("DATABASE_URL and DATABASE_REPLICA_URL must both be SQLite files.")
+            sys.exit(1)
+        sync_replica()
+        print("Replica synced.")
+
+    @app.cli.command('process-covers')
+    def process_covers_command():
+        """Convert covers uploaded before the image pipeline."""
+        converted, failed = process_legacy_covers()
+        print(f"Converted {converted} covers, {failed} failed.")
+
+    @app.cli.command('import-books')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--chunk-size', default=1000, show_default=True, help='Rows per transaction.')
+    def import_books_command(path, chunk_size):
+        """Add or update books from a .csv or .xlsx file."""
+        try:
+            result = import_books(path, lambda rows: print(f"  {rows} rows read"), chunk_size)
+        except ImportFileError as error:
+            print(error)
+            sys.exit(1)
+        for error in result['errors']:
+            print(f"Row {error['row']}: {error['error']}")
+        print(f"Imported {result['rows']} rows: {result['inserted']} added, {result['updated']} updated, "
+              f"{result['unchanged']} unchanged, {result['failed']} failed, {result['categories_created']} new categories.")
+
+    @app.cli.command('generate-data')
+    @click.option('--preset', type=click.Choice(list(PRESETS)), default='small', help='Dataset size preset.')
+    @click.option('--users', type=int, help='Override the number of students.')
+    @click.option('--books', type=int, help='Override the number of books.')
+    @click.option('--loans', type=int, help='Override the number of loan records.')
+    @click.option('--notifications', type=int, help='Override the number of notifications.')
+    @click.option('--seed', type=int, default=0, help='Random seed.')
+    def generate_data_command(preset, seed, **overrides):
+        """Bulk-insert a synthetic dataset into the configured database."""
+        sizes = dict(PRESETS[preset])
+        sizes.update({name: value for name, value in overrides.items() if value is not None})
+
+        def progress(table, inserted):
+            print(f"  {table}: {inserted}")
+
+        print(f"Generating {sizes} ...")
+        generate_dataset(seed=seed, progress=progress, **sizes)
+        print("Dataset generated.")
+
+    @app.cli.command('benchmark')
+    @click.option('--iterations', type=int, default=50, help='Requests per scenario (per thread over HTTP).')
+    @click.option('--scenario', 'names', multiple=True, help='Only run these scenarios.')
+    @click.option('--url', help='Benchmark a running server over HTTP instead of the test client.')
+    @click.option('--concurrency', type=int, default=8, help='Threads for HTTP mode.')
+    @click.option('--label', default='', help='Free-text label stored with the results.')
+    def benchmark_command(iterations, names, url, concurrency, label):
+        """Time the key routes and store the results for comparison."""
+        data = BenchmarkData()
+        if url:
+            results = run_http(url, data, iterations, concurrency, names)
+        else:
+            results = run_in_process(app, data, iterations, names)
+
+        print(format_results(results))
+        save_results(app.config['BENCHMARK_RESULTS'], {
+            'commit': current_commit(),
+            'label': label,
+            'at': datetime.now(timezone.utc).isoformat(),
+            'mode': 'http' if url else 'test_client',
+            'concurrency': concurrency if url else 1,
+            'dataset': dataset_size(),
+            'results': results
+        })
+
+    @app.cli.command('benchmark-writes')
+    @click.option('--threads', type=int, default=8, show_default=True)
+    @click.option('--operations', type=int, default=50, show_default=True, help='Requests per thread.')
+    @click.option('--profile', 'profiles', multiple=True, type=click.Choice(list(WRITE_PROFILES)),
+                  help='Only run these SQLite profiles.')
+    def benchmark_writes_command(threads, operations, profiles):
+        """Compare concurrent write throughput under the SQLite profiles."""
+        from app import create_app
+        results = run_write_benchmark(create_app, threads, operations, profiles)
+        print(format_results(results))
+        save_results(app.config['BENCHMARK_RESULTS'], {
+            'commit': current_commit(),
+            'label': 'writes',
+            'at': datetime.now(timezone.utc).isoformat(),
+            'mode': 'writes',
+            'concurrency': threads,
+            'dataset': {'threads': threads, 'operations': operations},
+            'results': results
+        })
+
+    @app.cli.command('benchmark-compare')
+    @click.option('--base', help='Commit to compare against (default: the previous run).')
+    def benchmark_compare_command(base):
+        """Compare the latest benchmark run with an earlier one."""
+        runs = load_results(app.config['BENCHMARK_RESULTS'])
+        if len(runs) < 2:
+            print("Need at least two stored benchmark runs.")
+            return
+        head = runs[-1]
+        candidates = [run for run in runs[:-1] if base is None or run['commit'] == base]
+        if not candidates:
+            print(f"No stored run for commit {base}.")
+            return
+        previous = candidates[-1]
+        print(f"{previous['commit']} -> {head['commit']}")
+        for row in compare_results(previous, head):
+            print('  '.join(f"{key}={value}" for key, value in row.items()))
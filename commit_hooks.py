@@ -0,0 +1,37 @@
+from flask import has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db
+
+
+def touch(key, ids, session=None):
+    """Record ids under session.info[key] for the current transaction"""
+    session = session or db.session()
+    session.info.setdefault(key, set()).update(ids)
+
+
+def forget_on_rollback(key):
+    """Drop session.info[key] when the transaction rolls back.
+
+    Only the outermost rollback ends the business change; a savepoint
+    rollback leaves the surrounding transaction (and its state) alive.
+    """
+    @event.listens_for(Session, 'after_soft_rollback')
+    def _forget(session, previous_transaction):
+        if previous_transaction.parent is None:
+            session.info.pop(key, None)
+
+
+def after_commit(key):
+    """Decorator: call the function with the ids `touch`ed under `key`
+    once their transaction commits (in an app context); rolled back
+    transactions forget them"""
+    def decorator(func):
+        @event.listens_for(Session, 'after_commit')
+        def _after_commit(session):
+            touched = session.info.pop(key, None)
+            if touched and has_app_context():
+                func(touched)
+        forget_on_rollback(key)
+        return func
+    return decorator
@@ -5,11 +5,30 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-change-this-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///library.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Optional read replica: GET requests read from it (see replica.py)
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    SQLALCHEMY_BINDS = {'replica': DATABASE_REPLICA_URL} if DATABASE_REPLICA_URL else {}
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS') or 10)  # primary reads after a write
+    REPLICA_SYNC_INTERVAL = int(os.environ.get('REPLICA_SYNC_INTERVAL') or 2)  # seconds, local SQLite replica copy
+    
+    # Database engine settings (see engine.py)
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'wal'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'normal'
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 10_000)  # milliseconds
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)  # bytes
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or 64 * 1024)  # KiB per connection
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)  # connections per process
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 20)  # extra connections under load
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT') or 30)  # seconds to wait for a connection
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)  # seconds
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ['true', 'on', '1']
     
     # File upload settings
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads', 'books')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    COVER_MAX_PIXELS = int(os.environ.get('COVER_MAX_PIXELS') or 40_000_000)  # width x height
+    COVER_CACHE_MAX_AGE = 365 * 24 * 3600  # seconds; cover file names change with their content
     
     # Session settings
     PERMANENT_SESSION_LIFETIME = timedelta(hours=2)
@@ -21,5 +40,55 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     
+    # Pagination settings
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE') or 50)
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE') or 500)
+    BOOKS_PER_PAGE = int(os.environ.get('BOOKS_PER_PAGE') or 24)
+    
     # Fine settings
     FINE_PER_DAY = 10  # ₹10 per day late fine
+    
+    # Circulation settings
+    CIRCULATION_BATCH_LIMIT = int(os.environ.get('CIRCULATION_BATCH_LIMIT') or 500)  # operations per request
+    
+    # Dashboard settings
+    DASHBOARD_OVERDUE_LIMIT = 10
+    DASHBOARD_FINES_LIMIT = 10  # largest fine balances listed
+    
+    # Background job settings
+    JOB_FOLDER = os.environ.get('JOB_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'jobs')
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS') or 2)
+    JOB_RETENTION_HOURS = int(os.environ.get('JOB_RETENTION_HOURS') or 24)
+    JOB_TIMEOUT_HOURS = int(os.environ.get('JOB_TIMEOUT_HOURS') or 6)  # unfinished jobs then count as failed
+    JOB_CLEANUP_INTERVAL = 3600  # seconds
+    STATS_RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL') or 3600)  # seconds
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() in ['true', 'on', '1']
+    NOTIFICATION_SWEEP_INTERVAL = int(os.environ.get('NOTIFICATION_SWEEP_INTERVAL') or 900)  # seconds
+    FINE_ACCRUAL_INTERVAL = int(os.environ.get('FINE_ACCRUAL_INTERVAL') or 24 * 3600)  # seconds
+    
+    # Unread notification count cache (per process)
+    UNREAD_COUNT_CACHE_TTL = int(os.environ.get('UNREAD_COUNT_CACHE_TTL') or 30)  # seconds
+    UNREAD_COUNT_CACHE_SIZE = int(os.environ.get('UNREAD_COUNT_CACHE_SIZE') or 100_000)  # users
+    
+    # Logged-in user cache (see identity.py)
+    IDENTITY_CACHE_STORE = os.environ.get('IDENTITY_CACHE_STORE') or 'memory'  # memory, file (shared by processes) or none
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL') or 300)  # seconds
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE') or 10_000)  # users, memory store
+    IDENTITY_CACHE_FOLDER = os.environ.get('IDENTITY_CACHE_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'identity')
+    
+    # Notification push stream (Server-Sent Events)
+    PUSH_BROKER = os.environ.get('PUSH_BROKER') or 'memory'  # memory (one process) or database (several)
+    PUSH_POLL_INTERVAL = int(os.environ.get('PUSH_POLL_INTERVAL') or 2)  # seconds, database broker
+    PUSH_HEARTBEAT = int(os.environ.get('PUSH_HEARTBEAT') or 15)  # seconds
+    PUSH_STREAM_MAX_SECONDS = int(os.environ.get('PUSH_STREAM_MAX_SECONDS') or 300)  # then the browser reconnects
+    PUSH_MAX_STREAMS = int(os.environ.get('PUSH_MAX_STREAMS') or 500)  # open streams per process
+    PUSH_MAX_STREAMS_PER_USER = int(os.environ.get('PUSH_MAX_STREAMS_PER_USER') or 5)
+    
+    # SQL profiler settings (opt-in)
+    SQL_PROFILER_ENABLED = os.environ.get('SQL_PROFILER_ENABLED', 'false').lower() in ['true', 'on', '1']
+    SQL_PROFILER_BUFFER_SIZE = int(os.environ.get('SQL_PROFILER_BUFFER_SIZE') or 1000)  # requests kept
+    SQL_PROFILER_TOP_STATEMENTS = 5
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS') or 500)
+    
+    # Benchmark settings
+    BENCHMARK_RESULTS = os.environ.get('BENCHMARK_RESULTS') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'benchmarks.jsonl')
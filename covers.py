@@ -0,0 +1,278 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import uuid
+from flask import current_app, request, url_for
+from PIL import Image, ImageOps, UnidentifiedImageError
+from commit_hooks import after_commit, touch
+from models import db, Book
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the encoding below changes, so re-encoded files get new
+# names and browsers holding the old ones (cached as immutable) refetch
+PIPELINE_VERSION = 1
+
+# variant -> (width, height, crop). Thumbnails are cropped to a fixed card
+# size; the full variant only bounds the longest sides.
+COVER_VARIANTS = {
+    'thumb': (240, 360, True),
+    'full': (1200, 1800, False),
+}
+
+# file extension -> (Pillow format, save options)
+COVER_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+# Formats accepted as uploads, checked against the decoded header rather
+# than the file name
+UPLOAD_FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+
+# session.info key: covers whose files go once the transaction commits
+RELEASED_COVERS_KEY = 'released_covers'
+
+COVER_KEY = re.compile(r'^[0-9a-f]{24}$')
+COVER_FILENAME = re.compile(r'^(?P<key>[0-9a-f]{24})-(?P<variant>[a-z]+)\.(?P<ext>[a-z]+)$')
+
+
+class InvalidCover(ValueError):
+    """The upload is not an image the pipeline accepts"""
+
+
+def cover_key(data):
+    """Content hash naming every stored variant of a cover"""
+    digest = hashlib.sha256(f'v{PIPELINE_VERSION}:'.encode())
+    digest.update(data)
+    return digest.hexdigest()[:24]
+
+
+def cover_filename(key, variant, ext):
+    return f'{key}-{variant}.{ext}'
+
+
+def is_processed_cover(cover_photo):
+    """False for covers uploaded before the pipeline (stored verbatim)"""
+    return bool(cover_photo and COVER_KEY.match(cover_photo))
+
+
+def check_upload(stream):
+    """Validate an uploaded cover from its header without decoding it.
+
+    Raises InvalidCover when the data is not a supported image or has more
+    pixels than COVER_MAX_PIXELS. Leaves the stream at the start.
+    """
+    try:
+        with Image.open(stream) as image:
+            image_format = image.format
+            width, height = image.size
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise InvalidCover('The cover photo is not a valid image.')
+    finally:
+        stream.seek(0)
+
+    if image_format not in UPLOAD_FORMATS:
+        raise InvalidCover(f'{image_format} images are not supported for cover photos.')
+    if width * height > current_app.config['COVER_MAX_PIXELS']:
+        raise InvalidCover('The cover photo is too large.')
+
+
+def _flatten(image, ext):
+    # JPEG has no alpha channel: composite transparent covers onto white
+    if ext == 'jpg' and image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+
+def render_variants(data, max_pixels):
+    """Decode an upload and encode every variant.
+
+    Returns {filename suffix (variant, ext): encoded bytes}. Metadata is
+    dropped and EXIF orientation applied; animated images keep their
+    first frame.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            if source.format not in UPLOAD_FORMATS:
+                raise InvalidCover(f'{source.format} images are not supported for cover photos.')
+            if source.width * source.height > max_pixels:
+                raise InvalidCover('The cover photo is too large.')
+            image = ImageOps.exif_transpose(source)
+            image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as error:
+        raise InvalidCover(f'The cover photo could not be decoded: {error}')
+
+    variants = {}
+    for variant, (width, height, crop) in COVER_VARIANTS.items():
+        if crop:
+            resized = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((width, height), Image.Resampling.LANCZOS)
+        for ext, (image_format, options) in COVER_FORMATS.items():
+            output = io.BytesIO()
+            _flatten(resized, ext).save(output, image_format, **options)
+            variants[(variant, ext)] = output.getvalue()
+    return variants
+
+
+def store_cover(data, folder, max_pixels):
+    """Process an upload into content-addressed files under `folder`.
+
+    Returns (key, bytes written per file). Identical uploads map to the same
+    key, so re-uploading a cover reuses the stored files.
+    """
+    key = cover_key(data)
+    os.makedirs(folder, exist_ok=True)
+    sizes = {}
+    for (variant, ext), encoded in render_variants(data, max_pixels).items():
+        filename = cover_filename(key, variant, ext)
+        path = os.path.join(folder, filename)
+        sizes[filename] = len(encoded)
+        if os.path.exists(path):
+            continue
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(encoded)
+        os.replace(temp_path, path)
+    return key, sizes
+
+
+def cover_in_use(cover_photo, exclude_book_id=None):
+    in_use = db.session.query(Book.id).filter(Book.cover_photo == cover_photo)
+    if exclude_book_id is not None:
+        in_use = in_use.filter(Book.id != exclude_book_id)
+    return in_use.first() is not None
+
+
+def remove_cover_files(cover_photo, folder):
+    if is_processed_cover(cover_photo):
+        names = [cover_filename(cover_photo, variant, ext)
+                 for variant in COVER_VARIANTS for ext in COVER_FORMATS]
+    else:
+        names = [os.path.basename(cover_photo)]
+    for name in names:
+        try:
+            os.remove(os.path.join(folder, name))
+        except FileNotFoundError:
+            pass
+
+
+def delete_cover(cover_photo, folder, exclude_book_id=None):
+    """Remove a cover's files unless another book still uses them"""
+    if cover_photo and not cover_in_use(cover_photo, exclude_book_id):
+        remove_cover_files(cover_photo, folder)
+
+
+def release_cover(book):
+    """Remove the cover files of a book being deleted once the current
+    transaction commits, unless another book still uses them. A rollback
+    keeps them, so the book never points at missing files."""
+    if book.cover_photo and not cover_in_use(book.cover_photo, exclude_book_id=book.id):
+        touch(RELEASED_COVERS_KEY, [book.cover_photo])
+
+
+@after_commit(RELEASED_COVERS_KEY)
+def _remove_released_covers(cover_photos):
+    folder = current_app.config['UPLOAD_FOLDER']
+    for cover_photo in cover_photos:
+        remove_cover_files(cover_photo, folder)
+
+
+def stage_upload(file, folder):
+    """Save an upload for the pipeline and return its path"""
+    incoming = os.path.join(folder, 'incoming')
+    os.makedirs(incoming, exist_ok=True)
+    path = os.path.join(incoming, uuid.uuid4().hex)
+    file.save(path)
+    return path
+
+
+def process_cover_job(job_id, progress, book_id, upload_path):
+    """Background job: turn a staged upload into the book's cover"""
+    folder = current_app.config['UPLOAD_FOLDER']
+    try:
+        with open(upload_path, 'rb') as file:
+            data = file.read()
+        key, sizes = store_cover(data, folder, current_app.config['COVER_MAX_PIXELS'])
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
+    book = db.session.get(Book, book_id)
+    if book is None:
+        # Book deleted while its cover was processed
+        delete_cover(key, folder)
+        return {'book_id': book_id, 'cover': None, 'files': {}}
+
+    previous = book.cover_photo
+    book.cover_photo = key
+    db.session.commit()
+    if previous != key:
+        delete_cover(previous, folder)
+    progress(1, 1)
+    return {'book_id': book_id, 'cover': key, 'source_bytes': len(data), 'files': sizes}
+
+
+def submit_cover(book, file, created_by=None):
+    """Stage an uploaded cover (already passed `check_upload`) and queue it
+    for processing; the book keeps its current cover until the job is done"""
+    upload_path = stage_upload(file, current_app.config['UPLOAD_FOLDER'])
+    return current_app.extensions['jobs'].submit('cover', process_cover_job, {
+        'book_id': book.id,
+        'upload_path': upload_path
+    }, created_by=created_by)
+
+
+def _prefers_webp():
+    return request.accept_mimetypes['image/webp'] > 0
+
+
+def cover_url(book, variant='thumb', ext=None):
+    """URL of a book's cover variant for templates, or None without a cover.
+
+    `ext` defaults to WebP for clients that accept it and JPEG otherwise.
+    Covers stored before the pipeline are served as they were uploaded.
+    """
+    cover_photo = book.cover_photo
+    if not cover_photo:
+        return None
+    if not is_processed_cover(cover_photo):
+        return url_for('static', filename=f'uploads/books/{cover_photo}')
+    if ext is None:
+        ext = 'webp' if _prefers_webp() else 'jpg'
+    return url_for('main.cover_image', filename=cover_filename(cover_photo, variant, ext))
+
+
+def process_legacy_covers():
+    """Run every cover stored before the pipeline through it.
+
+    Returns (converted, failed) counts. Originals are removed once their
+    book points at the processed cover.
+    """
+    folder = current_app.config['UPLOAD_FOLDER']
+    converted = failed = 0
+    books = Book.query.filter(Book.cover_photo.isnot(None)).all()
+    for book in books:
+        if is_processed_cover(book.cover_photo):
+            continue
+        path = os.path.join(folder, os.path.basename(book.cover_photo))
+        try:
+            with open(path, 'rb') as file:
+                key, _ = store_cover(file.read(), folder, current_app.config['COVER_MAX_PIXELS'])
+        except (OSError, InvalidCover) as error:
+            logger.warning('Cover %s of book %s not converted: %s', book.cover_photo, book.id, error)
+            failed += 1
+            continue
+        previous = book.cover_photo
+        book.cover_photo = key
+        db.session.commit()
+        delete_cover(previous, folder)
+        converted += 1
+    return converted, failed
@@ -0,0 +1,120 @@
+from datetime import date, datetime, timezone
+from models import db, User, Book, IssuedBook, Notification, Category, FineLedgerEntry, count_rows
+from export import sheet_statement
+from pagination import paginate_keyset
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# table name -> (description, sortable columns). Only NOT NULL columns are
+# sortable so every row has a well-defined keyset position.
+BROWSER_TABLES = {
+    'users': ('User accounts (visitors and admins)',
+              ['id', 'name', 'email', 'role']),
+    'books': ('Book inventory and details',
+              ['id', 'title', 'author', 'category', 'total_copies', 'available_copies']),
+    'issued_books': ('Book issue and return records',
+                     ['id', 'user_id', 'book_id', 'due_date']),
+    'notifications': ('User notifications and alerts',
+                      ['id', 'user_id']),
+    'categories': ('Book categories and classifications',
+                   ['id', 'name', 'book_count']),
+    'fine_ledger': ('Accrued fines with running balances per user',
+                    ['id', 'user_id', 'loan_id', 'balance']),
+}
+
+
+def database_overview():
+    """Per-table record counts and library statistics in one round trip"""
+    now = datetime.now(timezone.utc)
+    row = db.session.query(
+        count_rows(User).label('users'),
+        count_rows(Book).label('books'),
+        count_rows(IssuedBook).label('issued_books'),
+        count_rows(Notification).label('notifications'),
+        count_rows(Category).label('categories'),
+        count_rows(FineLedgerEntry).label('fine_ledger'),
+        count_rows(User, User.role == 'student').label('active_visitors'),
+        count_rows(User, User.role == 'admin').label('admin_users'),
+        count_rows(IssuedBook, IssuedBook.return_date.is_(None)).label('books_issued'),
+        count_rows(IssuedBook, IssuedBook.return_date.isnot(None)).label('books_returned'),
+        count_rows(Notification, Notification.is_read.is_(False)).label('unread_notifications'),
+        count_rows(IssuedBook, IssuedBook.is_overdue(now)).label('overdue_books')
+    ).one()
+
+    tables_info = []
+    for name, (description, sortable) in BROWSER_TABLES.items():
+        statement = sheet_statement(name)
+        tables_info.append({
+            'name': name,
+            'description': description,
+            'record_count': getattr(row, name),
+            'columns': [column.name for column in statement.selected_columns],
+            'sortable': sortable
+        })
+
+    db_stats = {
+        'total_records': sum(table['record_count'] for table in tables_info),
+        'active_visitors': row.active_visitors,
+        'admin_users': row.admin_users,
+        'total_books': row.books,
+        'books_issued': row.books_issued,
+        'books_returned': row.books_returned,
+        'unread_notifications': row.unread_notifications,
+        'overdue_books': row.overdue_books
+    }
+    return tables_info, db_stats
+
+
+def _display(column, value):
+    if value is None:
+        return 'Not Returned' if column == 'return_date' else 'N/A'
+    if isinstance(value, (datetime, date)):
+        return value.strftime(DATE_FORMAT)
+    if column in ('amount', 'loan_total', 'balance'):
+        return f'₹{value}'  # ledger amounts can be negative corrections
+    if column in ('fine', 'fine_balance'):
+        return f'₹{value}' if value > 0 else '₹0'
+    if column == 'is_read':
+        return 'Yes' if value else 'No'
+    return value
+
+
+def browse_table(name, sort='id', descending=False, filters=None, cursor=None, per_page=None):
+    """Fetch one page of a table for the admin database viewer.
+
+    Display names (user, book title, book category) are joined in
+    SQL. `filters` maps column names to values: text columns match by
+    substring, others by equality. Unknown columns raise ValueError.
+    """
+    statement = sheet_statement(name)
+    columns = statement.selected_columns
+    sortable = BROWSER_TABLES[name][1]
+
+    if sort not in sortable:
+        raise ValueError(f'Cannot sort {name} by {sort}')
+
+    for column_name, value in (filters or {}).items():
+        if column_name not in columns:
+            raise ValueError(f'Unknown column {column_name}')
+        column = columns[column_name]
+        if isinstance(column.type, (db.String, db.Text)):
+            statement = statement.where(column.contains(value))
+        elif isinstance(column.type, db.Boolean):
+            statement = statement.where(column.is_(value.lower() in ['yes', 'true', '1']))
+        else:
+            try:
+                statement = statement.where(column == column.type.python_type(value))
+            except (NotImplementedError, TypeError, ValueError):
+                raise ValueError(f'Invalid value for {column_name}')
+
+    sort_keys = [(columns[sort], descending)]
+    if sort != 'id':
+        sort_keys.append((columns['id'], descending))
+
+    page = paginate_keyset(statement, sort_keys, cursor, per_page)
+    names = [column.name for column in columns]
+    page.items = [
+        {column: _display(column, value) for column, value in zip(names, row)}
+        for row in page.items
+    ]
+    return page
@@ -0,0 +1,79 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from models import db
+
+SQLITE_JOURNAL_MODES = {'delete', 'truncate', 'persist', 'memory', 'wal', 'off'}
+SQLITE_SYNCHRONOUS = {'off', 'normal', 'full', 'extra'}
+
+
+def _option(app, name, allowed):
+    value = str(app.config[name]).lower()
+    if value not in allowed:
+        raise ValueError(f"Unknown {name} {value!r}; expected one of {', '.join(sorted(allowed))}")
+    return value
+
+
+def sqlite_pragmas(app):
+    """PRAGMA statements run on every new SQLite connection"""
+    return [
+        f"PRAGMA journal_mode={_option(app, 'SQLITE_JOURNAL_MODE', SQLITE_JOURNAL_MODES)}",
+        f"PRAGMA synchronous={_option(app, 'SQLITE_SYNCHRONOUS', SQLITE_SYNCHRONOUS)}",
+        f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}",
+        # Negative cache_size is in KiB rather than pages
+        f"PRAGMA cache_size={-int(app.config['SQLITE_CACHE_SIZE'])}",
+    ]
+
+
+def pool_options(app):
+    """Connection pool settings for server databases (PostgreSQL, MySQL)"""
+    return {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+    }
+
+
+def configure_engine(app):
+    """Fill in SQLALCHEMY_ENGINE_OPTIONS for the configured database.
+
+    Call before db.init_app. Server databases get the DB_POOL_* settings;
+    options set explicitly in SQLALCHEMY_ENGINE_OPTIONS win. SQLite keeps
+    SQLAlchemy's pool and is tuned per connection by `apply_sqlite_pragmas`.
+    """
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        sqlite_pragmas(app)  # reject bad settings at startup
+        return
+    options = pool_options(app)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def apply_sqlite_pragmas(app):
+    """Run the SQLite profile on each connection the app's engine opens.
+
+    WAL lets readers run alongside the single writer and, with
+    synchronous=NORMAL, commits no longer wait for an fsync (the WAL is
+    synced at checkpoints; a power loss may drop the last commits but
+    never corrupts the file). busy_timeout makes a writer wait for the
+    lock instead of failing with "database is locked". Call inside an app
+    context after db.init_app.
+    """
+    engines = [engine for engine in db.engines.values() if engine.dialect.name == 'sqlite']
+    if not engines:
+        return
+    pragmas = sqlite_pragmas(app)
+
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    for engine in engines:  # primary and replica
+        event.listen(engine, 'connect', _set_pragmas)
@@ -0,0 +1,216 @@
+import os
+import tempfile
+import xlsxwriter
+from datetime import date, datetime, time, timedelta
+from flask import current_app, send_file
+from models import db, User, Book, IssuedBook, Notification, Category, FineLedgerEntry
+
+# Rows fetched from the database per round trip while streaming
+EXPORT_BATCH_SIZE = 1000
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _format_date(value, default='N/A'):
+    return value.strftime(DATE_FORMAT) if value else default
+
+
+def _stream(statement):
+    return db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+
+def _users_statement():
+    return db.select(
+        User.id, User.name, User.email, User.mobile, User.role,
+        User.membership_type, User.membership_expiry, User.created_at, User.fine_balance
+    ).order_by(User.id)
+
+
+def _users_row(row):
+    return [row.id, row.name, row.email, row.mobile or 'N/A', row.role, row.membership_type,
+            _format_date(row.membership_expiry), _format_date(row.created_at), row.fine_balance]
+
+
+def _books_statement():
+    return db.select(
+        Book.id, Book.title, Book.author, Category.name.label('category'), Book.total_copies,
+        Book.available_copies, Book.cover_photo, Book.created_at
+    ).join(Category, Book.category_id == Category.id).order_by(Book.id)
+
+
+def _books_row(row):
+    return [row.id, row.title, row.author, row.category, row.total_copies, row.available_copies,
+            row.cover_photo or 'N/A', _format_date(row.created_at)]
+
+
+def _issued_books_statement():
+    return db.select(
+        IssuedBook.id, IssuedBook.user_id, User.name.label('user_name'), IssuedBook.book_id,
+        Book.title.label('book_title'), IssuedBook.issue_date, IssuedBook.due_date,
+        IssuedBook.return_date, IssuedBook.fine
+    ).outerjoin(User, IssuedBook.user_id == User.id).outerjoin(
+        Book, IssuedBook.book_id == Book.id
+    ).order_by(IssuedBook.id)
+
+
+def _issued_books_row(row):
+    return [row.id, row.user_id, row.user_name, row.book_id, row.book_title,
+            _format_date(row.issue_date), _format_date(row.due_date),
+            _format_date(row.return_date, 'Not Returned'), row.fine]
+
+
+def _notifications_statement():
+    return db.select(
+        Notification.id, Notification.user_id, User.name.label('user_name'), Notification.message,
+        Notification.notification_type, Notification.is_read, Notification.created_at
+    ).outerjoin(User, Notification.user_id == User.id).order_by(Notification.id)
+
+
+def _notifications_row(row):
+    return [row.id, row.user_id, row.user_name, row.message, row.notification_type,
+            'Yes' if row.is_read else 'No', _format_date(row.created_at)]
+
+
+def _fine_ledger_statement():
+    return db.select(
+        FineLedgerEntry.id, FineLedgerEntry.user_id, User.name.label('user_name'), FineLedgerEntry.loan_id,
+        FineLedgerEntry.kind, FineLedgerEntry.amount, FineLedgerEntry.loan_total, FineLedgerEntry.balance,
+        FineLedgerEntry.accrued_on, FineLedgerEntry.created_at
+    ).outerjoin(User, FineLedgerEntry.user_id == User.id).order_by(FineLedgerEntry.id)
+
+
+def _fine_ledger_row(row):
+    return [row.id, row.user_id, row.user_name, row.loan_id, row.kind, row.amount, row.loan_total,
+            row.balance, row.accrued_on.isoformat(), _format_date(row.created_at)]
+
+
+def _categories_statement():
+    return db.select(
+        Category.id, Category.name, Category.created_at, Category.book_count
+    ).order_by(Category.id)
+
+
+def _categories_row(row):
+    return [row.id, row.name, _format_date(row.created_at), row.book_count]
+
+
+# table name -> (sheet title, headers, statement, row formatter, date column)
+EXPORT_SHEETS = {
+    'users': ('Users', ['ID', 'Name', 'Email', 'Mobile', 'Role', 'Membership Type', 'Membership Expiry', 'Created At', 'Fine Balance'],
+              _users_statement, _users_row, User.created_at),
+    'books': ('Books', ['ID', 'Title', 'Author', 'Category', 'Total Copies', 'Available Copies', 'Cover Photo', 'Created At'],
+              _books_statement, _books_row, Book.created_at),
+    'issued_books': ('Issued Books', ['ID', 'User ID', 'User Name', 'Book ID', 'Book Title', 'Issue Date', 'Due Date', 'Return Date', 'Fine'],
+                     _issued_books_statement, _issued_books_row, IssuedBook.issue_date),
+    'notifications': ('Notifications', ['ID', 'User ID', 'User Name', 'Message', 'Type', 'Is Read', 'Created At'],
+                      _notifications_statement, _notifications_row, Notification.created_at),
+    'categories': ('Categories', ['ID', 'Name', 'Created At', 'Books Count'],
+                   _categories_statement, _categories_row, Category.created_at),
+    'fine_ledger': ('Fine Ledger', ['ID', 'User ID', 'User Name', 'Loan ID', 'Kind', 'Amount', 'Loan Total', 'Balance', 'Accrued On', 'Created At'],
+                    _fine_ledger_statement, _fine_ledger_row, FineLedgerEntry.created_at),
+}
+
+
+def sheet_statement(table, start_date=None, end_date=None):
+    """Select for one export sheet, with display names joined in"""
+    _, _, statement, _, date_column = EXPORT_SHEETS[table]
+    statement = statement()
+    if start_date:
+        statement = statement.where(date_column >= datetime.combine(start_date, time.min))
+    if end_date:
+        # end_date is inclusive
+        statement = statement.where(date_column < datetime.combine(end_date + timedelta(days=1), time.min))
+    return statement
+
+
+def count_export_rows(tables=None, start_date=None, end_date=None):
+    total = 0
+    for table in tables or EXPORT_SHEETS:
+        statement = sheet_statement(table, start_date, end_date).order_by(None)
+        total += db.session.execute(
+            db.select(db.func.count()).select_from(statement.subquery())
+        ).scalar()
+    return total
+
+
+def write_database_export(path, tables=None, start_date=None, end_date=None, progress=None):
+    """Write the selected tables (all by default) to an .xlsx file at `path`.
+
+    `start_date`/`end_date` limit each table to rows created (issued, for
+    loans) in that inclusive range. Rows are streamed from the database in
+    batches and written with xlsxwriter's constant_memory mode, which
+    flushes each row to a temp file as soon as it is complete, so memory use
+    does not grow with table size. `progress(rows_written)` is called after
+    every batch.
+    """
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True,
+        'tmpdir': os.path.dirname(path) or None
+    })
+    written = 0
+    try:
+        for table in tables or EXPORT_SHEETS:
+            title, headers, _, format_row, _ = EXPORT_SHEETS[table]
+            worksheet = workbook.add_worksheet(title)
+            worksheet.write_row(0, 0, headers)
+            for row_number, row in enumerate(_stream(sheet_statement(table, start_date, end_date)), 1):
+                worksheet.write_row(row_number, 0, format_row(row))
+                written += 1
+                if progress and written % EXPORT_BATCH_SIZE == 0:
+                    progress(written)
+    finally:
+        workbook.close()
+    if progress:
+        progress(written)
+    return path
+
+
+def create_export_file(tables=None):
+    """Export to a new temp file and return its path; the caller removes it"""
+    handle, path = tempfile.mkstemp(prefix='library_export_', suffix='.xlsx')
+    os.close(handle)
+    try:
+        return write_database_export(path, tables)
+    except Exception:
+        os.remove(path)
+        raise
+
+
+def send_export_file(path, download_name):
+    """Response streaming the temp export at `path`, which is deleted when
+    the server closes the response, whether or not the body was sent"""
+    try:
+        response = send_file(
+            path,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=download_name
+        )
+    except Exception:
+        os.remove(path)
+        raise
+    # A passthrough body is handed to the server as is, skipping the
+    # response's close callbacks
+    response.direct_passthrough = False
+    response.call_on_close(lambda: remove_export_file(path))
+    return response
+
+
+def remove_export_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def export_job(job_id, progress, tables=None, start_date=None, end_date=None):
+    """Background job body: export to a file owned by the job"""
+    start_date = date.fromisoformat(start_date) if start_date else None
+    end_date = date.fromisoformat(end_date) if end_date else None
+    runner = current_app.extensions['jobs']
+    path = runner.file_path(job_id, '.xlsx')
+
+    total = count_export_rows(tables, start_date, end_date)
+    progress(0, total)
+    write_database_export(path, tables, start_date, end_date, lambda written: progress(written, total))
+    return {'file': os.path.basename(path), 'rows': total}
@@ -0,0 +1,254 @@
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from flask import current_app
+from sqlalchemy import Column, Float, Integer, MetaData, Table
+from models import db, User, IssuedBook, FineLedgerEntry, chunked
+
+LEDGER_COLUMNS = ['loan_id', 'user_id', 'amount', 'loan_total']
+
+
+def _frame(statement, columns):
+    """Bulk-fetch a select into a DataFrame in one round trip"""
+    return pd.DataFrame.from_records(db.session.execute(statement).all(), columns=columns)
+
+
+def _utc(series):
+    # Loaded datetimes are aware UTC (UTCDateTime); normalize the dtype
+    return pd.to_datetime(series, utc=True)
+
+
+def overdue_frame(now):
+    """Every open overdue loan with the fine already accrued on it"""
+    return _frame(db.select(
+        IssuedBook.id, IssuedBook.user_id, IssuedBook.due_date, IssuedBook.fine
+    ).where(
+        IssuedBook.return_date.is_(None), IssuedBook.due_date < now
+    ), ['loan_id', 'user_id', 'due_date', 'fine'])
+
+
+def accrued_fines(loans, now, fine_per_day):
+    """Column-wise fines for a frame of loans (loan_id, user_id, due_date,
+    fine): whole days overdue times the daily rate, with the increase over
+    what was already accrued (`accrued`). Only loans whose fine grew are
+    returned."""
+    days = (pd.Timestamp(now).tz_convert('UTC') - _utc(loans['due_date'])) // pd.Timedelta(days=1)
+    loan_total = np.maximum(days.to_numpy(dtype='int64'), 0) * float(fine_per_day)
+    already = loans['fine'].fillna(0.0).to_numpy(dtype='float64')
+    accrued = pd.DataFrame({
+        'loan_id': loans['loan_id'].to_numpy(),
+        'user_id': loans['user_id'].to_numpy(),
+        'loan_total': loan_total,
+        'amount': loan_total - already,
+        'accrued': already,
+    })
+    return accrued[accrued['amount'] > 0]
+
+
+def _balances(user_ids):
+    balances = {}
+    for chunk in chunked(user_ids):
+        balances.update(db.session.query(User.id, User.fine_balance).filter(User.id.in_(chunk)))
+    return pd.Series(balances, dtype='float64')
+
+
+def _staged_accruals():
+    """Temporary table the claimed (loan_id, accrued, loan_total) rows are
+    staged in; kept off db.metadata so create_all never sees it.
+    PostgreSQL drops it when the transaction ends, however it ends."""
+    return Table(
+        'staged_accruals', MetaData(),
+        Column('loan_id', Integer, primary_key=True),
+        Column('accrued', Float, nullable=False),
+        Column('loan_total', Float, nullable=False),
+        prefixes=['TEMPORARY'],
+        postgresql_on_commit='DROP'
+    )
+
+
+def claim_accruals(entries):
+    """Set each loan's fine to its new total, but only while the loan is
+    still open and still carries the fine the pass read.
+
+    Another process's accrual pass, or a return, may have changed the loan
+    since; those loans are skipped so nothing is booked twice. The frame is
+    staged into a temporary table with one executemany, then a single
+    UPDATE ... FROM matches every loan against it and RETURNING names the
+    loans that were claimed. Returns the entries for those loans.
+    """
+    if entries.empty:
+        return entries
+    loans = IssuedBook.__table__
+    staged = _staged_accruals()
+    connection = db.session.connection()
+    # Errors propagate as they are: dropping in a `finally` would fail in an
+    # aborted PostgreSQL transaction and hide them. Elsewhere the table is
+    # dropped on success; one left behind by a failed pass is emptied here.
+    staged.create(connection, checkfirst=True)
+    connection.execute(db.delete(staged))
+    connection.execute(db.insert(staged), [
+        {'loan_id': loan_id, 'accrued': accrued, 'loan_total': total}
+        for loan_id, accrued, total in zip(entries['loan_id'].tolist(), entries['accrued'].tolist(),
+                                           entries['loan_total'].tolist())
+    ])
+    claimed = connection.execute(db.update(loans).where(
+        loans.c.id == staged.c.loan_id,
+        loans.c.return_date.is_(None),
+        db.func.coalesce(loans.c.fine, 0.0) == staged.c.accrued
+    ).values(fine=staged.c.loan_total).returning(loans.c.id)).scalars().all()
+    if connection.dialect.name != 'postgresql':
+        staged.drop(connection)
+    return entries[entries['loan_id'].isin(claimed)]
+
+
+def post_fines(entries, kind, now):
+    """Append ledger entries for a frame of (loan_id, user_id, amount,
+    loan_total) in the current transaction.
+
+    Each user's running balance is their stored balance plus the cumulative
+    sum of their entries in loan order. Writes are two executemany
+    statements: ledger rows and per-user balance increments; the loans'
+    fines are the caller's (claim_accruals, the return itself). Returns the
+    entries with their `balance` column.
+    """
+    if entries.empty:
+        return entries.assign(balance=pd.Series(dtype='float64'))
+    entries = entries[LEDGER_COLUMNS].sort_values(['user_id', 'loan_id'], kind='stable')
+    user_ids = [int(user_id) for user_id in entries['user_id'].unique()]
+    start = entries['user_id'].map(_balances(user_ids)).fillna(0.0)
+    entries = entries.assign(balance=start + entries.groupby('user_id')['amount'].cumsum())
+
+    # .tolist() hands the driver Python ints and floats, not NumPy scalars
+    columns = {name: entries[name].tolist() for name in LEDGER_COLUMNS + ['balance']}
+    accrued_on = now.date()
+    db.session.connection().execute(db.insert(FineLedgerEntry.__table__), [{
+        'loan_id': loan_id, 'user_id': user_id, 'kind': kind, 'amount': amount,
+        'loan_total': loan_total, 'balance': balance, 'accrued_on': accrued_on, 'created_at': now
+    } for loan_id, user_id, amount, loan_total, balance in zip(*columns.values())])
+
+    users = User.__table__
+    totals = entries.groupby('user_id')['amount'].sum()
+    db.session.connection().execute(
+        db.update(users).where(users.c.id == db.bindparam('user')).values(
+            fine_balance=users.c.fine_balance + db.bindparam('increase')
+        ),
+        [{'user': user_id, 'increase': increase}
+         for user_id, increase in zip(totals.index.tolist(), totals.tolist())]
+    )
+    return entries
+
+
+def _booked(loan_ids):
+    """The fines the ledger has booked so far on each of the loans
+    (payments against them not deducted)"""
+    booked = {}
+    for chunk in chunked(loan_ids):
+        booked.update(db.session.query(FineLedgerEntry.loan_id, db.func.sum(FineLedgerEntry.amount)).filter(
+            FineLedgerEntry.loan_id.in_(chunk), FineLedgerEntry.kind != FineLedgerEntry.KIND_PAYMENT
+        ).group_by(FineLedgerEntry.loan_id))
+    return booked
+
+
+def post_return_fines(returns, now):
+    """Book the difference between returned loans' final fines and what the
+    ledger has booked on them.
+
+    `returns` is a list of (loan_id, user_id, final fine), called after the
+    loans were closed, which sets their fine column. Reading the ledger then
+    rather than the fine seen before the return means an accrual committed
+    in between is not counted twice (and a later one skips the closed
+    loan). The entry is usually the part of a day the nightly pass has not
+    reached yet, and negative if the final fine came out lower.
+    """
+    booked = _booked([loan_id for loan_id, _, _ in returns])
+    entries = pd.DataFrame.from_records(
+        [(loan_id, user_id, final - booked.get(loan_id, 0.0), final) for loan_id, user_id, final in returns],
+        columns=LEDGER_COLUMNS
+    )
+    post_fines(entries[entries['amount'] != 0], FineLedgerEntry.KIND_RETURN, now)
+
+
+def accrue_fines(now=None):
+    """Nightly pass: accrue fines on every open overdue loan at once.
+
+    Loans are fetched into one frame, fines computed column-wise and only
+    loans whose fine grew since the last pass are written, so re-running
+    the same day writes nothing. If passes overlap (the scheduler and a
+    manual `flask accrue-fines`), claim_accruals lets only one book a loan.
+    Returns a summary dict.
+    """
+    now = now or datetime.now(timezone.utc)
+    loans = overdue_frame(now)
+    entries = claim_accruals(accrued_fines(loans, now, current_app.config['FINE_PER_DAY']))
+    posted = post_fines(entries, FineLedgerEntry.KIND_ACCRUAL, now)
+    db.session.commit()
+    return {
+        'overdue_loans': len(loans),
+        'accrued_loans': len(posted),
+        'users': int(posted['user_id'].nunique()),
+        'amount': float(posted['amount'].sum())
+    }
+
+
+def open_fine_ledger():
+    """Opening entries for fines recorded before the ledger existed, so
+    balances start from every loan's stored fine"""
+    now = datetime.now(timezone.utc)
+    loans = _frame(db.select(IssuedBook.id, IssuedBook.user_id, IssuedBook.fine).where(
+        IssuedBook.fine > 0,
+        IssuedBook.id.notin_(db.select(FineLedgerEntry.loan_id))
+    ), ['loan_id', 'user_id', 'fine'])
+    entries = loans.assign(amount=loans['fine'], loan_total=loans['fine'])
+    post_fines(entries, FineLedgerEntry.KIND_OPENING, now)
+    db.session.commit()
+    return len(entries)
+
+
+class PaymentError(ValueError):
+    """A payment that cannot be booked (not positive, or more than is owed)"""
+
+
+def record_payment(user_id, amount, now=None):
+    """Book a fine payment in the current transaction; the caller commits.
+
+    The payment settles the user's loans oldest first: one `payment` entry
+    per loan with a negative amount, so a loan's entries still sum to what
+    is owed on it and the running balance comes down. The user's row is
+    locked (and the balance checked) with one conditional UPDATE first, so
+    two desks cannot take the same fine twice. Raises PaymentError if the
+    amount is not positive or exceeds the balance. Returns the entries.
+    """
+    now = now or datetime.now(timezone.utc)
+    amount = round(float(amount), 2)
+    if not amount > 0:
+        raise PaymentError('The payment must be a positive amount.')
+    users = User.__table__
+    locked = db.session.connection().execute(
+        db.update(users).where(users.c.id == user_id, users.c.fine_balance >= amount).values(
+            fine_balance=users.c.fine_balance
+        )
+    ).rowcount
+    owed = _frame(db.select(
+        FineLedgerEntry.loan_id, db.func.sum(FineLedgerEntry.amount), db.func.coalesce(IssuedBook.fine, 0.0)
+    ).join(IssuedBook, IssuedBook.id == FineLedgerEntry.loan_id).where(
+        FineLedgerEntry.user_id == user_id
+    ).group_by(FineLedgerEntry.loan_id, IssuedBook.fine).having(
+        db.func.sum(FineLedgerEntry.amount) > 0
+    ).order_by(FineLedgerEntry.loan_id), ['loan_id', 'owed', 'loan_total'])
+    if not locked or amount > owed['owed'].sum() + 1e-9:
+        raise PaymentError(f'The payment is more than the outstanding fines (₹{owed["owed"].sum():g}).')
+
+    # Each loan takes what is left of the payment, up to what it owes
+    before = owed['owed'].cumsum() - owed['owed']
+    paid = np.minimum(owed['owed'], np.maximum(amount - before, 0.0))
+    entries = owed.assign(user_id=user_id, amount=-paid)[paid > 0]
+    return post_fines(entries, FineLedgerEntry.KIND_PAYMENT, now)
+
+
+def fine_summary(limit=10):
+    """Outstanding fines for dashboards: the total and the largest balances"""
+    total = db.session.query(db.func.coalesce(db.func.sum(User.fine_balance), 0.0)).scalar()
+    top = db.session.query(User.id, User.name, User.fine_balance).filter(
+        User.fine_balance > 0
+    ).order_by(User.fine_balance.desc()).limit(limit).all()
+    return total, top
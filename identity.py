@@ -0,0 +1,309 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from flask_login import UserMixin, user_logged_in
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from caching import FillGuard, TTLCache
+from commit_hooks import after_commit, touch
+from models import db, User, chunked, membership_active
+from replica import use_primary
+from unread import unread_count
+
+IDENTITY_TOUCHED_KEY = 'identity_touched'
+
+# Columns copied into the snapshot; a change to any of them invalidates it
+SNAPSHOT_FIELDS = ('id', 'name', 'email', 'mobile', 'role', 'membership_type',
+                   'membership_expiry', 'created_at', 'session_version')
+DATETIME_FIELDS = ('membership_expiry', 'created_at')
+
+# Changing these ends the user's other sessions (session_version is bumped)
+SESSION_FIELDS = ('role', 'password_hash')
+
+
+class UserSnapshot(UserMixin):
+    """Read-only stand-in for `current_user`, built from the identity cache.
+
+    Holds the columns the routes and templates use to identify and
+    authorize a user. Any other attribute (relationships, fine_balance,
+    ...) loads the user row once, on first use in the request; if the
+    user has been deleted since, the cached entry is dropped and the
+    attribute raises AttributeError.
+    """
+
+    def __init__(self, data):
+        self.__dict__.update(data)
+
+    def get_id(self):
+        return f'{self.id}:{self.session_version}'
+
+    def is_admin(self):
+        return self.role == 'admin'
+
+    def is_membership_active(self, now=None):
+        return membership_active(self.membership_type, self.membership_expiry, now)
+
+    def get_unread_notifications_count(self):
+        return unread_count(self.id)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        user = self.__dict__.get('_user')
+        if user is None:
+            user = self.__dict__['_user'] = db.session.get(User, self.id)
+        if user is None:
+            cache = current_app.extensions.get('identity_cache')
+            if cache is not None:
+                cache.invalidate([self.id])
+            raise AttributeError(f'{name} (user {self.id} no longer exists)')
+        return getattr(user, name)
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.id} v{self.session_version}>'
+
+
+def snapshot_data(user):
+    """The cached fields of a user row, as JSON-friendly values"""
+    data = {}
+    for field in SNAPSHOT_FIELDS:
+        value = getattr(user, field)
+        data[field] = value.isoformat() if isinstance(value, datetime) else value
+    return data
+
+
+def _from_data(data):
+    data = dict(data)
+    for field in DATETIME_FIELDS:
+        if data[field] is not None:
+            data[field] = datetime.fromisoformat(data[field])
+    return UserSnapshot(data)
+
+
+class MemoryIdentityStore(TTLCache):
+    """Per-process LRU of snapshot dicts, each kept for at most `ttl` seconds"""
+
+    def __init__(self, app):
+        super().__init__(app.config['IDENTITY_CACHE_TTL'], app.config['IDENTITY_CACHE_SIZE'])
+
+
+class FileIdentityStore:
+    """Shared-store stand-in: one JSON file per user in IDENTITY_CACHE_FOLDER.
+
+    Every process on the host sees the same entries, so an invalidation in
+    one process reaches the others at once. Swap it for a real shared store
+    (Redis, memcached) by implementing get/set/delete/clear the same way.
+    """
+
+    def __init__(self, app):
+        self.ttl = app.config['IDENTITY_CACHE_TTL']
+        self.folder = app.config['IDENTITY_CACHE_FOLDER']
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, user_id):
+        return os.path.join(self.folder, f'{int(user_id)}.json')
+
+    def get(self, user_id):
+        try:
+            with open(self._path(user_id), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['expires'] <= time.time():
+            return None
+        return entry['data']
+
+    def set(self, user_id, data):
+        path = self._path(user_id)
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'data': data, 'expires': time.time() + self.ttl}, f)
+        os.replace(temporary, path)
+
+    def delete(self, user_ids):
+        for user_id in user_ids:
+            try:
+                os.remove(self._path(user_id))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.folder):
+            if name.endswith('.json'):
+                self.delete([name[:-len('.json')]])
+
+
+class NullIdentityStore:
+    """Caches nothing: every request loads its user"""
+
+    def __init__(self, app):
+        pass
+
+    def get(self, user_id):
+        return None
+
+    def set(self, user_id, data):
+        pass
+
+    def delete(self, user_ids):
+        pass
+
+    def clear(self):
+        pass
+
+
+IDENTITY_STORES = {
+    'memory': MemoryIdentityStore,
+    'file': FileIdentityStore,
+    'none': NullIdentityStore,
+}
+
+
+class IdentityCache:
+    """Snapshots of logged-in users, so authenticated requests load no user row.
+
+    Session ids carry the user's session_version (`"<id>:<version>"`). A
+    session whose version no longer matches the user's is logged out, which
+    is how a password or role change ends other sessions. Commits that
+    change a cached field drop the user's entry from the store, whether
+    they go through the ORM unit of work or a bulk UPDATE/DELETE; with the
+    memory store other processes see the change once their entry expires
+    (IDENTITY_CACHE_TTL).
+    """
+
+    def __init__(self, app):
+        name = app.config['IDENTITY_CACHE_STORE']
+        if name not in IDENTITY_STORES:
+            raise ValueError(f"Unknown IDENTITY_CACHE_STORE {name!r}; expected one of {', '.join(IDENTITY_STORES)}")
+        self.store = IDENTITY_STORES[name](app)
+        self._guard = FillGuard()
+        self.hits = self.misses = 0
+        app.extensions['identity_cache'] = self
+
+    def _read(self, user_id):
+        with use_primary():  # a lagging replica would be cached for the TTL
+            row = db.session.query(*(getattr(User, field) for field in SNAPSHOT_FIELDS)).filter(
+                User.id == user_id
+            ).one_or_none()
+        return None if row is None else snapshot_data(row)
+
+    def load(self, session_id):
+        """The snapshot for a Flask-Login session id, or None to log out"""
+        user_id, _, version = str(session_id).partition(':')
+        try:
+            user_id = int(user_id)
+            # Sessions from before versioning carry no version
+            version = int(version) if version else None
+        except ValueError:
+            return None
+
+        data = self.store.get(user_id)
+        if data is not None and version in (None, data['session_version']):
+            self.hits += 1
+            return _from_data(data)
+
+        # Not cached, expired, or cached before a change made elsewhere
+        self.misses += 1
+        token = self._guard.token()
+        data = self._read(user_id)
+        if data is None:
+            # Deleted; drop whatever a stale entry still says about them
+            self.invalidate([user_id])
+            return None
+        self.put(data, token)
+        if version not in (None, data['session_version']):
+            return None
+        return _from_data(data)
+
+    def put(self, data, token=None):
+        """Cache a snapshot; with a FillGuard `token`, only if nothing was
+        invalidated since it was taken"""
+        if token is None or self._guard.still_valid(token):
+            self.store.set(data['id'], data)
+
+    def invalidate(self, user_ids):
+        self._guard.invalidate()
+        self.store.delete(user_ids)
+
+    def clear(self):
+        self._guard.invalidate()
+        self.store.clear()
+
+
+def load_identity(session_id):
+    """Flask-Login user_loader backed by the identity cache"""
+    return current_app.extensions['identity_cache'].load(session_id)
+
+
+@user_logged_in.connect
+def _prime_on_login(app, user):
+    # The login route has just loaded the row; the next request reuses it
+    cache = app.extensions.get('identity_cache')
+    if cache is not None and isinstance(user, User):
+        cache.put(snapshot_data(user))
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_identity_changes(session, flush_context, instances):
+    touched = set()
+    for user in session.dirty:
+        if not isinstance(user, User) or not session.is_modified(user):
+            continue
+        state = inspect(user)
+        changed = {field for field in SNAPSHOT_FIELDS + SESSION_FIELDS
+                   if state.attrs[field].history.has_changes()}
+        if not changed:
+            continue
+        if changed & set(SESSION_FIELDS) and 'session_version' not in changed:
+            user.session_version = (user.session_version or 1) + 1
+        touched.add(user.id)
+    touched.update(user.id for user in session.deleted if isinstance(user, User))
+    if touched:
+        touch(IDENTITY_TOUCHED_KEY, touched, session)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_identity_changes(orm_execute_state):
+    """Invalidate the users a bulk ORM UPDATE or DELETE matches.
+
+    The statement's values are not inspected, so the matched ids are read
+    first; an UPDATE that changes a session field also bumps the users'
+    session_version. Hot counter updates go through the connection (Core)
+    and skip this.
+    """
+    state = orm_execute_state
+    if not (state.is_update or state.is_delete) or state.bind_mapper is None \
+            or not issubclass(state.bind_mapper.class_, User):
+        return None
+    statement = state.statement
+    session_columns = [getattr(User, field) for field in SESSION_FIELDS]
+    query = db.select(User.id, *session_columns)
+    if statement.whereclause is not None:
+        query = query.where(statement.whereclause)
+    before = {row[0]: tuple(row[1:]) for row in state.session.execute(query)}
+    result = state.invoke_statement()
+    if not before:
+        return result
+
+    if state.is_update:
+        changed = []
+        for chunk in chunked(list(before)):
+            rows = state.session.execute(db.select(User.id, *session_columns).where(User.id.in_(chunk)))
+            changed.extend(row[0] for row in rows if tuple(row[1:]) != before[row[0]])
+        users = User.__table__
+        for chunk in chunked(changed):
+            state.session.connection().execute(db.update(users).where(users.c.id.in_(chunk)).values(
+                session_version=users.c.session_version + 1
+            ))
+    touch(IDENTITY_TOUCHED_KEY, before, state.session)
+    return result
+
+
+@after_commit(IDENTITY_TOUCHED_KEY)
+def _invalidate_after_commit(touched):
+    cache = current_app.extensions.get('identity_cache')
+    if cache is not None:
+        cache.invalidate(touched)
@@ -0,0 +1,311 @@
+import os
+import uuid
+import pandas as pd
+from openpyxl import load_workbook
+from flask import current_app
+from models import db, Book, Category
+from stats import adjust_stats, adjust_category_counts
+
+# Rows validated and written per transaction
+IMPORT_CHUNK_SIZE = 1000
+
+# Per-row errors kept in the result; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+IMPORT_EXTENSIONS = {'csv', 'xlsx'}
+
+# Accepted header spellings (lower-cased, spaces as underscores) -> field.
+# The export's Books sheet headers are accepted, so an export re-imports.
+IMPORT_COLUMNS = {
+    'title': 'title',
+    'author': 'author',
+    'category': 'category',
+    'total_copies': 'total_copies',
+    'copies': 'total_copies',
+}
+
+REQUIRED_COLUMNS = ('title', 'author', 'category')
+
+# Column length limits, as on the Book and Category models
+MAX_LENGTHS = {'title': 200, 'author': 100, 'category': 50}
+
+MAX_COPIES = 10000
+
+
+class ImportFileError(ValueError):
+    """The file as a whole cannot be imported (unknown type, bad header)"""
+
+
+class ImportConflict(Exception):
+    """Copies changed under a chunk while it was written; nothing was"""
+
+
+def _normalize_header(header):
+    return str(header or '').strip().lower().replace(' ', '_')
+
+
+def _field_positions(headers):
+    positions = {}
+    for position, header in enumerate(headers):
+        field = IMPORT_COLUMNS.get(_normalize_header(header))
+        if field and field not in positions:
+            positions[field] = position
+    missing = [column for column in REQUIRED_COLUMNS if column not in positions]
+    if missing:
+        raise ImportFileError(f"Missing required columns: {', '.join(missing)}")
+    return positions
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _fields(values, positions):
+    return {field: _cell(values[position] if position < len(values) else None)
+            for field, position in positions.items()}
+
+
+def _csv_chunks(path, chunk_size):
+    # The header is checked before any row, so a header-only file with the
+    # wrong columns is still rejected
+    try:
+        headers = pd.read_csv(path, dtype=str, encoding='utf-8-sig', nrows=0).columns
+    except pd.errors.EmptyDataError:
+        raise ImportFileError('The file is empty.')
+    positions = _field_positions(headers)
+
+    reader = pd.read_csv(path, dtype=str, keep_default_na=False, encoding='utf-8-sig',
+                         chunksize=chunk_size, skip_blank_lines=True)
+    row_number = 1  # the header is row 1, as in a spreadsheet
+    for frame in reader:
+        chunk = []
+        for values in frame.itertuples(index=False, name=None):
+            row_number += 1
+            chunk.append((row_number, _fields(values, positions)))
+        yield chunk
+
+
+def _xlsx_chunks(path, chunk_size):
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        positions = _field_positions(next(rows, ()))
+        chunk = []
+        for row_number, values in enumerate(rows, 2):
+            if all(value is None for value in values):
+                continue
+            chunk.append((row_number, _fields(values, positions)))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+def read_import_rows(path, chunk_size=IMPORT_CHUNK_SIZE):
+    """Yield lists of (row number, fields) from a .csv or .xlsx file.
+
+    Files are streamed; only one chunk of rows is held in memory.
+    """
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension == 'csv':
+        return _csv_chunks(path, chunk_size)
+    if extension == 'xlsx':
+        return _xlsx_chunks(path, chunk_size)
+    raise ImportFileError('Only .csv and .xlsx files can be imported.')
+
+
+def count_import_rows(path):
+    """Data rows in the file, for progress reporting (None if unknown)"""
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension == 'csv':
+        with open(path, 'rb') as file:
+            return max(0, sum(1 for line in file if line.strip()) - 1)
+    if extension == 'xlsx':
+        workbook = load_workbook(path, read_only=True)
+        try:
+            max_row = workbook.worksheets[0].max_row
+        finally:
+            workbook.close()
+        return max(0, max_row - 1) if max_row else None
+    return None
+
+
+def validate_row(fields):
+    """Return (title, author, category, total_copies) or raise ValueError"""
+    for field in REQUIRED_COLUMNS:
+        if not fields[field]:
+            raise ValueError(f'{field} is required')
+        if len(fields[field]) > MAX_LENGTHS[field]:
+            raise ValueError(f'{field} is longer than {MAX_LENGTHS[field]} characters')
+
+    copies = fields.get('total_copies') or '1'
+    try:
+        total_copies = int(copies)
+    except ValueError:
+        raise ValueError(f'total_copies must be a whole number, got {copies!r}')
+    if not 1 <= total_copies <= MAX_COPIES:
+        raise ValueError(f'total_copies must be between 1 and {MAX_COPIES}')
+    return fields['title'], fields['author'], fields['category'], total_copies
+
+
+def _category_ids(names):
+    """Map category names to ids, creating the missing categories"""
+    ids = dict(db.session.query(Category.name, Category.id).filter(Category.name.in_(names)))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        db.session.execute(db.insert(Category), [{'name': name, 'book_count': 0} for name in missing])
+        ids.update(db.session.query(Category.name, Category.id).filter(Category.name.in_(missing)))
+    return ids, len(missing)
+
+
+def import_chunk(rows):
+    """Upsert one chunk of validated rows in the current transaction.
+
+    `rows` maps (title, author) to (category, total_copies). Existing books
+    with the same title and author get the new category and copy count;
+    available copies move by the same amount, as when editing a book. The
+    copy change is applied as a delta in SQL with a `>= 0` guard, like the
+    circulation updates, so loans made meanwhile are not overwritten. A
+    book cannot drop below its copies on loan; such rows are returned as
+    rejected. The others are inserted; rows matching the stored book are
+    skipped. Statistics and category counts are adjusted in the same
+    transaction. Raises ImportConflict, after rolling back, when loans
+    changed a book's copies since it was read.
+    Returns (inserted, updated, unchanged, categories created, {key: error}).
+    """
+    category_ids, categories_created = _category_ids({category for category, _ in rows.values()})
+
+    existing = {}
+    for book_id, title, author, category_id, total_copies, available_copies in db.session.query(
+        Book.id, Book.title, Book.author, Book.category_id, Book.total_copies, Book.available_copies
+    ).filter(Book.title.in_({title for title, _ in rows})):
+        if (title, author) in rows:
+            existing[(title, author)] = (book_id, category_id, total_copies, available_copies)
+
+    inserts, updates, rejected = [], [], {}
+    category_deltas = {}
+    total_delta = available_delta = unchanged = 0
+    for key, (category, total_copies) in rows.items():
+        category_id = category_ids[category]
+        if key not in existing:
+            inserts.append({'title': key[0], 'author': key[1], 'category_id': category_id,
+                            'total_copies': total_copies, 'available_copies': total_copies})
+            category_deltas[category_id] = category_deltas.get(category_id, 0) + 1
+            total_delta += total_copies
+            available_delta += total_copies
+            continue
+
+        book_id, old_category_id, old_total, old_available = existing[key]
+        if category_id == old_category_id and total_copies == old_total:
+            unchanged += 1
+            continue
+        delta = total_copies - old_total
+        if old_available + delta < 0:
+            rejected[key] = (f'total_copies cannot go below the {old_total - old_available} '
+                             f'copies on loan, got {total_copies}')
+            continue
+        updates.append({'book_id': book_id, 'category_id': category_id, 'delta': delta})
+        if category_id != old_category_id:
+            category_deltas[old_category_id] = category_deltas.get(old_category_id, 0) - 1
+            category_deltas[category_id] = category_deltas.get(category_id, 0) + 1
+        total_delta += delta
+        available_delta += delta
+
+    connection = db.session.connection()
+    if inserts:
+        # Core executemany: no ORM bookkeeping for rows nobody loads
+        connection.execute(db.insert(Book.__table__), inserts)
+    if updates:
+        books = Book.__table__
+        changed = connection.execute(
+            db.update(books).where(
+                books.c.id == db.bindparam('book_id'),
+                books.c.available_copies + db.bindparam('delta') >= 0
+            ).values(
+                category_id=db.bindparam('category_id'),
+                total_copies=books.c.total_copies + db.bindparam('delta'),
+                available_copies=books.c.available_copies + db.bindparam('delta')
+            ),
+            updates
+        ).rowcount
+        if changed != len(updates):
+            db.session.rollback()
+            raise ImportConflict('Books were issued while the import ran; import these rows again.')
+    adjust_stats(total_books=len(inserts), total_copies=total_delta, available_copies=available_delta)
+    adjust_category_counts(category_deltas)
+    return len(inserts), len(updates), unchanged, categories_created, rejected
+
+
+def import_books(path, progress=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import books from a .csv/.xlsx file, committing once per chunk.
+
+    Rows are keyed by (title, author); a later row for the same book
+    overrides an earlier one. Invalid rows are skipped and reported with
+    their row number. `progress(rows_read)` is called after every chunk.
+    Returns a summary dict.
+    """
+    result = {'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'failed': 0,
+              'categories_created': 0, 'errors': []}
+
+    def fail(row_number, error):
+        result['failed'] += 1
+        if len(result['errors']) < MAX_REPORTED_ERRORS:
+            result['errors'].append({'row': row_number, 'error': error})
+
+    for chunk in read_import_rows(path, chunk_size):
+        rows, row_numbers = {}, {}
+        for row_number, fields in chunk:
+            try:
+                title, author, category, total_copies = validate_row(fields)
+            except ValueError as error:
+                fail(row_number, str(error))
+                continue
+            rows[(title, author)] = (category, total_copies)
+            row_numbers[(title, author)] = row_number
+
+        if rows:
+            try:
+                inserted, updated, unchanged, categories_created, rejected = import_chunk(rows)
+            except ImportConflict as error:
+                for key in rows:
+                    fail(row_numbers[key], str(error))
+            else:
+                db.session.commit()
+                result['inserted'] += inserted
+                result['updated'] += updated
+                result['unchanged'] += unchanged
+                result['categories_created'] += categories_created
+                for key, error in rejected.items():
+                    fail(row_numbers[key], error)
+
+        result['rows'] += len(chunk)
+        if progress:
+            progress(result['rows'])
+    result['errors'].sort(key=lambda error: error['row'])
+    return result
+
+
+def import_job(job_id, progress, path):
+    """Background job body: import a staged upload, then remove it"""
+    try:
+        total = count_import_rows(path)
+        progress(0, total)
+        return import_books(path, lambda rows: progress(rows, total))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def stage_import(file, extension):
+    """Save an uploaded import file in the job folder and return its path"""
+    runner = current_app.extensions['jobs']
+    path = os.path.join(runner.folder, f'import_{uuid.uuid4().hex}.{extension}')
+    file.save(path)
+    return path
@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+class JobRunner:
+    """Run long tasks (exports, imports) on a worker thread pool.
+
+    Job state lives in small JSON files under JOB_FOLDER rather than in the
+    database, so progress updates never contend with the job's own reads
+    and every worker process on the host sees the same state. Job output
+    files sit next to them and are purged JOB_RETENTION_HOURS after the job
+    finishes. A job still unfinished after JOB_TIMEOUT_HOURS (its process
+    died, say) is marked failed and purged like any other.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.folder = app.config['JOB_FOLDER']
+        self.retention = timedelta(hours=app.config['JOB_RETENTION_HOURS'])
+        self.timeout = timedelta(hours=app.config['JOB_TIMEOUT_HOURS'])
+        self.executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'], thread_name_prefix='library-job')
+        os.makedirs(self.folder, exist_ok=True)
+        app.extensions['jobs'] = self
+
+    def _meta_path(self, job_id):
+        return os.path.join(self.folder, f'{job_id}.json')
+
+    def file_path(self, job_id, suffix):
+        """Path for a file owned by the job; removed together with it"""
+        return os.path.join(self.folder, f'{job_id}{suffix}')
+
+    def _save(self, job):
+        path = self._meta_path(job['id'])
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(job, file)
+        os.replace(temp_path, path)
+
+    def get(self, job_id):
+        if not JOB_ID.match(job_id or ''):
+            return None
+        try:
+            with open(self._meta_path(job_id)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id, **values):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.update(values)
+        self._save(job)
+        return job
+
+    def submit(self, kind, func, params, created_by=None):
+        """Queue `func(job_id, progress, **params)` and return the new job.
+
+        `progress(current, total)` records how far the job has got. The
+        return value of `func` (a dict) is stored as the job's result.
+        """
+        created_at = _now()
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'status': JOB_QUEUED,
+            'params': params,
+            'created_by': created_by,
+            'created_at': created_at.isoformat(),
+            'started_at': None,
+            'finished_at': None,
+            # Moved up when the job finishes; covers jobs that never do
+            'expires_at': (created_at + self.timeout + self.retention).isoformat(),
+            'progress': {'current': 0, 'total': None},
+            'result': None,
+            'error': None
+        }
+        self._save(job)
+        self.executor.submit(self._run, job['id'], func, params)
+        return job
+
+    def _run(self, job_id, func, params):
+        def progress(current, total=None):
+            self.update(job_id, progress={'current': current, 'total': total})
+
+        with self.app.app_context():
+            self.update(job_id, status=JOB_RUNNING, started_at=_now().isoformat())
+            try:
+                result = func(job_id, progress, **params)
+            except Exception as exception:
+                # (`except ... as error` would unbind `error` on exit)
+                db.session.rollback()
+                logger.exception('Job %s failed', job_id)
+                status, result, error = JOB_FAILED, None, str(exception)
+            else:
+                status, error = JOB_DONE, None
+            finally:
+                db.session.remove()
+
+            finished_at = _now()
+            self.update(job_id, status=status, result=result, error=error,
+                        finished_at=finished_at.isoformat(),
+                        expires_at=(finished_at + self.retention).isoformat())
+
+    def _expires_at(self, job):
+        if job['expires_at']:
+            return datetime.fromisoformat(job['expires_at'])
+        # Written before jobs got an expiry when queued
+        return datetime.fromisoformat(job['created_at']) + self.timeout + self.retention
+
+    def _fail_timed_out(self, job, now):
+        """Mark a job unfinished after JOB_TIMEOUT_HOURS as failed"""
+        if job['status'] not in (JOB_QUEUED, JOB_RUNNING):
+            return job
+        if datetime.fromisoformat(job['created_at']) + self.timeout > now:
+            return job
+        logger.warning('Job %s timed out while %s', job['id'], job['status'])
+        return self.update(job['id'], status=JOB_FAILED, error='Timed out', finished_at=now.isoformat(),
+                           expires_at=min(self._expires_at(job), now + self.retention).isoformat())
+
+    def purge_expired(self, now=None):
+        """Fail timed-out jobs, then delete jobs and their files once past
+        their expiry. Files removed meanwhile by another process are skipped."""
+        now = now or _now()
+        files = {}
+        for name in os.listdir(self.folder):
+            files.setdefault(name[:32], []).append(name)
+
+        purged = 0
+        for job_id, names in files.items():
+            if f'{job_id}.json' not in names:
+                continue
+            job = self.get(job_id)
+            if job is not None:
+                job = self._fail_timed_out(job, now)
+            if job is None or self._expires_at(job) > now:
+                continue
+            for name in names:
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    pass
+            purged += 1
+        return purged
@@ -0,0 +1,216 @@
+import re
+from sqlalchemy import inspect
+from models import db, Book, IssuedBook, Notification, SchemaVersion
+from fines import open_fine_ledger
+from search import drop_search_triggers, ensure_search_index
+from stats import reconcile_category_counts, reconcile_unread_counts
+
+DUE_TOMORROW_MESSAGE = re.compile(r"^Book '(?P<title>.*)' is due tomorrow!$")
+OVERDUE_MESSAGE = re.compile(r"^Book '(?P<title>.*)' is overdue by \d+ days")
+
+
+def _column_names(table_name):
+    return {column['name'] for column in inspect(db.engine).get_columns(table_name)}
+
+
+def _add_notification_dedup_columns():
+    columns = _column_names('notifications')
+    if 'loan_id' in columns:
+        return False
+
+    with db.engine.begin() as connection:
+        connection.execute(db.text('ALTER TABLE notifications ADD COLUMN loan_id INTEGER REFERENCES issued_books (id)'))
+        connection.execute(db.text('ALTER TABLE notifications ADD COLUMN kind VARCHAR(20)'))
+        connection.execute(db.text('ALTER TABLE notifications ADD COLUMN day_bucket DATE'))
+    return True
+
+
+def _backfill_notification_dedup_keys():
+    """Derive (loan, kind, day) for alerts written before the key existed.
+
+    Alerts are matched to the user's loan of the titled book that was open
+    when the alert was created. Rows that cannot be matched, or that would
+    duplicate a key already assigned, keep a NULL key.
+    """
+    loans = {}
+    for loan_id, user_id, title, issue_date, due_date, return_date in db.session.query(
+        IssuedBook.id, IssuedBook.user_id, Book.title, IssuedBook.issue_date, IssuedBook.due_date,
+        IssuedBook.return_date
+    ).join(Book, IssuedBook.book_id == Book.id):
+        loans.setdefault((user_id, title), []).append((issue_date, loan_id, due_date, return_date))
+
+    seen = set()
+    updates = []
+    for notification_id, user_id, message, created_at in db.session.query(
+        Notification.id, Notification.user_id, Notification.message, Notification.created_at
+    ).filter(Notification.notification_type.in_(['warning', 'danger'])).order_by(Notification.id):
+        for kind, pattern in ((Notification.KIND_DUE_TOMORROW, DUE_TOMORROW_MESSAGE),
+                              (Notification.KIND_OVERDUE, OVERDUE_MESSAGE)):
+            match = pattern.match(message)
+            if match:
+                break
+        else:
+            continue
+
+        # Latest loan of that title that was open when the alert was created
+        candidates = [loan for loan in loans.get((user_id, match.group('title')), [])
+                      if created_at is None or ((loan[0] is None or loan[0] <= created_at) and
+                                                (loan[3] is None or loan[3] >= created_at))]
+        if not candidates or (kind == Notification.KIND_OVERDUE and created_at is None):
+            continue
+        _, loan_id, due_date, _ = max(candidates, key=lambda loan: (loan[0] is not None, loan[0], loan[1]))
+
+        day_bucket = due_date.date() if kind == Notification.KIND_DUE_TOMORROW else created_at.date()
+        key = (loan_id, kind, day_bucket)
+        if key in seen:
+            continue
+        seen.add(key)
+        updates.append({'id': notification_id, 'loan_id': loan_id, 'kind': kind, 'day_bucket': day_bucket})
+
+    if updates:
+        db.session.execute(db.update(Notification), updates)
+    db.session.commit()
+
+
+# Indexes each migration owns, by name. A migration creates only its own,
+# never "whatever the models declare today": a later migration's index may
+# need columns or data checks that the later migration provides.
+HOT_PATH_INDEXES = [
+    'ix_users_role_name', 'ix_books_available_title', 'ix_issued_books_user_issue',
+    'ix_issued_books_user_open', 'ix_issued_books_issue_date', 'ix_issued_books_open_due',
+    'ix_notifications_user_unread', 'ix_notifications_user_created',
+]
+
+
+def _create_indexes(*names):
+    """Create the named indexes, as declared on the models, if missing"""
+    declared = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+    for name in names:
+        declared[name].create(db.engine, checkfirst=True)
+
+
+def _add_notification_dedup_key():
+    if _add_notification_dedup_columns():
+        _backfill_notification_dedup_keys()
+    _create_indexes('uq_notifications_loan_kind_day')
+
+
+def _create_hot_path_indexes():
+    _create_indexes(*HOT_PATH_INDEXES)
+
+
+def _normalize_book_category():
+    """Replace the books.category name with a categories.id reference.
+
+    Names without a categories row get one. On databases migrated this way
+    books.category_id stays nullable (SQLite cannot add NOT NULL to an
+    existing column); the application always sets it.
+    """
+    if 'book_count' not in _column_names('categories'):
+        with db.engine.begin() as connection:
+            connection.execute(db.text('ALTER TABLE categories ADD COLUMN book_count INTEGER NOT NULL DEFAULT 0'))
+
+    columns = _column_names('books')
+    if 'category' in columns:
+        drop_search_triggers()
+        with db.engine.begin() as connection:
+            if 'category_id' not in columns:
+                connection.execute(db.text('ALTER TABLE books ADD COLUMN category_id INTEGER REFERENCES categories (id)'))
+            connection.execute(db.text(
+                'INSERT INTO categories (name, book_count, created_at) '
+                'SELECT DISTINCT category, 0, CURRENT_TIMESTAMP FROM books '
+                'WHERE category NOT IN (SELECT name FROM categories)'
+            ))
+            connection.execute(db.text(
+                'UPDATE books SET category_id = (SELECT id FROM categories WHERE name = books.category)'
+            ))
+            connection.execute(db.text('DROP INDEX IF EXISTS ix_books_category'))
+            connection.execute(db.text('ALTER TABLE books DROP COLUMN category'))
+
+    reconcile_category_counts()
+    db.session.commit()
+    _create_indexes('ix_books_category_id')
+
+
+def _unique_open_loans():
+    duplicates = db.session.query(IssuedBook.user_id, IssuedBook.book_id).filter(
+        IssuedBook.return_date.is_(None)
+    ).group_by(IssuedBook.user_id, IssuedBook.book_id).having(db.func.count() > 1).all()
+    if duplicates:
+        pairs = ', '.join(f'(user {user_id}, book {book_id})' for user_id, book_id in duplicates)
+        raise RuntimeError(f'Return the duplicate open loans before upgrading: {pairs}')
+    _create_indexes('uq_issued_books_open_user_book')
+
+
+def _add_unread_counter():
+    if 'unread_notifications' not in _column_names('users'):
+        with db.engine.begin() as connection:
+            connection.execute(db.text('ALTER TABLE users ADD COLUMN unread_notifications INTEGER NOT NULL DEFAULT 0'))
+    reconcile_unread_counts()
+    db.session.commit()
+
+
+def _add_fine_ledger():
+    if 'fine_balance' not in _column_names('users'):
+        with db.engine.begin() as connection:
+            connection.execute(db.text('ALTER TABLE users ADD COLUMN fine_balance FLOAT NOT NULL DEFAULT 0'))
+    _create_indexes('ix_users_fine_balance', 'ix_fine_ledger_user', 'ix_fine_ledger_loan')
+    open_fine_ledger()
+
+
+def _add_session_version():
+    if 'session_version' not in _column_names('users'):
+        with db.engine.begin() as connection:
+            connection.execute(db.text('ALTER TABLE users ADD COLUMN session_version INTEGER NOT NULL DEFAULT 1'))
+
+
+# (version, description, step). Steps must be safe to re-run: databases
+# created before versioning replay every step from the start. Append new
+# migrations at the end; never renumber.
+MIGRATIONS = [
+    (1, 'Structured notification dedup key', _add_notification_dedup_key),
+    (2, 'Library statistics table', lambda: None),  # created by create_all
+    (3, 'Indexes for hot query predicates', _create_hot_path_indexes),
+    (4, 'Books reference categories by id with maintained book counts', _normalize_book_category),
+    (5, 'Index books by title and author for bulk import', lambda: _create_indexes('ix_books_title_author')),
+    (6, 'One open loan per student and book', _unique_open_loans),
+    (7, 'Per-user unread notification counter', _add_unread_counter),
+    (8, 'Fine ledger with per-user balances', _add_fine_ledger),
+    (9, 'Session version for cached logins', _add_session_version),
+]
+
+
+def current_version():
+    return db.session.query(db.func.max(SchemaVersion.version)).scalar() or 0
+
+
+def _record(version, description):
+    db.session.add(SchemaVersion(version=version, description=description))
+    db.session.commit()
+
+
+def upgrade_database():
+    """Create a new database or migrate an existing one to the latest schema.
+
+    A fresh database gets the full current schema from the models and is
+    stamped with the latest version. Otherwise every migration newer than
+    the recorded version runs in order and is recorded as it completes.
+    """
+    fresh = 'users' not in inspect(db.engine).get_table_names()
+
+    # Creates missing tables (with their indexes) on the primary; never
+    # alters existing ones. A replica gets them from replication
+    db.create_all(bind_key=None)
+
+    if fresh:
+        for version, description, _ in MIGRATIONS:
+            db.session.add(SchemaVersion(version=version, description=description))
+        db.session.commit()
+    else:
+        applied = current_version()
+        for version, description, step in MIGRATIONS:
+            if version > applied:
+                step()
+                _record(version, description)
+
+    ensure_search_index()
@@ -1,9 +1,99 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, time, timedelta, timezone
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.hybrid import hybrid_method
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import TypeDecorator
 from werkzeug.security import generate_password_hash, check_password_hash
+from replica import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def as_utc(value):
+    """An aware UTC datetime; naive values are taken to be UTC already"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+class UTCDateTime(TypeDecorator):
+    """DateTime stored as naive UTC and loaded as aware UTC.
+
+    Aware values are converted to UTC before they are stored and naive
+    ones are taken to be UTC, so every row compares correctly in SQL and
+    Python never mixes naive and aware datetimes.
+    """
+    impl = db.DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        return as_utc(value)
+
+
+class days_between(FunctionElement):
+    """Whole days from `start` to `end` (rounded down) as SQL"""
+    type = db.Integer()
+    name = 'days_between'
+    inherit_cache = True
+
+
+@compiles(days_between)
+def _days_between(element, compiler, **kw):
+    start, end = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f'EXTRACT(DAY FROM ({end} - {start}))'
+
+
+@compiles(days_between, 'sqlite')
+def _days_between_sqlite(element, compiler, **kw):
+    start, end = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f'CAST(julianday({end}) - julianday({start}) AS INTEGER)'
+
+
+@compiles(days_between, 'postgresql')
+def _days_between_postgresql(element, compiler, **kw):
+    start, end = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f'CAST(floor(EXTRACT(EPOCH FROM ({end} - {start})) / 86400) AS INTEGER)'
+
+
+def membership_active(membership_type, membership_expiry, now=None):
+    """Whether a membership is active at `now` (Python side of the hybrid)"""
+    if membership_type == 'lifetime':
+        return True
+    if membership_expiry:
+        return (now or utcnow()) < as_utc(membership_expiry)
+    return membership_type == 'basic'
+
+
+def _utc_literal(value):
+    return db.literal(value, UTCDateTime())
+
+
+# Rows per IN (...) list or multi-row statement, well below SQLite's
+# bound-parameter limit
+CHUNK_SIZE = 500
+
+
+def chunked(items, size=CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def count_rows(model, *criteria):
+    """Scalar subquery counting the rows of `model` matching `criteria`"""
+    return db.select(db.func.count()).select_from(model).where(*criteria).scalar_subquery()
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -15,36 +105,53 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), nullable=False, default='student')  # admin or student
     membership_type = db.Column(db.String(20), default='basic')  # basic, 3month, 6month, lifetime
-    membership_expiry = db.Column(db.DateTime, nullable=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    membership_expiry = db.Column(UTCDateTime, nullable=True)
+    created_at = db.Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
+    # Unread notifications, kept in step by every notification writer
+    unread_notifications = db.Column(db.Integer, nullable=False, default=0)
+    # Fines accrued on all loans, the latest running balance in fine_ledger
+    fine_balance = db.Column(db.Float, nullable=False, default=0.0)
+    # Part of the session id; bumped on password or role changes to end
+    # the user's other sessions
+    session_version = db.Column(db.Integer, nullable=False, default=1)
     
     # Relationships
     issued_books = db.relationship('IssuedBook', backref='user', lazy=True)
     notifications = db.relationship('Notification', backref='user', lazy=True)
     
+    __table_args__ = (
+        # Student lists ordered by name (memberships, issue form)
+        db.Index('ix_users_role_name', 'role', 'name', 'id'),
+        # Outstanding fines total and largest balances (admin dashboard)
+        db.Index('ix_users_fine_balance', 'fine_balance'),
+    )
+    
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
+    def get_id(self):
+        return f'{self.id}:{self.session_version or 1}'
+    
     def is_admin(self):
         return self.role == 'admin'
     
     def get_unread_notifications_count(self):
-        return Notification.query.filter_by(user_id=self.id, is_read=False).count()
-    
-    def is_membership_active(self):
-        if self.membership_type == 'lifetime':
-            return True
-        if self.membership_expiry:
-            # Ensure membership_expiry is timezone-aware
-            if self.membership_expiry.tzinfo is None:
-                membership_expiry_utc = self.membership_expiry.replace(tzinfo=timezone.utc)
-            else:
-                membership_expiry_utc = self.membership_expiry
-            return datetime.now(timezone.utc) < membership_expiry_utc
-        return self.membership_type == 'basic'
+        return self.unread_notifications
+    
+    @hybrid_method
+    def is_membership_active(self, now=None):
+        return membership_active(self.membership_type, self.membership_expiry, now)
+    
+    @is_membership_active.expression
+    def is_membership_active(cls, now=None):
+        return db.or_(
+            cls.membership_type == 'lifetime',
+            db.and_(cls.membership_expiry.isnot(None), cls.membership_expiry > (now or utcnow())),
+            db.and_(cls.membership_expiry.is_(None), cls.membership_type == 'basic')
+        )
 
 class Book(db.Model):
     __tablename__ = 'books'
@@ -52,15 +159,26 @@ class Book(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     author = db.Column(db.String(100), nullable=False)
-    category = db.Column(db.String(50), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
     total_copies = db.Column(db.Integer, nullable=False, default=1)
     available_copies = db.Column(db.Integer, nullable=False, default=1)
     cover_photo = db.Column(db.String(255), nullable=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
     
     # Relationships
     issued_books = db.relationship('IssuedBook', backref='book', lazy=True)
     
+    __table_args__ = (
+        # Category filter on the catalog and category counts
+        db.Index('ix_books_category_id', 'category_id', 'id'),
+        # Bulk import matches existing books by title and author
+        db.Index('ix_books_title_author', 'title', 'author'),
+        # Issue form: books with copies left, by title
+        db.Index('ix_books_available_title', 'title', 'id',
+                 sqlite_where=db.text('available_copies > 0'),
+                 postgresql_where=db.text('available_copies > 0')),
+    )
+    
     def is_available(self):
         return self.available_copies > 0
     
@@ -73,51 +191,78 @@ class IssuedBook(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
-    issue_date = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    due_date = db.Column(db.DateTime, nullable=False)
-    return_date = db.Column(db.DateTime, nullable=True)
+    issue_date = db.Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
+    due_date = db.Column(UTCDateTime, nullable=False)
+    return_date = db.Column(UTCDateTime, nullable=True)
     fine = db.Column(db.Float, default=0.0)
     
+    __table_args__ = (
+        # A student's loans, newest first (my_books) and their open loans
+        db.Index('ix_issued_books_user_issue', 'user_id', 'issue_date', 'id'),
+        db.Index('ix_issued_books_user_open', 'user_id', 'return_date', 'due_date'),
+        # Recent issues (admin dashboard, recent_issues)
+        db.Index('ix_issued_books_issue_date', 'issue_date', 'id'),
+        # A student holds at most one open loan of a book
+        db.Index('uq_issued_books_open_user_book', 'user_id', 'book_id', unique=True,
+                 sqlite_where=db.text('return_date IS NULL'),
+                 postgresql_where=db.text('return_date IS NULL')),
+        # Open loans by due date (return desk, overdue checks, sweep)
+        db.Index('ix_issued_books_open_due', 'due_date', 'id',
+                 sqlite_where=db.text('return_date IS NULL'),
+                 postgresql_where=db.text('return_date IS NULL')),
+    )
+    
     def __init__(self, **kwargs):
         super(IssuedBook, self).__init__(**kwargs)
         if not self.due_date:
             self.due_date = datetime.now(timezone.utc) + timedelta(days=10)  # 10 days loan period
     
-    def is_overdue(self):
+    # The predicates below are hybrids: called on a loan they compute in
+    # Python, called on the class they build the equivalent SQL, e.g.
+    # IssuedBook.query.filter(IssuedBook.is_overdue()). `now` defaults to
+    # the current UTC time.
+    
+    @hybrid_method
+    def is_overdue(self, now=None):
         if self.return_date:
             return False
-        # Ensure due_date is timezone-aware for comparison
-        if self.due_date.tzinfo is None:
-            due_date_utc = self.due_date.replace(tzinfo=timezone.utc)
-        else:
-            due_date_utc = self.due_date
-        return datetime.now(timezone.utc) > due_date_utc
-    
-    def days_overdue(self):
-        if not self.is_overdue():
+        return (now or utcnow()) > as_utc(self.due_date)
+    
+    @is_overdue.expression
+    def is_overdue(cls, now=None):
+        return db.and_(cls.return_date.is_(None), cls.due_date < (now or utcnow()))
+    
+    @hybrid_method
+    def days_overdue(self, now=None):
+        now = now or utcnow()
+        if not self.is_overdue(now):
             return 0
-        # Ensure due_date is timezone-aware for calculation
-        if self.due_date.tzinfo is None:
-            due_date_utc = self.due_date.replace(tzinfo=timezone.utc)
-        else:
-            due_date_utc = self.due_date
-        return (datetime.now(timezone.utc) - due_date_utc).days
+        return (now - as_utc(self.due_date)).days
+    
+    @days_overdue.expression
+    def days_overdue(cls, now=None):
+        now = now or utcnow()
+        return db.case((cls.is_overdue(now), days_between(cls.due_date, _utc_literal(now))), else_=0)
     
     def calculate_fine(self, fine_per_day=10):
         if self.is_overdue():
             self.fine = self.days_overdue() * fine_per_day
         return self.fine
     
-    def is_due_tomorrow(self):
+    @hybrid_method
+    def is_due_tomorrow(self, now=None):
         if self.return_date:
             return False
-        tomorrow = datetime.now(timezone.utc) + timedelta(days=1)
-        # Ensure due_date is timezone-aware for comparison
-        if self.due_date.tzinfo is None:
-            due_date_utc = self.due_date.replace(tzinfo=timezone.utc)
-        else:
-            due_date_utc = self.due_date
-        return due_date_utc.date() == tomorrow.date()
+        tomorrow = (now or utcnow()) + timedelta(days=1)
+        return as_utc(self.due_date).date() == tomorrow.date()
+    
+    @is_due_tomorrow.expression
+    def is_due_tomorrow(cls, now=None):
+        # A range on due_date rather than date(due_date), so the open-loan
+        # index can be used
+        start = datetime.combine(((now or utcnow()) + timedelta(days=1)).date(), time.min, timezone.utc)
+        return db.and_(cls.return_date.is_(None), cls.due_date >= start,
+                       cls.due_date < start + timedelta(days=1))
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
@@ -125,27 +270,90 @@ class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     message = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
     is_read = db.Column(db.Boolean, default=False)
     notification_type = db.Column(db.String(20), default='info')  # info, warning, danger
     
-    @staticmethod
-    def create_notification(user_id, message, notification_type='info'):
-        notification = Notification(
-            user_id=user_id,
-            message=message,
-            notification_type=notification_type
-        )
-        db.session.add(notification)
-        db.session.commit()
-        return notification
+    # Structured dedup key for generated alerts: one alert per loan, kind and day
+    loan_id = db.Column(db.Integer, db.ForeignKey('issued_books.id'), nullable=True)
+    kind = db.Column(db.String(20), nullable=True)  # due_tomorrow, overdue
+    day_bucket = db.Column(db.Date, nullable=True)
+    
+    __table_args__ = (
+        db.Index('uq_notifications_loan_kind_day', 'loan_id', 'kind', 'day_bucket', unique=True),
+        # Unread count / mark-as-read, and a user's notifications newest first
+        db.Index('ix_notifications_user_unread', 'user_id', 'is_read', 'created_at'),
+        db.Index('ix_notifications_user_created', 'user_id', 'created_at', 'id'),
+    )
+    
+    KIND_DUE_TOMORROW = 'due_tomorrow'
+    KIND_OVERDUE = 'overdue'
 
 class Category(db.Model):
     __tablename__ = 'categories'
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # Number of books in the category, kept in step by the book routes
+    book_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
+    
+    # Relationships
+    books = db.relationship('Book', backref='category', lazy=True)
+    
+    def __str__(self):
+        return self.name
     
     def __repr__(self):
         return f'<Category {self.name}>'
+
+class LibraryStats(db.Model):
+    __tablename__ = 'library_stats'
+    
+    # Single row (id=1) of counters kept in step with the tables they summarize
+    id = db.Column(db.Integer, primary_key=True)
+    total_books = db.Column(db.Integer, nullable=False, default=0)
+    total_copies = db.Column(db.Integer, nullable=False, default=0)
+    available_copies = db.Column(db.Integer, nullable=False, default=0)
+    students = db.Column(db.Integer, nullable=False, default=0)  # student accounts, any membership
+    open_loans = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
+    
+    COUNTERS = ('total_books', 'total_copies', 'available_copies', 'students', 'open_loans')
+    
+    @staticmethod
+    def get():
+        return db.session.get(LibraryStats, 1)
+
+class FineLedgerEntry(db.Model):
+    __tablename__ = 'fine_ledger'
+    
+    # Append-only record of fines: one row per loan each time its fine grows
+    # or a payment settles part of it
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    loan_id = db.Column(db.Integer, db.ForeignKey('issued_books.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # opening, accrual, return, payment
+    amount = db.Column(db.Float, nullable=False)  # fine added by this entry (negative for payments)
+    loan_total = db.Column(db.Float, nullable=False)  # loan's fine after this entry (payments leave it)
+    balance = db.Column(db.Float, nullable=False)  # user's running balance after this entry
+    accrued_on = db.Column(db.Date, nullable=False)
+    created_at = db.Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        db.Index('ix_fine_ledger_user', 'user_id', 'id'),
+        db.Index('ix_fine_ledger_loan', 'loan_id', 'id'),
+    )
+    
+    KIND_OPENING = 'opening'
+    KIND_ACCRUAL = 'accrual'
+    KIND_RETURN = 'return'
+    KIND_PAYMENT = 'payment'
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    
+    # One row per applied migration (see migrations.py)
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
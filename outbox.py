@@ -0,0 +1,54 @@
+from datetime import datetime, timezone
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from commit_hooks import forget_on_rollback
+from models import db, Notification
+from stats import adjust_unread_counts
+
+# session.info key holding the rows queued in the current transaction
+OUTBOX_KEY = 'notification_outbox'
+
+
+def queue_notification(user_id, message, notification_type='info', session=None):
+    """Queue a notification to be written when the current transaction commits.
+
+    Nothing is sent to the database here: every queued row is inserted with
+    one executemany just before the commit of the change it reports, and is
+    dropped if that transaction rolls back.
+    """
+    session = session or db.session()
+    session.info.setdefault(OUTBOX_KEY, []).append({
+        'user_id': user_id,
+        'message': message,
+        'notification_type': notification_type,
+        'is_read': False,
+        'created_at': datetime.now(timezone.utc)
+    })
+
+
+def pending_notifications(session=None):
+    """Rows queued in the session's current transaction"""
+    session = session or db.session()
+    return list(session.info.get(OUTBOX_KEY, ()))
+
+
+def flush_outbox(session):
+    """Bulk-insert the queued rows in the session's transaction and bump
+    the recipients' unread counters; returns how many were written"""
+    rows = session.info.pop(OUTBOX_KEY, None)
+    if not rows:
+        return 0
+    session.execute(db.insert(Notification), rows)
+    deltas = {}
+    for row in rows:
+        deltas[row['user_id']] = deltas.get(row['user_id'], 0) + 1
+    adjust_unread_counts(deltas)
+    return len(rows)
+
+
+@event.listens_for(Session, 'before_commit')
+def _flush_before_commit(session):
+    flush_outbox(session)
+
+
+forget_on_rollback(OUTBOX_KEY)
@@ -0,0 +1,124 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from flask import current_app, request
+from sqlalchemy import Select
+from models import db
+
+
+class KeysetPage:
+    """One page of a keyset-paginated query.
+
+    `next_cursor` is an opaque token for the page after this one, or None on
+    the last page.
+    """
+
+    def __init__(self, items, next_cursor, per_page):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    """Inverse of `_encode_value`. Raises ValueError for anything else, so a
+    tampered cursor never reaches the query"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, dict) and len(value) == 1:
+        if isinstance(value.get('dt'), str):
+            return datetime.fromisoformat(value['dt'])
+        if isinstance(value.get('d'), str):
+            return date.fromisoformat(value['d'])
+    raise ValueError(f'Unexpected cursor value {value!r}')
+
+
+def encode_cursor(values):
+    payload = json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, width):
+    """Decode a cursor produced by `encode_cursor`; None if it is malformed
+    or tampered with, which callers treat as the first page"""
+    if not cursor:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(payload)
+        if not isinstance(values, list):
+            return None
+        values = [_decode_value(value) for value in values]
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if len(values) != width:
+        return None
+    return values
+
+
+def _after(sort_keys, values):
+    # (a, b) after (x, y)  <=>  a > x OR (a = x AND b > y), per-column direction
+    clauses = []
+    for position, ((column, descending), value) in enumerate(zip(sort_keys, values)):
+        equal = [sort_keys[index][0] == values[index] for index in range(position)]
+        clauses.append(db.and_(*equal, column < value if descending else column > value))
+    return db.or_(*clauses)
+
+
+def get_page_size(default=None):
+    """Page size from the `per_page` query argument, bounded by MAX_PAGE_SIZE"""
+    default = default or current_app.config['PAGE_SIZE']
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, current_app.config['MAX_PAGE_SIZE']))
+
+
+def paginate_keyset(query, sort_keys, cursor=None, per_page=None):
+    """Return the page of `query` (an ORM query or a Core select) that
+    follows `cursor`.
+
+    `sort_keys` is a list of (column, descending) pairs whose combined values
+    are unique per row, normally ending with the primary key. Each page is a
+    range scan on the sort key, so deep pages cost the same as the first.
+    """
+    per_page = per_page or get_page_size()
+    width = len(sort_keys)
+    columns = [column for column, _ in sort_keys]
+
+    query = query.order_by(None).add_columns(*columns)
+    values = decode_cursor(cursor, width)
+    if values is not None:
+        query = query.filter(_after(sort_keys, values))
+
+    query = query.order_by(
+        *[column.desc() if descending else column.asc() for column, descending in sort_keys]
+    ).limit(per_page + 1)
+    if isinstance(query, Select):
+        rows = db.session.execute(query).all()
+    else:
+        rows = query.all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(list(rows[-1][-width:]))
+
+    items = [row[0] if len(row) == width + 1 else tuple(row[:-width]) for row in rows]
+    return KeysetPage(items, next_cursor, per_page)
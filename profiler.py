@@ -0,0 +1,159 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from models import db
+
+slow_request_logger = logging.getLogger('library.slow_requests')
+
+# Longest bound-parameter repr kept per statement
+MAX_PARAMETERS_LENGTH = 500
+
+
+class QueryCounter:
+    """Collects the SQL statements an engine executes while active"""
+
+    def __init__(self):
+        self.statements = []
+        self.parameters = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+        self.parameters.append(parameters)
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Count the statements executed on `engine` (default: every engine of
+    the app, primary and replica)"""
+    engines = [engine] if engine is not None else list(db.engines.values())
+    counter = QueryCounter()
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', counter._record)
+    try:
+        yield counter
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', counter._record)
+
+
+class SQLProfiler:
+    """Per-request SQL instrumentation (opt-in via SQL_PROFILER_ENABLED).
+
+    Counts statements and database time for every request, keeps the
+    slowest statements with their parameters, stores the last
+    SQL_PROFILER_BUFFER_SIZE request profiles in a ring buffer and logs
+    requests slower than SLOW_REQUEST_MS as JSON to 'library.slow_requests'.
+    """
+
+    def __init__(self, app=None):
+        self.profiles = deque()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.profiles = deque(maxlen=app.config['SQL_PROFILER_BUFFER_SIZE'])
+        self.slow_request_ms = app.config['SLOW_REQUEST_MS']
+        self.top_statements = app.config['SQL_PROFILER_TOP_STATEMENTS']
+        app.extensions['sql_profiler'] = self
+
+        with app.app_context():
+            engines = list(db.engines.values())  # primary and replica
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._profiler_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_profiler_started', None)
+        if started is None or not has_request_context() or 'sql_profile' not in g:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        profile = g.sql_profile
+        profile['queries'] += 1
+        profile['db_ms'] += elapsed_ms
+        profile['statements'].append({
+            'sql': statement,
+            'parameters': repr(parameters)[:MAX_PARAMETERS_LENGTH],
+            'ms': round(elapsed_ms, 3)
+        })
+
+    def _start_request(self):
+        g.sql_profile = {'queries': 0, 'db_ms': 0.0, 'statements': [], 'started': time.perf_counter()}
+
+    def _finish_request(self, response):
+        profile = g.pop('sql_profile', None)
+        if profile is None:
+            return response
+
+        statements = sorted(profile['statements'], key=lambda statement: statement['ms'], reverse=True)
+        record = {
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': profile['queries'],
+            'db_ms': round(profile['db_ms'], 3),
+            'total_ms': round((time.perf_counter() - profile['started']) * 1000, 3),
+            'slowest_statements': statements[:self.top_statements],
+            'at': time.time()
+        }
+        with self._lock:
+            self.profiles.append(record)
+
+        if record['total_ms'] >= self.slow_request_ms:
+            slow_request_logger.warning(json.dumps(record))
+        return response
+
+    def recent(self):
+        with self._lock:
+            return list(self.profiles)
+
+    def endpoint_summary(self):
+        """Aggregate the buffered profiles per endpoint, slowest first"""
+        summary = {}
+        for record in self.recent():
+            entry = summary.setdefault(record['endpoint'] or record['path'], {
+                'requests': 0, 'queries': 0, 'max_queries': 0,
+                'db_ms': 0.0, 'max_db_ms': 0.0, 'total_ms': 0.0, 'max_total_ms': 0.0,
+                'slowest_statement': None
+            })
+            entry['requests'] += 1
+            entry['queries'] += record['queries']
+            entry['max_queries'] = max(entry['max_queries'], record['queries'])
+            entry['db_ms'] += record['db_ms']
+            entry['max_db_ms'] = max(entry['max_db_ms'], record['db_ms'])
+            entry['total_ms'] += record['total_ms']
+            entry['max_total_ms'] = max(entry['max_total_ms'], record['total_ms'])
+            for statement in record['slowest_statements'][:1]:
+                if entry['slowest_statement'] is None or statement['ms'] > entry['slowest_statement']['ms']:
+                    entry['slowest_statement'] = statement
+
+        rows = []
+        for endpoint, entry in summary.items():
+            requests = entry['requests']
+            rows.append({
+                'endpoint': endpoint,
+                'requests': requests,
+                'avg_queries': round(entry['queries'] / requests, 2),
+                'max_queries': entry['max_queries'],
+                'avg_db_ms': round(entry['db_ms'] / requests, 3),
+                'max_db_ms': entry['max_db_ms'],
+                'avg_total_ms': round(entry['total_ms'] / requests, 3),
+                'max_total_ms': entry['max_total_ms'],
+                'slowest_statement': entry['slowest_statement']
+            })
+        return sorted(rows, key=lambda row: row['avg_total_ms'], reverse=True)
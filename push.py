@@ -0,0 +1,338 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from models import db, User, Notification, chunked
+from replica import use_primary
+
+logger = logging.getLogger(__name__)
+
+# Most notifications sent per read, and kept in a stream's mailbox
+REPLAY_LIMIT = 100
+
+# Seconds a client turned away by the stream caps is asked to wait
+STREAM_LIMIT_RETRY_AFTER = 30
+
+
+class StreamLimitReached(Exception):
+    """No stream slot is free for the user (`per_user`) or the process"""
+
+    def __init__(self, message, per_user):
+        super().__init__(message)
+        self.per_user = per_user
+
+
+class Subscription:
+    """One open stream's mailbox, filled by the broker's shared poll"""
+
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self._rows = deque(maxlen=REPLAY_LIMIT)
+        self._count = None
+        self._delivered_count = None
+        self._missed = False
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+    def deliver(self, rows, count=None):
+        """Queue new rows and the latest unread count; wakes the stream
+        unless neither is news"""
+        with self._lock:
+            if not rows and count in (None, self._delivered_count):
+                return
+            if len(self._rows) + len(rows) > REPLAY_LIMIT:
+                self._missed = True  # the stream re-reads from the table
+            self._rows.extend(rows)
+            if count is not None:
+                self._count = self._delivered_count = count
+        self._event.set()
+
+    def take(self):
+        """(rows, unread count or None, missed) delivered since the last
+        call; `missed` means rows were dropped and must be re-read"""
+        with self._lock:
+            rows, count, missed = list(self._rows), self._count, self._missed
+            self._rows.clear()
+            self._count, self._missed = None, False
+        return rows, count, missed
+
+    def wait(self, timeout):
+        """Block until woken or `timeout` seconds pass; True if woken"""
+        woken = self._event.wait(timeout)
+        self._event.clear()
+        return woken
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+def _max_notification_id():
+    with use_primary():
+        return db.session.query(db.func.max(Notification.id)).scalar() or 0
+
+
+class MemoryBroker:
+    """In-process pub/sub fanning news out to the open streams.
+
+    Commits publish the users whose notifications or unread count changed.
+    One poller thread per process then reads the new notifications and the
+    unread counts of those users that have open streams, with one query
+    each for all of them, and delivers them to the streams' mailboxes. An
+    open stream so runs no query of its own after connecting, however many
+    are open. Only streams served by the publishing process are reached;
+    see DatabasePollingBroker for several processes. The poller starts with
+    the first stream and stops when the last one closes.
+
+    PUSH_MAX_STREAMS and PUSH_MAX_STREAMS_PER_USER cap the open streams:
+    each holds a worker (thread or greenlet) for its whole life.
+    """
+
+    # Seconds between passes nothing was published for (None: wait for one)
+    poll_interval = None
+
+    def __init__(self, app):
+        self.app = app
+        self.max_streams = app.config['PUSH_MAX_STREAMS']
+        self.max_streams_per_user = app.config['PUSH_MAX_STREAMS_PER_USER']
+        self._subscriptions = defaultdict(set)
+        self._pending = set()
+        self._last_id = None
+        self._poller = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        """Open a mailbox for one of the user's streams; raises
+        StreamLimitReached past the caps. Runs in an app context."""
+        if self._last_id is None:
+            self._last_id = _max_notification_id()
+        subscription = Subscription(self, user_id)
+        with self._lock:
+            if sum(len(subscriptions) for subscriptions in self._subscriptions.values()) >= self.max_streams:
+                raise StreamLimitReached('Too many open notification streams; try again later.', per_user=False)
+            if len(self._subscriptions.get(user_id, ())) >= self.max_streams_per_user:
+                raise StreamLimitReached('Too many open notification streams for this account.', per_user=True)
+            self._subscriptions[user_id].add(subscription)
+            poller = None
+            if self._poller is None:
+                poller = self._poller = threading.Thread(target=self._poll_forever, name='library-push-poll',
+                                                         daemon=True)
+        if poller is not None:
+            poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+            if not self._subscriptions:
+                self._wakeup.set()  # let the poller stop
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def subscribed_users(self):
+        with self._lock:
+            return set(self._subscriptions)
+
+    def publish(self, user_ids):
+        with self._lock:
+            self._pending.update(user_ids)
+        self._wakeup.set()
+
+    def _poll_forever(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            with self._lock:
+                if not self._subscriptions:
+                    self._poller = None
+                    return
+            with self.app.app_context():
+                try:
+                    self.poll()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Push broker poll failed')
+                finally:
+                    db.session.remove()
+
+    def _users_to_recount(self, published, subscribed):
+        """Users whose unread count may have changed since the last pass"""
+        return published & subscribed
+
+    def poll(self):
+        """One shared pass: read the new notifications and unread counts of
+        the users with open streams and deliver them. Runs in an app
+        context; returns the users reached."""
+        with self._lock:
+            published, self._pending = self._pending, set()
+            subscribed = set(self._subscriptions)
+        if not subscribed:
+            return set()
+
+        # Reads the primary: a lagging replica would hold back news
+        with use_primary():
+            last_id, max_id = self._last_id, _max_notification_id()
+            rows = []
+            if last_id is not None and max_id > last_id:
+                for chunk in chunked(sorted(subscribed)):
+                    rows.extend(db.session.query(
+                        Notification.id, Notification.user_id, Notification.message,
+                        Notification.notification_type, Notification.created_at
+                    ).filter(
+                        Notification.id > last_id, Notification.id <= max_id, Notification.user_id.in_(chunk)
+                    ))
+            self._last_id = max_id
+
+            users = self._users_to_recount(published, subscribed) | {row.user_id for row in rows}
+            counts = {}
+            for chunk in chunked(sorted(users)):
+                counts.update(db.session.query(User.id, User.unread_notifications).filter(User.id.in_(chunk)))
+
+        news = defaultdict(list)
+        for row in sorted(rows, key=lambda row: row.id):
+            news[row.user_id].append(row)
+        with self._lock:
+            subscriptions = [(subscription, subscription.user_id) for user_id in users
+                             for subscription in self._subscriptions.get(user_id, ())]
+        for subscription, user_id in subscriptions:
+            subscription.deliver(news[user_id], counts.get(user_id, 0))
+        return users
+
+
+class DatabasePollingBroker(MemoryBroker):
+    """Broker stand-in for deployments running several processes.
+
+    Besides the passes local commits trigger, the poller makes a pass every
+    PUSH_POLL_INTERVAL seconds and then recounts every subscribed user, so
+    notifications written and notifications read by other processes reach
+    this process's streams too. Swap it for a real broker (Redis pub/sub,
+    Postgres LISTEN/NOTIFY) by feeding `publish` from it instead.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.poll_interval = app.config['PUSH_POLL_INTERVAL']
+
+    def _users_to_recount(self, published, subscribed):
+        return subscribed
+
+
+PUSH_BROKERS = {
+    'memory': MemoryBroker,
+    'database': DatabasePollingBroker,
+}
+
+
+def create_broker(app):
+    """Build the broker named by PUSH_BROKER and register it on the app"""
+    name = app.config['PUSH_BROKER']
+    if name not in PUSH_BROKERS:
+        raise ValueError(f"Unknown PUSH_BROKER {name!r}; expected one of {', '.join(PUSH_BROKERS)}")
+    broker = PUSH_BROKERS[name](app)
+    app.extensions['push_broker'] = broker
+    return broker
+
+
+def format_event(data, event=None, event_id=None):
+    """Encode one Server-Sent Events message"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    lines.extend(f'data: {line}' for line in json.dumps(data).splitlines())
+    return '\n'.join(lines) + '\n\n'
+
+
+def parse_last_event_id(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_news(user_id, after_id):
+    """Notifications after `after_id` and the unread count, releasing the
+    session so an idle stream holds no connection. Reads the primary: a
+    lagging replica would hold back events the broker just announced."""
+    try:
+        with use_primary():
+            rows = db.session.query(
+                Notification.id, Notification.message, Notification.notification_type, Notification.created_at
+            ).filter(Notification.user_id == user_id, Notification.id > after_id).order_by(
+                Notification.id
+            ).limit(REPLAY_LIMIT).all()
+            count = db.session.query(User.unread_notifications).filter(User.id == user_id).scalar() or 0
+        return rows, count
+    finally:
+        db.session.remove()
+
+
+def _latest_notification_id(user_id):
+    try:
+        with use_primary():
+            return db.session.query(db.func.max(Notification.id)).filter(
+                Notification.user_id == user_id
+            ).scalar() or 0
+    finally:
+        db.session.remove()
+
+
+def notification_stream(subscription, last_event_id=None, heartbeat=15, max_seconds=300, retry_ms=3000):
+    """Yield SSE messages for one subscribed stream.
+
+    Sends `notification` events (id = notification id) and `count` events
+    with the unread count whenever it changes. With `last_event_id` the
+    notifications after it are replayed from the table first; without it
+    the stream starts at the user's newest one. After that the stream
+    queries nothing itself: the broker's shared poll fills its mailbox, and
+    a comment heartbeat is sent every `heartbeat` seconds without news. The
+    stream ends after `max_seconds`, closing the subscription; the browser
+    then reconnects with Last-Event-ID.
+    """
+    user_id = subscription.user_id
+    try:
+        cursor = last_event_id if last_event_id is not None else _latest_notification_id(user_id)
+        count = None
+        deadline = time.monotonic() + max_seconds
+        yield f'retry: {retry_ms}\n\n'
+        read = True
+        while True:
+            if read:
+                rows, latest = _read_news(user_id, cursor)
+                read = len(rows) == REPLAY_LIMIT  # more to replay
+            else:
+                rows, latest, read = subscription.take()
+                if read:
+                    continue  # the mailbox overflowed; re-read from the cursor
+            for row in rows:
+                if row.id <= cursor:
+                    continue  # replayed already
+                cursor = row.id
+                yield format_event({
+                    'id': row.id,
+                    'message': row.message,
+                    'type': row.notification_type,
+                    'created_at': row.created_at.isoformat() if row.created_at else None
+                }, event='notification', event_id=row.id)
+            if latest is not None and latest != count:
+                count = latest
+                yield format_event({'count': count}, event='count')
+            if read:
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if not subscription.wait(min(heartbeat, remaining)):
+                yield ': heartbeat\n\n'
+    finally:
+        subscription.close()
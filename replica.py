@@ -0,0 +1,112 @@
+import time
+from contextlib import contextmanager
+from flask import current_app, g, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+
+# Bind key of the read replica in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+# session.info flag: this session has written to the primary
+WROTE_KEY = 'replica_wrote'
+# Flask session key: read from the primary until this time (epoch seconds)
+STICKY_KEY = 'db_primary_until'
+
+
+def _is_read(clause):
+    if getattr(clause, 'is_select', False):
+        return True
+    if getattr(clause, 'is_text', False):
+        return clause.text.lstrip()[:6].upper() == 'SELECT'
+    return False
+
+
+class RoutingSession(Session):
+    """Session that sends a request's reads to the replica bind.
+
+    Reads go to the replica only while the request allows it (`g.read_replica`,
+    set by `ReadReplica` for GET requests) and outside `use_primary` blocks.
+    Flushes, DML, non-SELECT text and bare `connection()` calls go to the
+    primary; after the first of them the rest of the request reads from the
+    primary too, so it sees its own writes. Without a replica bind this is the plain Flask-SQLAlchemy
+    session.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and REPLICA_BIND in self._db.engines:
+            if not self._flushing and _is_read(clause):
+                if g.get('read_replica') and not g.get('use_primary'):
+                    return self._db.engines[REPLICA_BIND]
+            else:
+                self.info[WROTE_KEY] = True
+                g.read_replica = False
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def use_primary():
+    """Send the reads inside the block to the primary, even in a request
+    that may use the replica. For reads that must be current: values that
+    get cached beyond the request, and live streams."""
+    previous = g.get('use_primary', False)
+    g.use_primary = True
+    try:
+        yield
+    finally:
+        g.use_primary = previous
+
+
+class ReadReplica:
+    """Route GET requests' reads to the replica with read-your-writes stickiness.
+
+    A request that writes pins its browser session to the primary for
+    REPLICA_STICKY_SECONDS, long enough for the replica to catch up, so
+    users always see their own changes. Only active when SQLALCHEMY_BINDS
+    has a `replica` entry.
+    """
+
+    def __init__(self, app):
+        self.sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+        app.extensions['read_replica'] = self
+        app.before_request(self._route_reads)
+        app.after_request(self._pin_after_write)
+
+    def _route_reads(self):
+        g.read_replica = request.method in ('GET', 'HEAD') and session.get(STICKY_KEY, 0) <= time.time()
+
+    def _pin_after_write(self, response):
+        db = current_app.extensions['sqlalchemy']
+        if db.session.info.get(WROTE_KEY):
+            session[STICKY_KEY] = time.time() + self.sticky_seconds
+        return response
+
+
+def replica_configured(app):
+    return bool(app.config.get('SQLALCHEMY_BINDS', {}).get(REPLICA_BIND))
+
+
+def is_sqlite_file_copy(app):
+    """Whether primary and replica are both SQLite files, so the replica can
+    be kept in sync locally by `sync_replica`"""
+    if not replica_configured(app):
+        return False
+    urls = [make_url(app.config['SQLALCHEMY_DATABASE_URI']),
+            make_url(app.config['SQLALCHEMY_BINDS'][REPLICA_BIND])]
+    return all(url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+               for url in urls)
+
+
+def sync_replica():
+    """Copy the primary SQLite file onto the replica with SQLite's online
+    backup. A stand-in for real replication when testing locally; it copies
+    the whole file, so keep it to small databases. Runs in an app context.
+    """
+    db = current_app.extensions['sqlalchemy']
+    source = db.engines[None].raw_connection()
+    try:
+        target = db.engines[REPLICA_BIND].raw_connection()
+        try:
+            source.driver_connection.backup(target.driver_connection)
+        finally:
+            target.close()
+    finally:
+        source.close()
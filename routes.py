@@ -1,17 +1,47 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, send_file, send_from_directory, Response, abort, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
-from models import db, User, Book, IssuedBook, Notification, Category
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from models import db, User, Book, IssuedBook, Notification, Category, LibraryStats
+from search import search_books
+from covers import COVER_FILENAME, InvalidCover, check_upload, release_cover, submit_cover
+from pagination import paginate_keyset
+from export import EXPORT_SHEETS, create_export_file, export_job, send_export_file
+from importer import IMPORT_EXTENSIONS, import_job, stage_import
+from outbox import queue_notification
+from circulation import BatchConflict, BatchError, apply_batch, close_loan, parse_operations, release_copy, take_copy
+from jobs import JOB_DONE
+from database_browser import BROWSER_TABLES, browse_table, database_overview
+from stats import adjust_stats, adjust_category_count, clear_unread_count, overdue_count, reconcile_stats
+from unread import unread_count
+from fines import PaymentError, fine_summary, post_return_fines, record_payment
+from push import STREAM_LIMIT_RETRY_AFTER, StreamLimitReached, notification_stream, parse_last_event_id
 from datetime import datetime, timedelta, timezone
-import os
-import xlsxwriter
-from io import BytesIO
 
 main = Blueprint('main', __name__)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
+def _cover_upload():
+    """The request's cover photo if one was uploaded; InvalidCover if it is
+    not a usable image"""
+    file = request.files.get('cover_photo')
+    if not file or file.filename == '' or not allowed_file(file.filename):
+        return None
+    check_upload(file.stream)
+    return file
+
+def _get_or_create_category(name):
+    """Category for a book form's category name, added if it is new"""
+    name = name.strip()
+    category = Category.query.filter_by(name=name).first()
+    if category is None:
+        category = Category(name=name, book_count=0)
+        db.session.add(category)
+        db.session.flush()
+    return category
+
 @main.route('/')
 def index():
     if current_user.is_authenticated:
@@ -59,6 +89,7 @@ def register():
         user = User(name=name, email=email, mobile=mobile, role=role)
         user.set_password(password)
         db.session.add(user)
+        adjust_stats(students=1 if role == 'student' else 0)
         db.session.commit()
         
         flash('Registration successful! Please login.', 'success')
@@ -80,26 +111,35 @@ def admin_dashboard():
         flash('Access denied. Admin privileges required.', 'danger')
         return redirect(url_for('main.student_dashboard'))
     
-    # Get statistics
-    total_books = Book.query.count()
-    total_visitors = User.query.filter_by(role='student').count()
-    issued_books = IssuedBook.query.filter(IssuedBook.return_date.is_(None)).count()
-    available_books = db.session.query(db.func.sum(Book.available_copies)).scalar() or 0
+    # Get statistics from the maintained stats row
+    stats = LibraryStats.get()
+    if stats is None:
+        reconcile_stats()
+        stats = LibraryStats.get()
     
     # Recent activities
-    recent_issues = IssuedBook.query.order_by(IssuedBook.issue_date.desc()).limit(5).all()
-    overdue_books = IssuedBook.query.filter(
-        IssuedBook.return_date.is_(None),
-        IssuedBook.due_date < datetime.now(timezone.utc)
-    ).all()
+    recent_issues = IssuedBook.query.options(
+        joinedload(IssuedBook.user), joinedload(IssuedBook.book)
+    ).order_by(IssuedBook.issue_date.desc()).limit(5).all()
+    overdue_books = IssuedBook.query.options(
+        joinedload(IssuedBook.user), joinedload(IssuedBook.book)
+    ).filter(IssuedBook.is_overdue()).order_by(
+        IssuedBook.due_date
+    ).limit(current_app.config['DASHBOARD_OVERDUE_LIMIT']).all()
+    
+    # Outstanding fines from the per-user balances kept by the fine ledger
+    outstanding_fines, top_fine_balances = fine_summary(current_app.config['DASHBOARD_FINES_LIMIT'])
     
     return render_template('admin_dashboard.html', 
-                         total_books=total_books,
-                         total_visitors=total_visitors,
-                         issued_books=issued_books,
-                         available_books=available_books,
+                         total_books=stats.total_books,
+                         total_visitors=stats.students,
+                         issued_books=stats.open_loans,
+                         available_books=stats.available_copies,
+                         overdue_count=overdue_count(),
                          recent_issues=recent_issues,
-                         overdue_books=overdue_books)
+                         overdue_books=overdue_books,
+                         outstanding_fines=outstanding_fines,
+                         top_fine_balances=top_fine_balances)
 
 @main.route('/student/dashboard')
 @login_required
@@ -107,22 +147,19 @@ def student_dashboard():
     search = request.args.get('search', '')
     category = request.args.get('category', '')
     
-    query = Book.query
-    
-    if search:
-        query = query.filter(
-            (Book.title.contains(search)) |
-            (Book.author.contains(search))
-        )
-    
-    if category:
-        query = query.filter_by(category=category)
-    
-    books = query.all()
-    categories = db.session.query(Book.category).distinct().all()
-    categories = [cat[0] for cat in categories]
-    
-    return render_template('student_dashboard.html', books=books, categories=categories, search=search, selected_category=category)
+    # Ranked full-text search where available, paged by cursor
+    query, sort_keys = search_books(search, category)
+    page = paginate_keyset(query, sort_keys, request.args.get('cursor'),
+                           current_app.config['BOOKS_PER_PAGE'])
+    # Categories that have books, from the maintained counts
+    categories = [name for name, in db.session.query(Category.name).filter(
+        Category.book_count > 0
+    ).order_by(Category.name)]
+    
+    return render_template('student_dashboard.html', books=page.items, page=page,
+                         categories=categories, search=search, selected_category=category,
+                         fine_balance=db.session.query(User.fine_balance).filter(
+                             User.id == current_user.id).scalar())
 
 @main.route('/books')
 @login_required
@@ -131,8 +168,9 @@ def books():
         flash('Access denied. Admin privileges required.', 'danger')
         return redirect(url_for('main.student_dashboard'))
     
-    books = Book.query.all()
-    return render_template('books.html', books=books)
+    page = paginate_keyset(Book.query.options(joinedload(Book.category)), [(Book.id, False)],
+                           request.args.get('cursor'))
+    return render_template('books.html', books=page.items, page=page)
 
 @main.route('/books/add', methods=['GET', 'POST'])
 @login_required
@@ -144,37 +182,34 @@ def add_book():
     if request.method == 'POST':
         title = request.form['title']
         author = request.form['author']
-        category = request.form['category']
         total_copies = int(request.form['total_copies'])
         
-        # Handle file upload
-        cover_photo = None
-        if 'cover_photo' in request.files:
-            file = request.files['cover_photo']
-            if file and file.filename != '' and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                # Add timestamp to avoid conflicts
-                filename = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{filename}"
-                file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                
-                # Create directory if it doesn't exist
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                file.save(file_path)
-                cover_photo = filename
+        # Validate the cover up front; it is processed in the background
+        try:
+            cover = _cover_upload()
+        except InvalidCover as error:
+            flash(str(error), 'danger')
+            return redirect(url_for('main.add_book'))
         
+        category = _get_or_create_category(request.form['category'])
         book = Book(
             title=title,
             author=author,
             category=category,
             total_copies=total_copies,
-            available_copies=total_copies,
-            cover_photo=cover_photo
+            available_copies=total_copies
         )
         
         db.session.add(book)
+        adjust_stats(total_books=1, total_copies=total_copies, available_copies=total_copies)
+        adjust_category_count(category.id, 1)
         db.session.commit()
         
-        flash('Book added successfully!', 'success')
+        if cover:
+            submit_cover(book, cover, created_by=current_user.id)
+            flash('Book added successfully! The cover photo is being processed.', 'success')
+        else:
+            flash('Book added successfully!', 'success')
         return redirect(url_for('main.books'))
     
     categories = Category.query.order_by(Category.name).all()
@@ -190,41 +225,43 @@ def edit_book(book_id):
     book = Book.query.get_or_404(book_id)
     
     if request.method == 'POST':
+        try:
+            cover = _cover_upload()
+        except InvalidCover as error:
+            flash(str(error), 'danger')
+            return redirect(url_for('main.edit_book', book_id=book.id))
+        
         book.title = request.form['title']
         book.author = request.form['author']
-        book.category = request.form['category']
+        category = _get_or_create_category(request.form['category'])
+        if category.id != book.category_id:
+            adjust_category_count(book.category_id, -1)
+            adjust_category_count(category.id, 1)
+            book.category = category
         old_total = book.total_copies
         new_total = int(request.form['total_copies'])
         
         # Update available copies proportionally
         if new_total != old_total:
-            issued_count = old_total - book.available_copies
+            old_available = book.available_copies
+            issued_count = old_total - old_available
             book.total_copies = new_total
             book.available_copies = max(0, new_total - issued_count)
-        
-        # Handle file upload
-        if 'cover_photo' in request.files:
-            file = request.files['cover_photo']
-            if file and file.filename != '' and allowed_file(file.filename):
-                # Delete old file if exists
-                if book.cover_photo:
-                    old_file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], book.cover_photo)
-                    if os.path.exists(old_file_path):
-                        os.remove(old_file_path)
-                
-                filename = secure_filename(file.filename)
-                filename = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{filename}"
-                file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                file.save(file_path)
-                book.cover_photo = filename
+            adjust_stats(total_copies=new_total - old_total,
+                         available_copies=book.available_copies - old_available)
         
         db.session.commit()
-        flash('Book updated successfully!', 'success')
+        
+        # The old cover is replaced (and removed) once the new one is processed
+        if cover:
+            submit_cover(book, cover, created_by=current_user.id)
+            flash('Book updated successfully! The new cover photo is being processed.', 'success')
+        else:
+            flash('Book updated successfully!', 'success')
         return redirect(url_for('main.books'))
     
-    return render_template('edit_book.html', book=book)
+    categories = Category.query.order_by(Category.name).all()
+    return render_template('edit_book.html', book=book, categories=categories)
 
 @main.route('/books/delete/<int:book_id>')
 @login_required
@@ -240,18 +277,58 @@ def delete_book(book_id):
         flash('Cannot delete book. It is currently issued to students.', 'danger')
         return redirect(url_for('main.books'))
     
-    # Delete cover photo if exists
-    if book.cover_photo:
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], book.cover_photo)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    
+    # Cover files go after the commit, unless another book shares the image
+    release_cover(book)
     db.session.delete(book)
+    adjust_stats(total_books=-1, total_copies=-book.total_copies, available_copies=-book.available_copies)
+    adjust_category_count(book.category_id, -1)
     db.session.commit()
     
     flash('Book deleted successfully!', 'success')
     return redirect(url_for('main.books'))
 
+@main.route('/books/import', methods=['POST'])
+@login_required
+def import_books():
+    if not current_user.is_admin():
+        return jsonify({'error': 'Admin privileges required.'}), 403
+    
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        return jsonify({'error': 'Choose a .csv or .xlsx file to import.'}), 400
+    extension = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    if extension not in IMPORT_EXTENSIONS:
+        return jsonify({'error': 'Only .csv and .xlsx files can be imported.'}), 400
+    
+    path = stage_import(file, extension)
+    job = current_app.extensions['jobs'].submit('import', import_job, {'path': path},
+                                                created_by=current_user.id)
+    return jsonify(_job_response(job)), 202
+
+@main.route('/books/import/jobs/<job_id>')
+@login_required
+def import_job_status(job_id):
+    if not current_user.is_admin():
+        return jsonify({'error': 'Admin privileges required.'}), 403
+    
+    job = current_app.extensions['jobs'].get(job_id)
+    if job is None or job['kind'] != 'import':
+        return jsonify({'error': 'Import not found or expired.'}), 404
+    return jsonify(_job_response(job))
+
+@main.route('/covers/<filename>')
+def cover_image(filename):
+    # Names are content hashes, so a file never changes once written
+    if not COVER_FILENAME.match(filename):
+        abort(404)
+    response = send_from_directory(
+        current_app.config['UPLOAD_FOLDER'], filename,
+        max_age=current_app.config['COVER_CACHE_MAX_AGE'], etag=filename
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @main.route('/issue-book', methods=['GET', 'POST'])
 @login_required
 def issue_book():
@@ -270,10 +347,6 @@ def issue_book():
             flash('Invalid student or book selected.', 'danger')
             return redirect(url_for('main.issue_book'))
         
-        if not book.is_available():
-            flash('Book is not available for issue.', 'danger')
-            return redirect(url_for('main.issue_book'))
-        
         # Check if student already has this book
         existing_issue = IssuedBook.query.filter_by(
             user_id=student_id,
@@ -285,27 +358,49 @@ def issue_book():
             flash('Student already has this book issued.', 'danger')
             return redirect(url_for('main.issue_book'))
         
-        # Issue the book
-        issued_book = IssuedBook(user_id=student_id, book_id=book_id)
-        book.available_copies -= 1
+        # Take a copy only if one is left, in a single statement, so two
+        # desks cannot both issue the last copy
+        if not take_copy(book.id):
+            db.session.rollback()
+            flash('Book is not available for issue.', 'danger')
+            return redirect(url_for('main.issue_book'))
         
+        # Issue the book; the unique open-loan index rejects a concurrent
+        # duplicate, rolling back the copy taken above
+        issued_book = IssuedBook(user_id=student.id, book_id=book.id)
         db.session.add(issued_book)
-        db.session.commit()
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Student already has this book issued.', 'danger')
+            return redirect(url_for('main.issue_book'))
+        adjust_stats(available_copies=-1, open_loans=1)
         
-        # Create notification for student
-        Notification.create_notification(
-            student_id,
+        # Notify the student in the same commit as the loan
+        queue_notification(
+            student.id,
             f"Book '{book.title}' has been issued to you. Due date: {issued_book.due_date.strftime('%Y-%m-%d')}",
             'info'
         )
+        db.session.commit()
         
         flash('Book issued successfully!', 'success')
         return redirect(url_for('main.issue_book'))
     
-    visitors = User.query.filter_by(role='student').all()
-    books = Book.query.filter(Book.available_copies > 0).all()
+    students_page = paginate_keyset(
+        User.query.filter_by(role='student'),
+        [(User.name, False), (User.id, False)],
+        request.args.get('students_cursor')
+    )
+    books_page = paginate_keyset(
+        Book.query.filter(Book.available_copies > 0),
+        [(Book.title, False), (Book.id, False)],
+        request.args.get('books_cursor')
+    )
     
-    return render_template('issue_book.html', students=visitors, books=books)
+    return render_template('issue_book.html', students=students_page.items, books=books_page.items,
+                         students_page=students_page, books_page=books_page)
 
 @main.route('/return-book', methods=['GET', 'POST'])
 @login_required
@@ -323,31 +418,68 @@ def return_book():
             return redirect(url_for('main.return_book'))
         
         # Calculate fine if overdue
-        if issued_book.is_overdue():
-            issued_book.calculate_fine(current_app.config['FINE_PER_DAY'])
+        was_overdue = issued_book.is_overdue()
+        fine = issued_book.days_overdue() * current_app.config['FINE_PER_DAY'] if was_overdue else issued_book.fine
         
-        # Return the book
-        issued_book.return_date = datetime.now(timezone.utc)
-        issued_book.book.available_copies += 1
+        # Close the loan only if it is still open, so a double submit or a
+        # second desk cannot return it (and free a copy) twice
+        now = datetime.now(timezone.utc)
+        if not close_loan(issued_book.id, now, fine):
+            db.session.rollback()
+            flash('Invalid book return request.', 'danger')
+            return redirect(url_for('main.return_book'))
+        release_copy(issued_book.book_id)
+        # Book the part of the fine the nightly accrual has not yet
+        post_return_fines([(issued_book.id, issued_book.user_id, fine)], now)
         
-        db.session.commit()
+        adjust_stats(available_copies=1, open_loans=-1)
         
-        # Create notification for student
+        # Notify the student in the same commit as the return
         message = f"Book '{issued_book.book.title}' has been returned."
-        if issued_book.fine > 0:
-            message += f" Fine: ₹{issued_book.fine}"
+        if fine > 0:
+            message += f" Fine: ₹{fine}"
         
-        Notification.create_notification(
+        queue_notification(
             issued_book.user_id,
             message,
             'info'
         )
+        db.session.commit()
         
         flash('Book returned successfully!', 'success')
         return redirect(url_for('main.return_book'))
     
-    issued_books = IssuedBook.query.filter(IssuedBook.return_date.is_(None)).all()
-    return render_template('return_book.html', issued_books=issued_books)
+    page = paginate_keyset(
+        IssuedBook.query.options(
+            joinedload(IssuedBook.user), joinedload(IssuedBook.book)
+        ).filter(IssuedBook.return_date.is_(None)),
+        [(IssuedBook.due_date, False), (IssuedBook.id, False)],
+        request.args.get('cursor')
+    )
+    return render_template('return_book.html', issued_books=page.items, page=page)
+
+@main.route('/api/circulation/batch', methods=['POST'])
+@login_required
+def circulation_batch():
+    if not current_user.is_admin():
+        return jsonify({'error': 'Admin privileges required.'}), 403
+    
+    try:
+        operations = parse_operations(request.get_json(silent=True),
+                                      current_app.config['CIRCULATION_BATCH_LIMIT'])
+    except BatchError as error:
+        return jsonify({'error': str(error)}), 400
+    
+    try:
+        results = apply_batch(operations)
+    except BatchConflict as error:
+        return jsonify({'error': str(error)}), 409
+    return jsonify({
+        'results': results,
+        'issued': sum(1 for result in results if result['ok'] and result['op'] == 'issue'),
+        'returned': sum(1 for result in results if result['ok'] and result['op'] == 'return'),
+        'failed': sum(1 for result in results if not result['ok'])
+    })
 
 @main.route('/my-books')
 @login_required
@@ -356,27 +488,66 @@ def my_books():
         flash('This page is for students only.', 'info')
         return redirect(url_for('main.admin_dashboard'))
     
-    issued_books = IssuedBook.query.filter_by(user_id=current_user.id).order_by(IssuedBook.issue_date.desc()).all()
-    return render_template('my_books.html', issued_books=issued_books)
+    page = paginate_keyset(
+        IssuedBook.query.options(joinedload(IssuedBook.book)).filter_by(user_id=current_user.id),
+        [(IssuedBook.issue_date, True), (IssuedBook.id, True)],
+        request.args.get('cursor')
+    )
+    return render_template('my_books.html', issued_books=page.items, page=page)
 
 @main.route('/notifications')
 @login_required
 def notifications():
-    notifications = Notification.query.filter_by(user_id=current_user.id).order_by(Notification.created_at.desc()).all()
-    
     # Mark all as read
-    for notification in notifications:
-        notification.is_read = True
+    Notification.query.filter_by(user_id=current_user.id, is_read=False).update(
+        {'is_read': True}, synchronize_session=False
+    )
+    clear_unread_count(current_user.id)
     db.session.commit()
     
-    return render_template('notifications.html', notifications=notifications)
+    page = paginate_keyset(
+        Notification.query.filter_by(user_id=current_user.id),
+        [(Notification.created_at, True), (Notification.id, True)],
+        request.args.get('cursor')
+    )
+    return render_template('notifications.html', notifications=page.items, page=page)
 
 @main.route('/api/notifications/count')
 @login_required
 def notification_count():
-    count = current_user.get_unread_notifications_count()
+    count = unread_count(current_user.id)
     return jsonify({'count': count})
 
+@main.route('/api/notifications/stream')
+@login_required
+def notification_events():
+    # EventSource sends Last-Event-ID when reconnecting; the query
+    # parameter lets a page resume from an id it already has
+    last_event_id = parse_last_event_id(
+        request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    )
+    try:
+        subscription = current_app.extensions['push_broker'].subscribe(current_user.id)
+    except StreamLimitReached as error:
+        # 429 asks this user to close a tab; 503 says the process is full
+        return jsonify({'error': str(error)}), 429 if error.per_user else 503, {
+            'Retry-After': str(STREAM_LIMIT_RETRY_AFTER)
+        }
+    
+    stream = notification_stream(
+        subscription,
+        last_event_id,
+        heartbeat=current_app.config['PUSH_HEARTBEAT'],
+        max_seconds=current_app.config['PUSH_STREAM_MAX_SECONDS']
+    )
+    response = Response(stream_with_context(stream), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # let nginx pass events through unbuffered
+    })
+    # Frees the slot even if the stream is closed before its first read
+    response.call_on_close(subscription.close)
+    return response
+
 # Category Management Routes
 @main.route('/categories')
 @login_required
@@ -386,9 +557,10 @@ def categories():
         return redirect(url_for('main.student_dashboard'))
     
     categories = Category.query.order_by(Category.name).all()
+    book_counts = {category.name: category.book_count for category in categories}
     
     def books_in_category(category_name):
-        return Book.query.filter_by(category=category_name).count()
+        return book_counts.get(category_name, 0)
     
     return render_template('categories.html', categories=categories, books_in_category=books_in_category)
 
@@ -428,9 +600,8 @@ def delete_category(category_id):
     category = Category.query.get_or_404(category_id)
     
     # Check if any books use this category
-    books_with_category = Book.query.filter_by(category=category.name).count()
-    if books_with_category > 0:
-        flash(f'Cannot delete category. {books_with_category} books are using this category.', 'danger')
+    if category.book_count > 0:
+        flash(f'Cannot delete category. {category.book_count} books are using this category.', 'danger')
         return redirect(url_for('main.categories'))
     
     db.session.delete(category)
@@ -447,8 +618,20 @@ def memberships():
         flash('Access denied. Admin privileges required.', 'danger')
         return redirect(url_for('main.student_dashboard'))
     
-    visitors = User.query.filter_by(role='student').order_by(User.name).all()
-    return render_template('memberships.html', visitors=visitors)
+    # Optional ?status=active|expired filter, evaluated in SQL
+    status = request.args.get('status', '')
+    query = User.query.filter_by(role='student')
+    if status == 'active':
+        query = query.filter(User.is_membership_active())
+    elif status == 'expired':
+        query = query.filter(db.not_(User.is_membership_active()))
+    
+    page = paginate_keyset(
+        query,
+        [(User.name, False), (User.id, False)],
+        request.args.get('cursor')
+    )
+    return render_template('memberships.html', visitors=page.items, page=page, status=status)
 
 @main.route('/memberships/update/<int:user_id>', methods=['POST'])
 @login_required
@@ -471,9 +654,8 @@ def update_membership(user_id):
         user.membership_expiry = None
     
     user.membership_type = membership_type
-    db.session.commit()
     
-    # Create notification for user
+    # Notify the user in the same commit as the change
     membership_names = {
         'basic': 'Basic (Free)',
         '3month': '3 Month (₹100)',
@@ -481,15 +663,44 @@ def update_membership(user_id):
         'lifetime': 'Lifetime (₹600)'
     }
     
-    Notification.create_notification(
+    queue_notification(
         user.id,
         f"Your membership has been updated to {membership_names[membership_type]}.",
         'info'
     )
+    db.session.commit()
     
     flash(f'Membership updated successfully for {user.name}!', 'success')
     return redirect(url_for('main.memberships'))
 
+@main.route('/fines/pay/<int:user_id>', methods=['POST'])
+@login_required
+def pay_fine(user_id):
+    if not current_user.is_admin():
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('main.student_dashboard'))
+    
+    user = User.query.get_or_404(user_id)
+    try:
+        amount = float(request.form.get('amount', ''))
+    except ValueError:
+        flash('Enter the amount paid.', 'danger')
+        return redirect(url_for('main.admin_dashboard'))
+    
+    # Settles the user's loans oldest first and lowers their balance
+    try:
+        record_payment(user.id, amount)
+    except PaymentError as error:
+        db.session.rollback()
+        flash(str(error), 'danger')
+        return redirect(url_for('main.admin_dashboard'))
+    
+    queue_notification(user.id, f"Payment of ₹{amount:g} received toward your fines.", 'info')
+    db.session.commit()
+    
+    flash(f'Payment recorded for {user.name}.', 'success')
+    return redirect(url_for('main.admin_dashboard'))
+
 # Recent Issues Page
 @main.route('/recent-issues')
 @login_required
@@ -498,8 +709,12 @@ def recent_issues():
         flash('Access denied. Admin privileges required.', 'danger')
         return redirect(url_for('main.student_dashboard'))
     
-    recent_issues = IssuedBook.query.order_by(IssuedBook.issue_date.desc()).limit(50).all()
-    return render_template('recent_issues.html', recent_issues=recent_issues)
+    page = paginate_keyset(
+        IssuedBook.query.options(joinedload(IssuedBook.user), joinedload(IssuedBook.book)),
+        [(IssuedBook.issue_date, True), (IssuedBook.id, True)],
+        request.args.get('cursor')
+    )
+    return render_template('recent_issues.html', recent_issues=page.items, page=page)
 
 # Database Admin Page
 @main.route('/admin/database')
@@ -516,139 +731,66 @@ def database_admin():
         'total_tables': 5
     }
     
-    # Get table information and records
-    tables_info = []
-    
-    # Users table
-    users = User.query.all()
-    users_data = []
-    for user in users:
-        users_data.append({
-            'id': user.id,
-            'name': user.name,
-            'email': user.email,
-            'mobile': user.mobile,
-            'role': user.role,
-            'membership_type': user.membership_type,
-            'membership_expiry': user.membership_expiry.strftime('%Y-%m-%d %H:%M:%S') if user.membership_expiry else 'N/A',
-            'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        })
-    
-    tables_info.append({
-        'name': 'users',
-        'description': 'User accounts (visitors and admins)',
-        'record_count': len(users),
-        'columns': ['id', 'name', 'email', 'mobile', 'role', 'membership_type', 'membership_expiry', 'created_at'],
-        'records': users_data
-    })
+    # Counts and statistics only; records are loaded page by page from
+    # database_admin_rows
+    tables_info, db_stats = database_overview()
+    for table in tables_info:
+        table['rows_url'] = url_for('main.database_admin_rows', table=table['name'])
     
-    # Books table
-    books = Book.query.all()
-    books_data = []
-    for book in books:
-        books_data.append({
-            'id': book.id,
-            'title': book.title,
-            'author': book.author,
-            'category': book.category,
-            'total_copies': book.total_copies,
-            'available_copies': book.available_copies,
-            'cover_photo': book.cover_photo or 'N/A',
-            'created_at': book.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        })
-    
-    tables_info.append({
-        'name': 'books',
-        'description': 'Book inventory and details',
-        'record_count': len(books),
-        'columns': ['id', 'title', 'author', 'category', 'total_copies', 'available_copies', 'cover_photo', 'created_at'],
-        'records': books_data
-    })
+    return render_template('database_admin.html', 
+                         db_info=db_info,
+                         tables_info=tables_info,
+                         db_stats=db_stats)
+
+@main.route('/admin/database/<table>/rows')
+@login_required
+def database_admin_rows(table):
+    if not current_user.is_admin():
+        return jsonify({'error': 'Admin privileges required.'}), 403
     
-    # Issued Books table
-    issued_books = IssuedBook.query.all()
-    issued_books_data = []
-    for issued_book in issued_books:
-        issued_books_data.append({
-            'id': issued_book.id,
-            'user_id': issued_book.user_id,
-            'user_name': issued_book.user.name,
-            'book_id': issued_book.book_id,
-            'book_title': issued_book.book.title,
-            'issue_date': issued_book.issue_date.strftime('%Y-%m-%d %H:%M:%S'),
-            'due_date': issued_book.due_date.strftime('%Y-%m-%d %H:%M:%S'),
-            'return_date': issued_book.return_date.strftime('%Y-%m-%d %H:%M:%S') if issued_book.return_date else 'Not Returned',
-            'fine': f'₹{issued_book.fine}' if issued_book.fine > 0 else '₹0'
-        })
-    
-    tables_info.append({
-        'name': 'issued_books',
-        'description': 'Book issue and return records',
-        'record_count': len(issued_books),
-        'columns': ['id', 'user_id', 'user_name', 'book_id', 'book_title', 'issue_date', 'due_date', 'return_date', 'fine'],
-        'records': issued_books_data
-    })
+    if table not in BROWSER_TABLES:
+        return jsonify({'error': 'Unknown table.'}), 404
     
-    # Notifications table
-    notifications = Notification.query.all()
-    notifications_data = []
-    for notification in notifications:
-        notifications_data.append({
-            'id': notification.id,
-            'user_id': notification.user_id,
-            'user_name': notification.user.name,
-            'message': notification.message,
-            'notification_type': notification.notification_type,
-            'is_read': 'Yes' if notification.is_read else 'No',
-            'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        })
-    
-    tables_info.append({
-        'name': 'notifications',
-        'description': 'User notifications and alerts',
-        'record_count': len(notifications),
-        'columns': ['id', 'user_id', 'user_name', 'message', 'notification_type', 'is_read', 'created_at'],
-        'records': notifications_data
-    })
+    # Column filters are passed as filter_<column>=<value>
+    filters = {
+        key[len('filter_'):]: value
+        for key, value in request.args.items()
+        if key.startswith('filter_') and value
+    }
+    
+    try:
+        page = browse_table(
+            table,
+            sort=request.args.get('sort', 'id'),
+            descending=request.args.get('dir') == 'desc',
+            filters=filters,
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
     
-    # Categories table
-    categories = Category.query.all()
-    categories_data = []
-    for category in categories:
-        categories_data.append({
-            'id': category.id,
-            'name': category.name,
-            'created_at': category.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'books_count': Book.query.filter_by(category=category.name).count()
-        })
-    
-    tables_info.append({
-        'name': 'categories',
-        'description': 'Book categories and classifications',
-        'record_count': len(categories),
-        'columns': ['id', 'name', 'created_at', 'books_count'],
-        'records': categories_data
+    return jsonify({
+        'table': table,
+        'records': page.items,
+        'next_cursor': page.next_cursor
     })
+
+# SQL Profiler View
+@main.route('/admin/profiler')
+@login_required
+def sql_profiler():
+    if not current_user.is_admin():
+        return jsonify({'error': 'Admin privileges required.'}), 403
     
-    # Database statistics
-    db_stats = {
-        'total_records': sum(table['record_count'] for table in tables_info),
-        'active_visitors': User.query.filter_by(role='student').count(),
-        'admin_users': User.query.filter_by(role='admin').count(),
-        'total_books': Book.query.count(),
-        'books_issued': IssuedBook.query.filter(IssuedBook.return_date.is_(None)).count(),
-        'books_returned': IssuedBook.query.filter(IssuedBook.return_date.isnot(None)).count(),
-        'unread_notifications': Notification.query.filter_by(is_read=False).count(),
-        'overdue_books': IssuedBook.query.filter(
-            IssuedBook.return_date.is_(None),
-            IssuedBook.due_date < datetime.now(timezone.utc)
-        ).count()
-    }
+    profiler = current_app.extensions.get('sql_profiler')
+    if profiler is None:
+        return jsonify({'error': 'SQL profiler is disabled. Set SQL_PROFILER_ENABLED=true.'}), 404
     
-    return render_template('database_admin.html', 
-                         db_info=db_info,
-                         tables_info=tables_info,
-                         db_stats=db_stats)
+    recent = profiler.recent()
+    return jsonify({
+        'endpoints': profiler.endpoint_summary(),
+        'recent_requests': recent[-request.args.get('limit', 20, type=int):][::-1]
+    })
 
 # Excel Export Route
 @main.route('/admin/database/export')
@@ -658,107 +800,88 @@ def export_database():
         flash('Access denied. Admin privileges required.', 'danger')
         return redirect(url_for('main.student_dashboard'))
     
-    # Create Excel file in memory
-    output = BytesIO()
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
-    
-    # Export Users
-    worksheet = workbook.add_worksheet('Users')
-    users = User.query.all()
-    headers = ['ID', 'Name', 'Email', 'Mobile', 'Role', 'Membership Type', 'Membership Expiry', 'Created At']
-    
-    for col, header in enumerate(headers):
-        worksheet.write(0, col, header)
-    
-    for row, user in enumerate(users, 1):
-        worksheet.write(row, 0, user.id)
-        worksheet.write(row, 1, user.name)
-        worksheet.write(row, 2, user.email)
-        worksheet.write(row, 3, user.mobile or 'N/A')
-        worksheet.write(row, 4, user.role)
-        worksheet.write(row, 5, user.membership_type)
-        worksheet.write(row, 6, user.membership_expiry.strftime('%Y-%m-%d %H:%M:%S') if user.membership_expiry else 'N/A')
-        worksheet.write(row, 7, user.created_at.strftime('%Y-%m-%d %H:%M:%S'))
-    
-    # Export Books
-    worksheet = workbook.add_worksheet('Books')
-    books = Book.query.all()
-    headers = ['ID', 'Title', 'Author', 'Category', 'Total Copies', 'Available Copies', 'Cover Photo', 'Created At']
-    
-    for col, header in enumerate(headers):
-        worksheet.write(0, col, header)
-    
-    for row, book in enumerate(books, 1):
-        worksheet.write(row, 0, book.id)
-        worksheet.write(row, 1, book.title)
-        worksheet.write(row, 2, book.author)
-        worksheet.write(row, 3, book.category)
-        worksheet.write(row, 4, book.total_copies)
-        worksheet.write(row, 5, book.available_copies)
-        worksheet.write(row, 6, book.cover_photo or 'N/A')
-        worksheet.write(row, 7, book.created_at.strftime('%Y-%m-%d %H:%M:%S'))
-    
-    # Export Issued Books
-    worksheet = workbook.add_worksheet('Issued Books')
-    issued_books = IssuedBook.query.all()
-    headers = ['ID', 'User ID', 'User Name', 'Book ID', 'Book Title', 'Issue Date', 'Due Date', 'Return Date', 'Fine']
-    
-    for col, header in enumerate(headers):
-        worksheet.write(0, col, header)
-    
-    for row, issued_book in enumerate(issued_books, 1):
-        worksheet.write(row, 0, issued_book.id)
-        worksheet.write(row, 1, issued_book.user_id)
-        worksheet.write(row, 2, issued_book.user.name)
-        worksheet.write(row, 3, issued_book.book_id)
-        worksheet.write(row, 4, issued_book.book.title)
-        worksheet.write(row, 5, issued_book.issue_date.strftime('%Y-%m-%d %H:%M:%S'))
-        worksheet.write(row, 6, issued_book.due_date.strftime('%Y-%m-%d %H:%M:%S'))
-        worksheet.write(row, 7, issued_book.return_date.strftime('%Y-%m-%d %H:%M:%S') if issued_book.return_date else 'Not Returned')
-        worksheet.write(row, 8, issued_book.fine)
-    
-    # Export Notifications
-    worksheet = workbook.add_worksheet('Notifications')
-    notifications = Notification.query.all()
-    headers = ['ID', 'User ID', 'User Name', 'Message', 'Type', 'Is Read', 'Created At']
-    
-    for col, header in enumerate(headers):
-        worksheet.write(0, col, header)
-    
-    for row, notification in enumerate(notifications, 1):
-        worksheet.write(row, 0, notification.id)
-        worksheet.write(row, 1, notification.user_id)
-        worksheet.write(row, 2, notification.user.name)
-        worksheet.write(row, 3, notification.message)
-        worksheet.write(row, 4, notification.notification_type)
-        worksheet.write(row, 5, 'Yes' if notification.is_read else 'No')
-        worksheet.write(row, 6, notification.created_at.strftime('%Y-%m-%d %H:%M:%S'))
-    
-    # Export Categories
-    worksheet = workbook.add_worksheet('Categories')
-    categories = Category.query.all()
-    headers = ['ID', 'Name', 'Created At', 'Books Count']
-    
-    for col, header in enumerate(headers):
-        worksheet.write(0, col, header)
-    
-    for row, category in enumerate(categories, 1):
-        worksheet.write(row, 0, category.id)
-        worksheet.write(row, 1, category.name)
-        worksheet.write(row, 2, category.created_at.strftime('%Y-%m-%d %H:%M:%S'))
-        worksheet.write(row, 3, Book.query.filter_by(category=category.name).count())
-    
-    workbook.close()
-    
-    output.seek(0)
+    # Stream the export to a temp file instead of building it in memory
+    path = create_export_file()
     
     # Generate filename with timestamp
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f'library_database_export_{timestamp}.xlsx'
     
+    return send_export_file(path, filename)
+
+# Background Export Jobs
+def _parse_date(value):
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+# job kind -> status endpoint
+JOB_STATUS_ENDPOINTS = {
+    'export': 'main.export_job_status',
+    'import': 'main.import_job_status',
+}
+
+def _job_response(job):
+    data = {key: job[key] for key in ('id', 'kind', 'status', 'progress', 'result', 'error',
+                                      'created_at', 'started_at', 'finished_at', 'expires_at')}
+    data['status_url'] = url_for(JOB_STATUS_ENDPOINTS[job['kind']], job_id=job['id'])
+    if job['kind'] == 'export' and job['status'] == JOB_DONE:
+        data['download_url'] = url_for('main.download_export', job_id=job['id'])
+    return data
+
+@main.route('/admin/database/export/jobs', methods=['POST'])
+@login_required
+def start_export():
+    if not current_user.is_admin():
+        return jsonify({'error': 'Admin privileges required.'}), 403
+    
+    tables = request.form.getlist('tables') or list(EXPORT_SHEETS)
+    unknown = [table for table in tables if table not in EXPORT_SHEETS]
+    if unknown:
+        return jsonify({'error': f"Unknown tables: {', '.join(unknown)}"}), 400
+    
+    try:
+        start_date = _parse_date(request.form.get('start_date'))
+        end_date = _parse_date(request.form.get('end_date'))
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format.'}), 400
+    
+    job = current_app.extensions['jobs'].submit('export', export_job, {
+        'tables': tables,
+        'start_date': start_date.isoformat() if start_date else None,
+        'end_date': end_date.isoformat() if end_date else None
+    }, created_by=current_user.id)
+    
+    return jsonify(_job_response(job)), 202
+
+@main.route('/admin/database/export/jobs/<job_id>')
+@login_required
+def export_job_status(job_id):
+    if not current_user.is_admin():
+        return jsonify({'error': 'Admin privileges required.'}), 403
+    
+    job = current_app.extensions['jobs'].get(job_id)
+    if job is None or job['kind'] != 'export':
+        return jsonify({'error': 'Export not found or expired.'}), 404
+    return jsonify(_job_response(job))
+
+@main.route('/admin/database/export/jobs/<job_id>/download')
+@login_required
+def download_export(job_id):
+    if not current_user.is_admin():
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('main.student_dashboard'))
+    
+    runner = current_app.extensions['jobs']
+    job = runner.get(job_id)
+    if job is None or job['kind'] != 'export' or job['status'] != JOB_DONE:
+        flash('Export not found or expired.', 'danger')
+        return redirect(url_for('main.database_admin'))
+    
+    timestamp = datetime.fromisoformat(job['finished_at']).strftime('%Y%m%d_%H%M%S')
     return send_file(
-        output,
+        runner.file_path(job_id, '.xlsx'),
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         as_attachment=True,
-        download_name=filename
+        download_name=f'library_database_export_{timestamp}.xlsx'
     )
@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """Run registered jobs periodically, on a daemon thread (`start`) or in
+    the foreground (`run_forever`).
+
+    create_app only registers the jobs: one process per deployment runs
+    them, normally `flask run-scheduler`, so CLI commands and web workers
+    do not each repeat every sweep. Every job runs inside an application
+    context and gets a fresh database session, so jobs can use the models
+    exactly like a request handler does.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['scheduler'] = self
+
+    def add_job(self, name, func, interval):
+        """Register `func` to run every `interval` seconds (0 disables it)."""
+        if not interval or interval <= 0:
+            return
+        with self._lock:
+            self._jobs[name] = {
+                'func': func,
+                'interval': interval,
+                'next_run': time.monotonic() + interval
+            }
+
+    def job_names(self):
+        with self._lock:
+            return list(self._jobs)
+
+    def run_job(self, name):
+        """Run a registered job immediately in the calling thread."""
+        job = self._jobs[name]
+        with self.app.app_context():
+            try:
+                return job['func']()
+            except Exception:
+                db.session.rollback()
+                logger.exception('Scheduled job %s failed', name)
+            finally:
+                db.session.remove()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='library-scheduler', daemon=True)
+        self._thread.start()
+
+    def run_forever(self):
+        """Run the jobs in the calling thread until `shutdown` or Ctrl+C"""
+        self._stop.clear()
+        try:
+            self._run()
+        except KeyboardInterrupt:
+            pass
+
+    def shutdown(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self._lock:
+                due = [name for name, job in self._jobs.items() if job['next_run'] <= now]
+                for name in due:
+                    self._jobs[name]['next_run'] = now + self._jobs[name]['interval']
+                wait = min((job['next_run'] for job in self._jobs.values()), default=now + 60) - now
+
+            for name in due:
+                self.run_job(name)
+
+            self._stop.wait(max(wait, 1))
@@ -0,0 +1,123 @@
+import re
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+from models import db, Book, Category
+
+# Column weights for bm25(): a title hit outranks an author hit, which
+# outranks a category hit
+TITLE_WEIGHT = 10.0
+AUTHOR_WEIGHT = 5.0
+CATEGORY_WEIGHT = 1.0
+
+# Category names are indexed through books.category_id
+CATEGORY_NAME = '(SELECT name FROM categories WHERE id = {}.category_id)'
+
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, category, tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts (rowid, title, author, category)
+        VALUES (new.id, new.title, new.author, {CATEGORY_NAME.format('new')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, category_id ON books BEGIN
+        DELETE FROM books_fts WHERE rowid = old.id;
+        INSERT INTO books_fts (rowid, title, author, category)
+        VALUES (new.id, new.title, new.author, {CATEGORY_NAME.format('new')});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+        DELETE FROM books_fts WHERE rowid = old.id;
+    END""",
+]
+
+SEARCH_TRIGGERS = ['books_fts_insert', 'books_fts_update', 'books_fts_delete']
+
+books_fts = db.table('books_fts', db.column('rowid'))
+
+
+def ensure_search_index():
+    """Create the FTS5 index over books and its sync triggers on SQLite.
+
+    Returns True when full-text search is available. Engines without FTS5
+    keep using the LIKE based search.
+    """
+    current_app.extensions['search_index'] = False
+    if db.engine.dialect.name != 'sqlite':
+        return False
+
+    created = 'books_fts' not in inspect(db.engine).get_table_names()
+    try:
+        with db.engine.begin() as connection:
+            for statement in SEARCH_INDEX_DDL:
+                connection.execute(db.text(statement))
+    except OperationalError:
+        # SQLite built without the FTS5 extension
+        return False
+
+    if created:
+        rebuild_search_index()
+    current_app.extensions['search_index'] = True
+    return True
+
+
+def rebuild_search_index():
+    """Repopulate the FTS index from the books table"""
+    with db.engine.begin() as connection:
+        connection.execute(db.text('DELETE FROM books_fts'))
+        connection.execute(db.text(
+            'INSERT INTO books_fts (rowid, title, author, category) '
+            f"SELECT id, title, author, {CATEGORY_NAME.format('books')} FROM books"
+        ))
+
+
+def drop_search_triggers():
+    """Drop the sync triggers so a migration can alter the books table;
+    `ensure_search_index` recreates them"""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as connection:
+        for trigger in SEARCH_TRIGGERS:
+            connection.execute(db.text(f'DROP TRIGGER IF EXISTS {trigger}'))
+
+
+def has_search_index():
+    return current_app.extensions.get('search_index', False)
+
+
+def fts_query(search):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    terms = re.findall(r'\w+', search)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_books(search='', category=''):
+    """Return a Book query for the catalog filtered by `search` and `category`,
+    together with the keyset sort keys for paging it.
+
+    With the FTS index, matches are ranked by bm25 relevance; otherwise the
+    query falls back to substring matching on title and author.
+    """
+    query = Book.query.options(joinedload(Book.category))
+
+    if category:
+        query = query.filter(Book.category_id == db.select(Category.id).where(
+            Category.name == category
+        ).scalar_subquery())
+
+    if not search:
+        return query, [(Book.id, False)]
+
+    match = fts_query(search)
+    if match and has_search_index():
+        fts = db.literal_column('books_fts')
+        rank = db.func.bm25(fts, TITLE_WEIGHT, AUTHOR_WEIGHT, CATEGORY_WEIGHT)
+        query = query.join(books_fts, books_fts.c.rowid == Book.id).filter(fts.op('MATCH')(match))
+        return query, [(rank, False), (Book.id, False)]
+
+    query = query.filter(
+        (Book.title.contains(search)) |
+        (Book.author.contains(search))
+    )
+    return query, [(Book.id, False)]
@@ -0,0 +1,160 @@
+import logging
+from datetime import datetime, timezone
+from commit_hooks import touch
+from models import db, User, Book, IssuedBook, Category, LibraryStats, Notification, chunked, count_rows
+
+logger = logging.getLogger(__name__)
+
+# session.info key: users whose unread count changed in the transaction
+UNREAD_TOUCHED_KEY = 'unread_counts_touched'
+
+
+def adjust_stats(**deltas):
+    """Apply counter deltas to the stats row in the current transaction.
+
+    The update is a single `SET counter = counter + delta` statement, so
+    concurrent writers never lose each other's changes. Call it before the
+    commit of the change it accounts for.
+    """
+    values = {name: getattr(LibraryStats, name) + delta for name, delta in deltas.items() if delta}
+    if not values:
+        return
+    values['updated_at'] = datetime.now(timezone.utc)
+    db.session.execute(db.update(LibraryStats).where(LibraryStats.id == 1).values(values))
+
+
+def adjust_category_count(category_id, delta):
+    """Add `delta` to a category's book count in the current transaction"""
+    adjust_category_counts({category_id: delta})
+
+
+def adjust_category_counts(deltas):
+    """Apply {category_id: delta} to the book counts in one executemany"""
+    params = [{'category_id': category_id, 'delta': delta}
+              for category_id, delta in deltas.items() if category_id is not None and delta]
+    if not params:
+        return
+    statement = db.update(Category.__table__).where(
+        Category.__table__.c.id == db.bindparam('category_id')
+    ).values(book_count=Category.__table__.c.book_count + db.bindparam('delta'))
+    db.session.connection().execute(statement, params)
+
+
+def adjust_unread_counts(deltas):
+    """Apply {user_id: delta} to the users' unread notification counters
+    in one executemany, in the current transaction"""
+    params = [{'user_id': user_id, 'delta': delta} for user_id, delta in deltas.items() if delta]
+    if not params:
+        return
+    users = User.__table__
+    db.session.connection().execute(
+        db.update(users).where(users.c.id == db.bindparam('user_id')).values(
+            unread_notifications=users.c.unread_notifications + db.bindparam('delta')
+        ),
+        params
+    )
+    touch(UNREAD_TOUCHED_KEY, deltas)
+
+
+def clear_unread_count(user_id):
+    """Zero a user's counter when all their notifications are marked read"""
+    users = User.__table__
+    db.session.connection().execute(db.update(users).where(users.c.id == user_id).values(
+        unread_notifications=0
+    ))
+    touch(UNREAD_TOUCHED_KEY, [user_id])
+
+
+def _unread_count():
+    return count_rows(Notification, Notification.user_id == User.id, Notification.is_read.is_(False))
+
+
+def refresh_unread_counts(user_ids):
+    """Recount the unread notifications of the given users, for writers
+    that cannot tell how many rows they added per user"""
+    user_ids = list(user_ids)
+    users = User.__table__
+    for chunk in chunked(user_ids):
+        db.session.connection().execute(db.update(users).where(users.c.id.in_(chunk)).values(
+            unread_notifications=_unread_count()
+        ))
+    touch(UNREAD_TOUCHED_KEY, user_ids)
+
+
+def reconcile_unread_counts():
+    """Recount every user's unread notifications; returns {key: (stored,
+    actual)} drift"""
+    rows = db.session.query(User.id, User.unread_notifications, _unread_count()).filter(
+        User.unread_notifications != _unread_count()
+    ).all()
+    if rows:
+        refresh_unread_counts(user_id for user_id, _, _ in rows)
+    return {f'unread_notifications[user {user_id}]': (stored, actual) for user_id, stored, actual in rows}
+
+
+def compute_stats():
+    """Recompute every counter from the base tables in one query"""
+    row = db.session.query(
+        count_rows(Book).label('total_books'),
+        db.select(db.func.coalesce(db.func.sum(Book.total_copies), 0)).scalar_subquery().label('total_copies'),
+        db.select(db.func.coalesce(db.func.sum(Book.available_copies), 0)).scalar_subquery().label('available_copies'),
+        count_rows(User, User.role == 'student').label('students'),
+        count_rows(IssuedBook, IssuedBook.return_date.is_(None)).label('open_loans')
+    ).one()
+    return {name: getattr(row, name) for name in LibraryStats.COUNTERS}
+
+
+def _category_book_count():
+    return count_rows(Book, Book.category_id == Category.id)
+
+
+def reconcile_category_counts():
+    """Recount books per category; returns {name: (stored, actual)} drift"""
+    drift = {
+        f'book_count[{name}]': (stored, actual)
+        for name, stored, actual in db.session.query(
+            Category.name, Category.book_count, _category_book_count()
+        ).filter(Category.book_count != _category_book_count())
+    }
+    if drift:
+        db.session.execute(db.update(Category).values(book_count=_category_book_count()))
+    return drift
+
+
+def reconcile_stats():
+    """Rebuild the stats row, the per-category book counts and the per-user
+    unread counters from scratch and report drift.
+
+    Returns a dict of counter -> (stored, actual) for every counter that had
+    drifted; each drift is also logged as a warning.
+    """
+    counter_drift = reconcile_category_counts()
+    counter_drift.update(reconcile_unread_counts())
+    actual = compute_stats()
+    stats = LibraryStats.get()
+    if stats is None:
+        stats = LibraryStats(id=1)
+        db.session.add(stats)
+
+    drift = {}
+    for name, value in actual.items():
+        stored = getattr(stats, name)
+        if stored is not None and stored != value:
+            drift[name] = (stored, value)
+        setattr(stats, name, value)
+    drift.update(counter_drift)
+    stats.updated_at = datetime.now(timezone.utc)
+    db.session.commit()
+
+    for name, (stored, value) in drift.items():
+        logger.warning('Library stats drift: %s was %s, actual %s', name, stored, value)
+    return drift
+
+
+def overdue_count(now=None):
+    """Live count of overdue loans, a range scan of the open-loan due-date
+    index. Loans become overdue with time rather than with writes, so no
+    delta could keep a stored count right and the stats row has none."""
+    now = now or datetime.now(timezone.utc)
+    return db.session.query(count_rows(IssuedBook, IssuedBook.is_overdue(now))).scalar()
+
@@ -0,0 +1,98 @@
+from flask import current_app
+from models import db, Book, IssuedBook, Notification, chunked
+from stats import refresh_unread_counts
+from datetime import datetime, timedelta, timezone
+
+DEDUP_KEY = ('loan_id', 'kind', 'day_bucket')
+
+
+def _insert_ignore_sql():
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert(Notification).on_conflict_do_nothing(index_elements=list(DEDUP_KEY))
+
+
+def insert_keyed_notifications(rows):
+    """Insert alerts carrying a (loan_id, kind, day_bucket) key, skipping
+    any whose key already exists. Returns the number of rows inserted.
+
+    Uses INSERT ... ON CONFLICT DO NOTHING against the unique dedup index
+    where the engine supports it, otherwise probes the index per chunk.
+    """
+    if not rows:
+        return 0
+
+    statement = _insert_ignore_sql()
+    if statement is not None:
+        return db.session.connection().execute(statement, rows).rowcount
+
+    inserted = 0
+    for chunk in chunked(rows):
+        existing = set(db.session.query(Notification.loan_id, Notification.kind, Notification.day_bucket).filter(
+            Notification.loan_id.in_({row['loan_id'] for row in chunk}),
+            Notification.kind.in_({row['kind'] for row in chunk}),
+            Notification.day_bucket.in_({row['day_bucket'] for row in chunk})
+        ).all())
+        new_rows = [row for row in chunk if tuple(row[column] for column in DEDUP_KEY) not in existing]
+        if new_rows:
+            db.session.execute(db.insert(Notification), new_rows)
+            inserted += len(new_rows)
+    return inserted
+
+
+def _due_tomorrow_rows(now):
+    loans = db.session.query(IssuedBook.id, IssuedBook.user_id, Book.title).join(
+        Book, IssuedBook.book_id == Book.id
+    ).filter(IssuedBook.is_due_tomorrow(now))
+
+    return [{
+        'user_id': loan.user_id,
+        'message': f"Book '{loan.title}' is due tomorrow!",
+        'notification_type': 'warning',
+        'loan_id': loan.id,
+        'kind': Notification.KIND_DUE_TOMORROW,
+        'day_bucket': (now + timedelta(days=1)).date()
+    } for loan in loans]
+
+
+def _overdue_rows(now):
+    fine_per_day = current_app.config['FINE_PER_DAY']
+    loans = db.session.query(
+        IssuedBook.id, IssuedBook.user_id, IssuedBook.days_overdue(now).label('days_overdue'), Book.title
+    ).join(Book, IssuedBook.book_id == Book.id).filter(IssuedBook.is_overdue(now))
+
+    rows = []
+    for loan in loans:
+        fine = loan.days_overdue * fine_per_day
+        rows.append({
+            'user_id': loan.user_id,
+            'message': f"Book '{loan.title}' is overdue by {loan.days_overdue} days. Fine: ₹{fine}",
+            'notification_type': 'danger',
+            'loan_id': loan.id,
+            'kind': Notification.KIND_OVERDUE,
+            'day_bucket': now.date()
+        })
+    return rows
+
+
+def sweep_due_notifications(now=None):
+    """Create due-tomorrow and overdue notifications for every open loan.
+
+    Candidate loans are selected for all users at once and the alerts are
+    bulk-inserted in a single transaction; the unique (loan, kind, day) key
+    drops alerts that were already sent. Returns the number created.
+    """
+    now = now or datetime.now(timezone.utc)
+
+    rows = _due_tomorrow_rows(now) + _overdue_rows(now)
+    created = insert_keyed_notifications(rows)
+    if created:
+        # Skipped duplicates are not known per user: recount the recipients
+        refresh_unread_counts({row['user_id'] for row in rows})
+    db.session.commit()
+    return created
@@ -0,0 +1,141 @@
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import pytest
+from jinja2 import DictLoader
+
+from app import create_app
+from config import Config
+from models import db, User, Book, IssuedBook, Category
+from stats import adjust_category_counts
+
+ADMIN = ('admin@library.com', 'admin123')
+STUDENT = ('student@library.com', 'student123')
+
+LOAN_ROWS = '{% for loan in loans %}{{ loan.book.title }} {{ loan.user.name }} {{ loan.due_date }}{% endfor %}'
+
+# Stand-ins for the page templates, which are not in the tree: they touch
+# the same relationships the real pages do, so a lazy load per row still
+# shows up in query counts. Pages without a stub render as empty strings.
+STUB_TEMPLATES = {
+    'admin_dashboard.html': '{% with loans = recent_issues %}' + LOAN_ROWS + '{% endwith %}'
+                            '{% with loans = overdue_books %}' + LOAN_ROWS + '{% endwith %}',
+    'return_book.html': '{% with loans = issued_books %}' + LOAN_ROWS + '{% endwith %}',
+    'recent_issues.html': '{% with loans = recent_issues %}' + LOAN_ROWS + '{% endwith %}',
+    'my_books.html': '{% for loan in issued_books %}{{ loan.book.title }} {{ loan.due_date }}{% endfor %}',
+    'notifications.html': '{% for notification in notifications %}{{ notification.message }}{% endfor %}',
+    'student_dashboard.html': '{% for book in books %}{{ book.title }} {{ book.category.name }}{% endfor %}'
+                              '{% for category in categories %}{{ category.name }}{% endfor %}',
+    'issue_book.html': '{% for student in students %}{{ student.name }}{% endfor %}'
+                       '{% for book in books %}{{ book.title }}{% endfor %}',
+    'books.html': '{% for book in books %}{{ book.title }} {{ book.category.name }}{% endfor %}',
+    'categories.html': '{% for category in categories %}{{ category.name }}={{ books_in_category(category.name) }};'
+                       '{% endfor %}',
+    'memberships.html': '{% for visitor in visitors %}{{ visitor.name }} {{ visitor.membership_type }}{% endfor %}',
+}
+for _name in ('index.html', 'login.html', 'register.html', 'add_book.html', 'edit_book.html',
+              'database_admin.html'):
+    STUB_TEMPLATES.setdefault(_name, '')
+
+
+def scratch_config(folder, database_uri='sqlite://', **settings):
+    """Config for a throwaway app: its own database, job, upload and cache
+    folders under `folder`, no replica or profiler. `settings`
+    override any other Config value."""
+    class ScratchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_uri
+        SQLALCHEMY_BINDS = {}
+        SQL_PROFILER_ENABLED = False
+        JOB_FOLDER = os.path.join(folder, 'jobs')
+        UPLOAD_FOLDER = os.path.join(folder, 'uploads')
+        IDENTITY_CACHE_FOLDER = os.path.join(folder, 'identity')
+        TESTING = True
+    for name, value in settings.items():
+        setattr(ScratchConfig, name, value)
+    return ScratchConfig
+
+
+def close_app(app):
+    """Release an app's connections and job threads"""
+    app.extensions['jobs'].executor.shutdown(wait=True)
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def stub_app(folder, database_uri='sqlite://', **settings):
+    """create_app on a scratch config, rendering the stub templates"""
+    app = create_app(scratch_config(str(folder), database_uri, **settings))
+    app.jinja_env.loader = DictLoader(STUB_TEMPLATES)
+    return app
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Factory for stub-template apps on throwaway databases under tmp_path"""
+    apps = []
+
+    def make(database_uri='sqlite://', **settings):
+        app = stub_app(tmp_path, database_uri, **settings)
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        close_app(app)
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture(scope='module')
+def seeded_app(tmp_path_factory):
+    """One app per test module with `seed_loans` applied"""
+    app = stub_app(tmp_path_factory.mktemp('seeded'))
+    with app.app_context():
+        seed_loans()
+    yield app
+    close_app(app)
+
+
+def login(app, credentials=ADMIN):
+    """A test client logged in as `credentials` (email, password)"""
+    client = app.test_client()
+    email, password = credentials
+    client.post('/login', data={'email': email, 'password': password})
+    return client
+
+
+def add_seed_rows(books=(), students=()):
+    """Add seed books and students and count the books into their categories.
+
+    Flushes, so the rows have ids; the caller commits.
+    """
+    books, students = list(books), list(students)
+    db.session.add_all(books + students)
+    db.session.flush()
+    adjust_category_counts(Counter(book.category_id for book in books))
+
+
+def seed_loans(count=30):
+    """Spread `count` open loans, some overdue, over extra students and books"""
+    now = datetime.now(timezone.utc)
+    fiction = Category.query.filter_by(name='Fiction').one()
+    students = [User(name=f'Student {index}', email=f'student{index}@example.com', role='student')
+                for index in range(count)]
+    for student in students:
+        student.set_password('student')
+    books = [Book(title=f'Book {index}', author=f'Author {index}', category=fiction,
+                  total_copies=2, available_copies=1) for index in range(count)]
+    add_seed_rows(books, students)
+    sample_id = User.query.filter_by(email=STUDENT[0]).one().id
+    for index, (student, book) in enumerate(zip(students, books)):
+        # Alternate between the sample student and a fresh one per loan
+        user_id = student.id if index % 2 else sample_id
+        db.session.add(IssuedBook(user_id=user_id, book_id=book.id, due_date=now + timedelta(days=index - count // 2)))
+    db.session.commit()
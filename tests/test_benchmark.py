@@ -0,0 +1,57 @@
+from benchmark import (BenchmarkData, compare_results, generate_dataset, load_results, run_in_process,
+                       run_write_benchmark, save_results, summarize)
+from app import create_app
+from models import db, User, Book, IssuedBook, Notification
+from stats import compute_stats, reconcile_stats
+
+
+def test_generated_dataset_is_consistent(app):
+    generate_dataset(users=20, books=30, loans=200, notifications=100, seed=1)
+    assert User.query.filter(User.email.like('%@bench.local')).count() == 20
+    assert (IssuedBook.query.count(), Notification.query.count()) == (200, 100)
+
+    # Copy counts cover the open loans; counters agree with the tables
+    open_loans = IssuedBook.query.filter(IssuedBook.return_date.is_(None)).count()
+    assert open_loans and db.session.query(db.func.sum(Book.total_copies - Book.available_copies)).scalar() == open_loans
+    assert Book.query.filter(Book.available_copies < 0).count() == 0
+    assert reconcile_stats() == {}
+    assert compute_stats()['open_loans'] == open_loans
+
+
+def test_in_process_run_reports_latency_and_queries(app):
+    generate_dataset(users=5, books=10, loans=20, notifications=10)
+    data = BenchmarkData()
+    results = run_in_process(app, data, iterations=3, names=['admin_dashboard', 'notification_count'])
+    assert [result['scenario'] for result in results] == ['admin_dashboard', 'notification_count']
+    for result in results:
+        assert (result['requests'], result['errors']) == (3, 0)
+        assert result['p50_ms'] <= result['max_ms'] and 'avg_queries' in result
+    # The unread count is cached after the first request
+    assert results[1]['avg_queries'] < results[0]['avg_queries']
+
+
+def test_summarize_percentiles():
+    result = summarize('probe', [float(value) for value in range(1, 101)], errors=2, elapsed=2.0)
+    assert (result['p50_ms'], result['p90_ms'], result['p99_ms'], result['max_ms']) == (51.0, 90.0, 99.0, 100.0)
+    assert (result['throughput'], result['errors']) == (50.0, 2)
+    assert summarize('empty', [], 0, 0)['p50_ms'] is None
+
+
+def test_results_are_appended_and_compared(tmp_path):
+    path = str(tmp_path / 'results' / 'bench.jsonl')
+    assert load_results(path) == []
+    save_results(path, {'commit': 'a', 'results': [{'scenario': 'login', 'throughput': 100.0, 'p50_ms': 10.0}]})
+    save_results(path, {'commit': 'b', 'results': [{'scenario': 'login', 'throughput': 150.0, 'p50_ms': 5.0},
+                                                   {'scenario': 'new', 'throughput': 1.0}]})
+    base, head = load_results(path)
+    rows = compare_results(base, head)
+    assert rows[0]['throughput_change'] == '+50.0%' and rows[0]['p50_ms_change'] == '-50.0%'
+    assert rows[1]['throughput_change'] == 'n/a'
+
+
+def test_write_benchmark_runs_on_a_throwaway_database(tmp_path, monkeypatch):
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+    results = run_write_benchmark(create_app, threads=2, operations=3, profiles=['tuned'])
+    assert [result['scenario'] for result in results] == ['writes_tuned']
+    assert results[0]['requests'] == 6 and results[0]['errors'] == 0
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,65 @@
+from conftest import ADMIN, STUDENT, login
+from models import db, Book, Category
+from stats import reconcile_category_counts
+
+
+def _counts(app):
+    with app.app_context():
+        return {category.name: category.book_count for category in Category.query}
+
+
+def _book_form(category, total_copies='1'):
+    return {'title': 'Dune', 'author': 'Frank Herbert', 'category': category, 'total_copies': total_copies}
+
+
+def test_book_counts_follow_adds_moves_and_deletes(make_app):
+    app = make_app()
+    client = login(app, ADMIN)
+    before = _counts(app)
+
+    client.post('/books/add', data=_book_form(' Space Opera '))
+    counts = _counts(app)
+    assert counts['Space Opera'] == 1 and counts['Fiction'] == before['Fiction']
+
+    with app.app_context():
+        dune = Book.query.filter_by(title='Dune').one()
+        assert dune.category.name == 'Space Opera'
+        dune_id = dune.id
+    client.post(f'/books/edit/{dune_id}', data=_book_form('Fiction'))
+    counts = _counts(app)
+    assert (counts['Space Opera'], counts['Fiction']) == (0, before['Fiction'] + 1)
+
+    client.get(f'/books/delete/{dune_id}')
+    assert _counts(app) == {**before, 'Space Opera': 0}
+    with app.app_context():
+        assert reconcile_category_counts() == {}
+
+
+def test_categories_page_reads_the_maintained_counts(make_app):
+    response = login(make_app(), ADMIN).get('/categories')
+    assert 'Fiction=4;' in response.get_data(as_text=True)
+
+
+def test_categories_in_use_cannot_be_deleted(make_app):
+    app = make_app()
+    client = login(app, ADMIN)
+    with app.app_context():
+        fiction, biography = (Category.query.filter_by(name=name).one().id for name in ('Fiction', 'Biography'))
+    client.get(f'/categories/delete/{fiction}')
+    client.get(f'/categories/delete/{biography}')
+    with app.app_context():
+        assert db.session.get(Category, fiction) is not None
+        assert db.session.get(Category, biography) is None
+
+
+def test_student_dashboard_offers_only_categories_with_books(make_app):
+    page = login(make_app(), STUDENT).get('/student/dashboard').get_data(as_text=True)
+    assert 'Political Fiction' in page and 'Biography' not in page
+
+
+def test_reconcile_repairs_drifted_counts(app):
+    db.session.execute(db.update(Category).where(Category.name == 'Fiction').values(book_count=9))
+    db.session.commit()
+    assert reconcile_category_counts() == {'book_count[Fiction]': (9, 4)}
+    db.session.commit()
+    assert Category.query.filter_by(name='Fiction').one().book_count == 4
@@ -0,0 +1,168 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from circulation import close_loan, release_copy, take_copy
+from conftest import ADMIN, STUDENT, login
+from models import db, User, Book, IssuedBook
+from stats import reconcile_stats
+
+
+def _book(title='Animal Farm'):
+    return Book.query.filter_by(title=title).one()
+
+
+def _student_id():
+    return User.query.filter_by(email=STUDENT[0]).one().id
+
+
+def _flashes(client):
+    with client.session_transaction() as session:
+        return [message for _, message in session.pop('_flashes', [])]
+
+
+def test_take_copy_stops_at_zero(app):
+    book = _book()
+    assert [take_copy(book.id) for _ in range(4)] == [True, True, True, False]
+    db.session.commit()
+    db.session.refresh(book)
+    assert book.available_copies == 0
+
+    release_copy(book.id)
+    db.session.commit()
+    db.session.refresh(book)
+    assert book.available_copies == 1
+
+
+def test_close_loan_only_closes_open_loans(app):
+    loan = IssuedBook(user_id=_student_id(), book_id=_book().id)
+    db.session.add(loan)
+    db.session.commit()
+    assert close_loan(loan.id, loan.issue_date, 0.0)
+    assert not close_loan(loan.id, loan.issue_date, 5.0)
+    db.session.commit()
+    db.session.refresh(loan)
+    assert loan.return_date is not None and loan.fine == 0.0
+
+
+def test_one_open_loan_per_student_and_book(app):
+    student_id, book_id = _student_id(), _book().id
+    first = IssuedBook(user_id=student_id, book_id=book_id)
+    db.session.add(first)
+    db.session.commit()
+    db.session.add(IssuedBook(user_id=student_id, book_id=book_id))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+    # Returned loans do not count
+    close_loan(first.id, first.issue_date, 0.0)
+    db.session.add(IssuedBook(user_id=student_id, book_id=book_id))
+    db.session.commit()
+    assert IssuedBook.query.filter_by(user_id=student_id, book_id=book_id).count() == 2
+
+
+def test_last_copy_is_issued_once(make_app):
+    app = make_app()
+    client = login(app, ADMIN)
+    with app.app_context():
+        db.session.add_all([User(name=name, email=f'{name.lower()}@example.com', role='student', password_hash='-')
+                            for name in ('Second', 'Third')])
+        db.session.commit()
+        reconcile_stats()
+        db.session.commit()
+        book_id = _book('Pride and Prejudice').id
+        first, second, third = (User.query.filter_by(email=email).one().id
+                                for email in (STUDENT[0], 'second@example.com', 'third@example.com'))
+
+    for student_id in (first, first, second, third):
+        client.post('/issue-book', data={'student_id': student_id, 'book_id': book_id})
+    assert _flashes(client) == ['Book issued successfully!', 'Student already has this book issued.',
+                                'Book issued successfully!', 'Book is not available for issue.']
+    with app.app_context():
+        assert db.session.get(Book, book_id).available_copies == 0
+        assert reconcile_stats() == {}
+
+
+def test_double_return_releases_one_copy(make_app):
+    app = make_app()
+    client = login(app, ADMIN)
+    with app.app_context():
+        book_id, student_id = _book().id, _student_id()
+    client.post('/issue-book', data={'student_id': student_id, 'book_id': book_id})
+    with app.app_context():
+        loan_id = IssuedBook.query.filter_by(book_id=book_id).one().id
+
+    client.post('/return-book', data={'issued_book_id': loan_id})
+    client.post('/return-book', data={'issued_book_id': loan_id})
+    assert _flashes(client) == ['Book issued successfully!', 'Book returned successfully!',
+                                'Invalid book return request.']
+    with app.app_context():
+        assert db.session.get(Book, book_id).available_copies == 3
+        assert reconcile_stats() == {}
+
+
+@pytest.fixture
+def file_app(make_app, tmp_path):
+    return make_app(f"sqlite:///{tmp_path / 'library.db'}")
+
+
+def _run_elsewhere_before(prefix, sql, *parameters):
+    """Listener running `sql` on another connection just before the first
+    statement starting with `prefix`, as a second desk would"""
+    path = db.engine.url.database
+    done = []
+
+    def listener(conn, cursor, statement, params, context, executemany):
+        if statement.startswith(prefix) and not done:
+            done.append(True)
+            with sqlite3.connect(path) as other:
+                other.execute(sql, parameters)
+    return listener
+
+
+def test_concurrent_duplicate_issue_rolls_back_the_copy(file_app):
+    client = login(file_app, ADMIN)
+    with file_app.app_context():
+        book_id, student_id = _book().id, _student_id()
+        # The other desk's loan lands after the duplicate check passed
+        listener = _run_elsewhere_before(
+            'UPDATE books', "INSERT INTO issued_books (user_id, book_id, issue_date, due_date, fine) "
+                            "VALUES (?, ?, '2024-01-01 00:00:00.000000', '2024-01-11 00:00:00.000000', 0)",
+            student_id, book_id)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        client.post('/issue-book', data={'student_id': student_id, 'book_id': book_id})
+    finally:
+        with file_app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert _flashes(client) == ['Student already has this book issued.']
+    with file_app.app_context():
+        assert db.session.get(Book, book_id).available_copies == 3
+        assert IssuedBook.query.filter_by(book_id=book_id).count() == 1
+
+
+def test_concurrent_return_releases_no_copy(file_app):
+    client = login(file_app, ADMIN)
+    with file_app.app_context():
+        book_id, student_id = _book().id, _student_id()
+    client.post('/issue-book', data={'student_id': student_id, 'book_id': book_id})
+    _flashes(client)
+    with file_app.app_context():
+        loan_id = IssuedBook.query.filter_by(book_id=book_id).one().id
+        listener = _run_elsewhere_before(
+            'UPDATE issued_books', "UPDATE issued_books SET return_date = '2024-01-01 00:00:00.000000' "
+                                   "WHERE id = ?", loan_id)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        client.post('/return-book', data={'issued_book_id': loan_id})
+    finally:
+        with file_app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert _flashes(client) == ['Invalid book return request.']
+    with file_app.app_context():
+        assert db.session.get(Book, book_id).available_copies == 2
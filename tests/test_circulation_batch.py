@@ -0,0 +1,151 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event
+
+from circulation import BatchConflict, BatchError, apply_batch, parse_operations
+from conftest import ADMIN, STUDENT, login
+from models import db, User, Book, IssuedBook, Notification, FineLedgerEntry
+from stats import reconcile_stats
+
+
+def _ids(*titles):
+    return [Book.query.filter_by(title=title).one().id for title in titles]
+
+
+def _student_id():
+    return User.query.filter_by(email=STUDENT[0]).one().id
+
+
+def _issue(student_id, book_id):
+    return {'op': 'issue', 'student_id': student_id, 'book_id': book_id}
+
+
+@pytest.mark.parametrize('payload', [None, [], {'operations': []}, {'operations': 'issue'},
+                                     {'operations': [{}] * 4}])
+def test_unusable_bodies_are_rejected(payload):
+    with pytest.raises(BatchError):
+        parse_operations(payload, limit=3)
+
+
+def test_bad_operations_are_reported_per_item():
+    parsed = parse_operations({'operations': [
+        'issue', {'op': 'lend'}, {'op': 'issue', 'student_id': 2}, {'op': 'issue', 'student_id': True, 'book_id': 1},
+        {'op': 'return', 'issued_book_id': '7'}, {'op': 'issue', 'student_id': '2', 'book_id': 1}
+    ]}, limit=10)
+    assert [op for op, _ in parsed] == [None, None, None, None, 'return', 'issue']
+    assert parsed[1][1] == "Unknown op 'lend'" and parsed[3][1] == 'student_id must be an integer'
+    assert parsed[4][1]['issued_book_id'] == 7 and parsed[5][1]['student_id'] == 2
+
+
+def test_batch_applies_issues_and_returns_in_order(app):
+    student_id = _student_id()
+    gatsby, farm = _ids('The Great Gatsby', 'Animal Farm')
+    results = apply_batch(parse_operations({'operations': [
+        _issue(student_id, gatsby), _issue(student_id, farm), _issue(student_id, gatsby),
+        _issue(1, farm), _issue(student_id, 999)
+    ]}, limit=10))
+    assert [result['ok'] for result in results] == [True, True, False, False, False]
+    assert [result.get('error') for result in results[2:]] == \
+        ['Student already has this book issued', 'Invalid student or book', 'Invalid student or book']
+
+    # A return earlier in the batch frees the student to borrow it again
+    gatsby_loan = results[0]['issued_book_id']
+    results = apply_batch(parse_operations({'operations': [
+        {'op': 'return', 'issued_book_id': gatsby_loan}, _issue(student_id, gatsby),
+        {'op': 'return', 'issued_book_id': gatsby_loan}
+    ]}, limit=10))
+    assert [result['ok'] for result in results] == [True, True, False]
+
+    assert [book.available_copies for book in Book.query.filter(Book.id.in_((gatsby, farm))).order_by(Book.id)] == \
+        [2, 2]
+    assert IssuedBook.query.filter_by(user_id=student_id, return_date=None).count() == 2
+    assert Notification.query.filter_by(user_id=student_id).count() == 4
+    assert reconcile_stats() == {}
+
+
+def test_overdue_returns_book_their_fine(app):
+    student_id = _student_id()
+    [farm] = _ids('Animal Farm')
+    [issued] = apply_batch(parse_operations({'operations': [_issue(student_id, farm)]}, limit=10))
+    loan = db.session.get(IssuedBook, issued['issued_book_id'])
+    loan.due_date = datetime.now(timezone.utc) - timedelta(days=3, hours=1)
+    db.session.commit()
+
+    [returned] = apply_batch(parse_operations({'operations': [
+        {'op': 'return', 'student_id': student_id, 'book_id': farm}]}, limit=10))
+    assert returned['ok'] and returned['fine'] == 3 * app.config['FINE_PER_DAY']
+    assert [(entry.kind, entry.amount) for entry in FineLedgerEntry.query.filter_by(loan_id=loan.id)] == \
+        [(FineLedgerEntry.KIND_RETURN, returned['fine'])]
+    assert db.session.get(User, student_id).fine_balance == returned['fine']
+    assert 'Fine: ₹30' in Notification.query.order_by(Notification.id.desc()).first().message
+
+
+@pytest.fixture
+def file_app(make_app, tmp_path):
+    app = make_app(f"sqlite:///{tmp_path / 'library.db'}")
+    with app.app_context():
+        yield app
+
+
+def _before_book_update(sql, *parameters):
+    """Run `sql` on another connection just before the batch adjusts copies"""
+    path = db.engine.url.database
+
+    def listener(conn, cursor, statement, params, context, executemany):
+        if statement.startswith('UPDATE books'):
+            with sqlite3.connect(path) as other:
+                other.execute(sql, parameters)
+    return listener
+
+
+def _apply_with(listener, operations):
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        return apply_batch(parse_operations({'operations': operations}, limit=10))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+def test_copies_taken_elsewhere_roll_the_batch_back(file_app):
+    student_id = _student_id()
+    gatsby, farm = _ids('The Great Gatsby', 'Animal Farm')
+    notifications = Notification.query.count()
+
+    listener = _before_book_update('UPDATE books SET available_copies = 0 WHERE id = ?', farm)
+    with pytest.raises(BatchConflict, match='Copies were issued elsewhere'):
+        _apply_with(listener, [_issue(student_id, gatsby), _issue(student_id, farm)])
+    assert IssuedBook.query.count() == 0 and Notification.query.count() == notifications
+    assert db.session.get(Book, gatsby).available_copies == 3
+
+
+def test_loans_returned_elsewhere_roll_the_batch_back(file_app):
+    student_id = _student_id()
+    [farm] = _ids('Animal Farm')
+    [issued] = apply_batch(parse_operations({'operations': [_issue(student_id, farm)]}, limit=10))
+    loan_id = issued['issued_book_id']
+
+    listener = _before_book_update("UPDATE issued_books SET return_date = '2024-01-01 00:00:00.000000' "
+                                   "WHERE id = ?", loan_id)
+    with pytest.raises(BatchConflict, match='Loans were returned elsewhere'):
+        _apply_with(listener, [{'op': 'return', 'issued_book_id': loan_id}])
+    assert db.session.get(Book, farm).available_copies == 2
+    assert FineLedgerEntry.query.count() == 0
+
+
+def test_batch_route(make_app):
+    app = make_app()
+    with app.app_context():
+        student_id = _student_id()
+        [farm] = _ids('Animal Farm')
+    client = login(app, ADMIN)
+    response = client.post('/api/circulation/batch', json={'operations': [_issue(student_id, farm), {'op': 'x'}]})
+    assert response.status_code == 200
+    assert {key: response.get_json()[key] for key in ('issued', 'returned', 'failed')} == \
+        {'issued': 1, 'returned': 0, 'failed': 1}
+
+    assert client.post('/api/circulation/batch', json={'operations': []}).status_code == 400
+    app.config['CIRCULATION_BATCH_LIMIT'] = 1
+    assert client.post('/api/circulation/batch', json={'operations': [{}, {}]}).status_code == 400
+    assert login(app, STUDENT).post('/api/circulation/batch', json={'operations': []}).status_code == 403
@@ -0,0 +1,109 @@
+import random
+import threading
+from collections import Counter
+from sqlalchemy.exc import OperationalError
+from conftest import ADMIN, add_seed_rows, login
+from models import db, User, Book, IssuedBook, Category
+from stats import reconcile_stats
+
+
+def _seed(students, copies):
+    category = Category.query.filter_by(name='Fiction').one()
+    book = Book(title='Stress Test Copy', author='Stress', category=category,
+                total_copies=copies, available_copies=copies)
+    rows = [User(name=f'Stress Student {index}', email=f'stress{index}@stress.local', role='student',
+                 password_hash='-') for index in range(students)]
+    add_seed_rows([book], rows)
+    db.session.commit()
+    reconcile_stats()
+    return book.id, [user.id for user in rows]
+
+
+def check_circulation_invariants(book_id):
+    """Return a list of violated invariants for the stressed book"""
+    violations = []
+    book = db.session.get(Book, book_id)
+    open_loans = IssuedBook.query.filter_by(book_id=book_id, return_date=None).count()
+    if book.available_copies < 0:
+        violations.append(f'available_copies is negative ({book.available_copies})')
+    if book.available_copies != book.total_copies - open_loans:
+        violations.append(f'available_copies is {book.available_copies} but {book.total_copies} copies '
+                          f'with {open_loans} open loans leave {book.total_copies - open_loans}')
+    duplicates = db.session.query(IssuedBook.user_id).filter_by(book_id=book_id, return_date=None).group_by(
+        IssuedBook.user_id
+    ).having(db.func.count() > 1).count()
+    if duplicates:
+        violations.append(f'{duplicates} students hold more than one open loan of the book')
+    for name, (stored, actual) in reconcile_stats().items():
+        violations.append(f'library stats {name} drifted: stored {stored}, actual {actual}')
+    return violations
+
+
+def run_circulation_stress(app, threads, operations, copies, students, seed=0):
+    """Hammer one book with concurrent issues and returns from many threads.
+
+    Every thread logs in as the admin and mixes single issues, single
+    returns and small circulation batches against the same book, through
+    the real routes. Returns the request outcome counts and any violated
+    invariants (negative or drifting copy counts, duplicate open loans,
+    stats drift). Errors such as "database is locked" are counted as
+    outcomes, not violations.
+    """
+    with app.app_context():
+        book_id, student_ids = _seed(students, copies)
+
+    outcomes = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def record(outcome):
+        with lock:
+            outcomes[outcome] += 1
+
+    def open_loan_ids():
+        with app.app_context():
+            return [loan_id for loan_id, in db.session.query(IssuedBook.id).filter_by(
+                book_id=book_id, return_date=None)]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = login(app, ADMIN)
+        barrier.wait()
+        for _ in range(operations):
+            choice = rng.random()
+            try:
+                if choice < 0.5:
+                    client.post('/issue-book', data={'student_id': rng.choice(student_ids), 'book_id': book_id})
+                    record('issue')
+                elif choice < 0.85:
+                    loan_ids = open_loan_ids()
+                    if loan_ids:
+                        client.post('/return-book', data={'issued_book_id': rng.choice(loan_ids)})
+                        record('return')
+                else:
+                    response = client.post('/api/circulation/batch', json={'operations': [
+                        {'op': 'issue', 'student_id': rng.choice(student_ids), 'book_id': book_id},
+                        {'op': 'return', 'student_id': rng.choice(student_ids), 'book_id': book_id},
+                        {'op': 'issue', 'student_id': rng.choice(student_ids), 'book_id': book_id}
+                    ]})
+                    record('batch' if response.status_code == 200 else f'batch_{response.status_code}')
+            except OperationalError as error:
+                record('database_locked' if 'locked' in str(error) else 'OperationalError')
+            except Exception as error:
+                record(type(error).__name__)
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    with app.app_context():
+        return outcomes, check_circulation_invariants(book_id)
+
+
+def test_concurrent_circulation_keeps_counts_consistent(make_app, tmp_path):
+    app = make_app(f"sqlite:///{tmp_path / 'stress.db'}")
+    outcomes, violations = run_circulation_stress(app, threads=4, operations=10, copies=2, students=4)
+    assert sum(outcomes.values()) > 0
+    assert not violations, '\n'.join(violations)
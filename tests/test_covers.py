@@ -0,0 +1,130 @@
+import io
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from conftest import ADMIN, login
+from covers import (InvalidCover, check_upload, cover_key, process_legacy_covers, release_cover, render_variants,
+                    store_cover)
+from jobs import JOB_DONE, JOB_FAILED
+from models import db, Book
+
+
+def _image(size=(600, 900), image_format='PNG', mode='RGB', color=(200, 30, 30)):
+    output = io.BytesIO()
+    Image.new(mode, size, color).save(output, image_format)
+    return output.getvalue()
+
+
+def _folder(app):
+    return app.config['UPLOAD_FOLDER']
+
+
+def _wait_for_jobs(app, timeout=10):
+    runner = app.extensions['jobs']
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        jobs = [runner.get(name[:-5]) for name in os.listdir(runner.folder) if name.endswith('.json')]
+        if all(job['status'] in (JOB_DONE, JOB_FAILED) for job in jobs):
+            return jobs
+        time.sleep(0.05)
+    raise AssertionError('cover jobs did not finish')
+
+
+def test_check_upload_accepts_images_and_rejects_the_rest(app):
+    check_upload(io.BytesIO(_image()))
+    with pytest.raises(InvalidCover, match='not a valid image'):
+        check_upload(io.BytesIO(b'<svg></svg>'))
+    with pytest.raises(InvalidCover, match='not supported'):
+        check_upload(io.BytesIO(_image(image_format='BMP')))
+    app.config['COVER_MAX_PIXELS'] = 100
+    with pytest.raises(InvalidCover, match='too large'):
+        check_upload(io.BytesIO(_image()))
+
+
+def test_variants_are_resized_and_flattened():
+    variants = render_variants(_image(mode='RGBA', color=(0, 0, 0, 0)), max_pixels=10 ** 7)
+    assert set(variants) == {(variant, ext) for variant in ('thumb', 'full') for ext in ('webp', 'jpg')}
+    with Image.open(io.BytesIO(variants[('thumb', 'jpg')])) as thumb:
+        assert thumb.size == (240, 360) and thumb.getpixel((0, 0)) == (255, 255, 255)
+    with Image.open(io.BytesIO(variants[('full', 'webp')])) as full:
+        assert full.size == (600, 900)
+
+
+def test_identical_uploads_share_their_files(tmp_path):
+    data = _image()
+    key, sizes = store_cover(data, str(tmp_path), 10 ** 7)
+    assert key == cover_key(data) and len(sizes) == 4
+    assert sorted(os.listdir(tmp_path)) == sorted(sizes)
+    assert store_cover(data, str(tmp_path), 10 ** 7)[0] == key
+    assert len(os.listdir(tmp_path)) == 4
+
+
+def test_uploaded_cover_is_processed_and_served(make_app):
+    app = make_app()
+    client = login(app, ADMIN)
+    client.post('/books/add', data={'title': 'Dune', 'author': 'Frank Herbert', 'category': 'Fiction',
+                                    'total_copies': '1', 'cover_photo': (io.BytesIO(_image()), 'dune.png')},
+                content_type='multipart/form-data')
+    [job] = _wait_for_jobs(app)
+    assert job['status'] == JOB_DONE, job['error']
+    with app.app_context():
+        key = Book.query.filter_by(title='Dune').one().cover_photo
+    assert key == job['result']['cover']
+
+    response = client.get(f'/covers/{key}-thumb.webp')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control'] and response.headers['ETag']
+    assert client.get('/covers/../../config.py').status_code == 404
+
+
+def _book_with_cover(app, title='Dune'):
+    key, _ = store_cover(_image(), _folder(app), 10 ** 7)
+    book = Book(title=title, author='Frank Herbert', category_id=1, cover_photo=key)
+    db.session.add(book)
+    db.session.commit()
+    return book, key
+
+
+def test_cover_files_stay_when_the_delete_rolls_back(app):
+    book, key = _book_with_cover(app)
+    release_cover(book)
+    db.session.delete(book)
+    db.session.rollback()
+    assert len(os.listdir(_folder(app))) == 4
+
+    release_cover(book)
+    db.session.delete(book)
+    db.session.commit()
+    assert os.listdir(_folder(app)) == []
+
+
+def test_delete_book_removes_cover_files_after_commit_unless_shared(make_app):
+    app = make_app()
+    client = login(app, ADMIN)
+    with app.app_context():
+        first, key = _book_with_cover(app)
+        second, _ = _book_with_cover(app, 'Dune Messiah')
+        first_id, second_id = first.id, second.id
+
+    client.get(f'/books/delete/{first_id}')
+    assert len(os.listdir(_folder(app))) == 4
+    client.get(f'/books/delete/{second_id}')
+    assert os.listdir(_folder(app)) == []
+
+
+def test_legacy_covers_are_converted(app):
+    os.makedirs(_folder(app))
+    with open(os.path.join(_folder(app), 'old_cover.png'), 'wb') as file:
+        file.write(_image())
+    book = Book.query.first()
+    book.cover_photo = 'old_cover.png'
+    missing = Book.query.offset(1).first()
+    missing.cover_photo = 'missing.png'
+    db.session.commit()
+
+    assert process_legacy_covers() == (1, 1)
+    assert len(book.cover_photo) == 24
+    assert 'old_cover.png' not in os.listdir(_folder(app))
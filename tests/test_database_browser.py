@@ -0,0 +1,63 @@
+import pytest
+
+from conftest import ADMIN, STUDENT, login
+from database_browser import BROWSER_TABLES, browse_table, database_overview
+
+
+def test_overview_counts_every_table(app):
+    tables_info, db_stats = database_overview()
+    counts = {table['name']: table['record_count'] for table in tables_info}
+    assert list(counts) == list(BROWSER_TABLES)
+    assert counts['users'] == 2 and counts['books'] == 8 and counts['categories'] == 10
+    assert db_stats['total_records'] == sum(counts.values())
+    assert (db_stats['admin_users'], db_stats['books_issued'], db_stats['overdue_books']) == (1, 0, 0)
+
+
+def test_browse_pages_sorted_by_a_column(app):
+    first = browse_table('books', sort='title', per_page=3)
+    rest = browse_table('books', sort='title', cursor=first.next_cursor, per_page=10)
+    titles = [row['title'] for row in first.items + rest.items]
+    assert titles == sorted(titles) and len(titles) == 8
+    assert rest.next_cursor is None
+    assert first.items[0]['category'] == 'Science Fiction'  # 1984, name joined in
+
+
+def _titles(**filters):
+    return [row['title'] for row in browse_table('books', filters=filters, per_page=50).items]
+
+
+def test_browse_filters_text_by_substring_and_numbers_by_value(app):
+    assert _titles(author='orwell') == ['1984', 'Animal Farm']
+    assert _titles(total_copies='4') == ['1984']
+    assert browse_table('users', filters={'fine_balance': '0'}, per_page=50).items[0]['fine_balance'] == '₹0'
+
+
+@pytest.mark.parametrize('table, kwargs, message', [
+    ('users', {'sort': 'password_hash'}, 'Cannot sort'),
+    ('users', {'filters': {'password_hash': 'x'}}, 'Unknown column'),
+    ('books', {'filters': {'total_copies': 'many'}}, 'Invalid value'),
+])
+def test_browse_rejects_unknown_columns_and_bad_values(app, table, kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        browse_table(table, per_page=50, **kwargs)
+
+
+def test_rows_endpoint_pages_as_json(make_app):
+    app = make_app()
+    client = login(app, ADMIN)
+    response = client.get('/admin/database/users/rows', query_string={'sort': 'email', 'dir': 'desc'})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [record['email'] for record in data['records']] == [STUDENT[0], ADMIN[0]]
+    assert 'password_hash' not in data['records'][0]
+    assert data['next_cursor'] is None
+
+    assert client.get('/admin/database/secrets/rows').status_code == 404
+    assert client.get('/admin/database/books/rows?sort=cover_photo').status_code == 400
+    assert login(app, STUDENT).get('/admin/database/users/rows').status_code == 403
+
+
+def test_rows_endpoint_filters_by_column(make_app):
+    client = login(make_app(), ADMIN)
+    data = client.get('/admin/database/users/rows', query_string={'filter_role': 'admin'}).get_json()
+    assert [record['email'] for record in data['records']] == [ADMIN[0]]
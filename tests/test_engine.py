@@ -0,0 +1,84 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from app import create_app
+from benchmark import run_write_benchmark
+from conftest import scratch_config
+from engine import configure_engine, sqlite_pragmas
+from models import db, User
+
+
+def _pragma(name):
+    return db.session.execute(db.text(f'PRAGMA {name}')).scalar()
+
+
+def _server_app(**settings):
+    app = Flask(__name__)
+    app.config.from_object(scratch_config('.', 'postgresql://library@db.internal/library', **settings))
+    return app
+
+
+def test_sqlite_connections_get_the_profile(make_app, tmp_path):
+    app = make_app(f"sqlite:///{tmp_path / 'library.db'}", SQLITE_BUSY_TIMEOUT=2500, SQLITE_CACHE_SIZE=8192)
+    with app.app_context():
+        assert _pragma('journal_mode') == 'wal'
+        assert _pragma('synchronous') == 1  # NORMAL
+        assert _pragma('busy_timeout') == 2500
+        assert _pragma('cache_size') == -8192
+        assert _pragma('mmap_size') == app.config['SQLITE_MMAP_SIZE']
+
+
+def test_profile_settings_are_validated_at_startup(tmp_path):
+    with pytest.raises(ValueError, match='SQLITE_JOURNAL_MODE'):
+        create_app(scratch_config(str(tmp_path), SQLITE_JOURNAL_MODE='fast'))
+    assert sqlite_pragmas(_server_app(SQLITE_SYNCHRONOUS='FULL'))[1] == 'PRAGMA synchronous=full'
+
+
+def test_server_databases_get_pool_settings():
+    app = _server_app(DB_POOL_SIZE=4, DB_MAX_OVERFLOW=2, DB_POOL_PRE_PING=False,
+                      SQLALCHEMY_ENGINE_OPTIONS={'pool_recycle': 60, 'echo': True})
+    configure_engine(app)
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS'] == {
+        'pool_size': 4, 'max_overflow': 2, 'pool_timeout': 30, 'pool_recycle': 60, 'pool_pre_ping': False,
+        'echo': True,
+    }
+
+
+def test_sqlite_keeps_the_default_pool(tmp_path):
+    app = Flask(__name__)
+    app.config.from_object(scratch_config(str(tmp_path), f"sqlite:///{tmp_path / 'library.db'}"))
+    configure_engine(app)
+    assert not app.config.get('SQLALCHEMY_ENGINE_OPTIONS')
+
+
+def test_writers_wait_for_the_lock(make_app, tmp_path):
+    path = tmp_path / 'library.db'
+    app = make_app(f'sqlite:///{path}')
+    other = sqlite3.connect(path, check_same_thread=False)
+    other.execute('BEGIN IMMEDIATE')
+    other.execute("UPDATE users SET name = 'Held' WHERE id = 1")
+    # Another process holds the write lock for a moment
+    releaser = threading.Timer(0.3, other.commit)
+    releaser.start()
+    try:
+        with app.app_context():
+            started = time.perf_counter()
+            db.session.get(User, 2).name = 'Waited'
+            db.session.commit()
+            assert time.perf_counter() - started >= 0.2
+            assert [name for name, in db.session.query(User.name).filter(User.id.in_([1, 2])).order_by(User.id)] \
+                == ['Held', 'Waited']
+    finally:
+        releaser.join()
+        other.close()
+
+
+def test_write_benchmark_runs_every_profile():
+    results = run_write_benchmark(create_app, threads=2, operations=4)
+    assert [result['scenario'] for result in results] == ['writes_default', 'writes_tuned']
+    assert all(result['requests'] == 8 for result in results)
+    assert results[1]['errors'] == 0
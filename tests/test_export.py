@@ -0,0 +1,69 @@
+import io
+import tempfile
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from openpyxl import load_workbook
+
+from conftest import ADMIN, STUDENT, login
+from export import EXPORT_SHEETS, count_export_rows, write_database_export
+from models import db, User, Book, IssuedBook
+
+
+@pytest.fixture
+def export_dir(tmp_path, monkeypatch):
+    """Temp exports land in their own folder, so leaks are visible"""
+    folder = tmp_path / 'exports'
+    folder.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(folder))
+    return folder
+
+
+def test_export_download_is_a_workbook_of_every_table(make_app, export_dir):
+    app = make_app()
+    response = login(app, ADMIN).get('/admin/database/export')
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'].startswith('attachment; filename=library_database_export_')
+    workbook = load_workbook(io.BytesIO(response.get_data()), read_only=True)
+    assert workbook.sheetnames == [sheet[0] for sheet in EXPORT_SHEETS.values()]
+    titles = [row[1] for row in workbook['Books'].iter_rows(min_row=2, values_only=True)]
+    assert 'The Great Gatsby' in titles
+    response.close()
+    assert list(export_dir.iterdir()) == []
+
+
+def test_export_file_is_removed_when_the_body_is_never_read(make_app, export_dir):
+    app = make_app()
+    response = login(app, ADMIN).get('/admin/database/export', buffered=False)
+    assert len(list(export_dir.iterdir())) == 1
+    response.close()
+    assert list(export_dir.iterdir()) == []
+
+
+def test_students_cannot_export(make_app, export_dir):
+    response = login(make_app(), STUDENT).get('/admin/database/export')
+    assert response.status_code == 302
+    assert list(export_dir.iterdir()) == []
+
+
+def test_date_range_limits_rows_per_table(app, tmp_path):
+    student = User.query.filter_by(email=STUDENT[0]).one()
+    book = Book.query.first()
+    old = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    db.session.add_all([
+        IssuedBook(user_id=student.id, book_id=book.id, issue_date=old, return_date=old, due_date=old),
+        IssuedBook(user_id=student.id, book_id=book.id),
+    ])
+    db.session.commit()
+
+    today = date.today()
+    assert count_export_rows(['issued_books']) == 2
+    assert count_export_rows(['issued_books'], today - timedelta(days=1), today + timedelta(days=1)) == 1
+    assert count_export_rows(['issued_books'], date(2020, 1, 1), date(2020, 1, 1)) == 1
+
+    path = str(tmp_path / 'loans.xlsx')
+    progress = []
+    write_database_export(path, ['issued_books'], date(2020, 1, 1), date(2020, 1, 1), progress.append)
+    rows = list(load_workbook(path, read_only=True)['Issued Books'].iter_rows(min_row=2, values_only=True))
+    assert len(rows) == 1 and rows[0][5] == '2020-01-01 00:00:00'
+    assert progress[-1] == 1
@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event
+
+from conftest import ADMIN, STUDENT, login
+from fines import PaymentError, accrue_fines, claim_accruals, accrued_fines, overdue_frame, post_return_fines, \
+    record_payment
+from models import db, User, Book, IssuedBook, FineLedgerEntry
+
+NOW = datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+
+
+def _student_id():
+    return User.query.filter_by(email=STUDENT[0]).one().id
+
+
+def _overdue_loans(*days_overdue):
+    """Open loans of the sample student, one per book, due the given
+    number of days before NOW"""
+    user_id = _student_id()
+    books = Book.query.order_by(Book.id).all()
+    loans = [IssuedBook(user_id=user_id, book_id=book.id, issue_date=NOW - timedelta(days=days + 10),
+                        due_date=NOW - timedelta(days=days, hours=1))
+             for book, days in zip(books, days_overdue)]
+    db.session.add_all(loans)
+    db.session.commit()
+    return loans
+
+
+def _ledger(user_id):
+    return [(entry.loan_id, entry.kind, entry.amount, entry.balance)
+            for entry in FineLedgerEntry.query.filter_by(user_id=user_id).order_by(FineLedgerEntry.id)]
+
+
+def _balance(user_id):
+    return db.session.query(User.fine_balance).filter(User.id == user_id).scalar()
+
+
+def _temp_tables():
+    statement = db.text("SELECT name FROM sqlite_temp_master WHERE type = 'table'")
+    return [name for name, in db.session.execute(statement)]
+
+
+def test_accrual_books_growth_once_per_day(app):
+    student_id = _student_id()
+    first, second = _overdue_loans(2, 5)
+    assert accrue_fines(NOW) == {'overdue_loans': 2, 'accrued_loans': 2, 'users': 1, 'amount': 70.0}
+    assert accrue_fines(NOW)['accrued_loans'] == 0
+
+    assert accrue_fines(NOW + timedelta(days=1))['amount'] == 20.0
+    assert _ledger(student_id) == [
+        (first.id, 'accrual', 20.0, 20.0), (second.id, 'accrual', 50.0, 70.0),
+        (first.id, 'accrual', 10.0, 80.0), (second.id, 'accrual', 10.0, 90.0),
+    ]
+    assert _balance(student_id) == 90.0
+    assert _temp_tables() == []
+
+
+def test_claims_skip_loans_changed_since_they_were_read(app):
+    first, second = _overdue_loans(2, 3)
+    entries = accrued_fines(overdue_frame(NOW), NOW, 10)
+    # Another pass accrues the first loan, a return closes the second
+    first.fine = 20.0
+    second.return_date = NOW
+    db.session.commit()
+    assert claim_accruals(entries).empty
+
+
+def test_a_failed_pass_raises_its_own_error_and_the_next_one_runs(app):
+    student_id = _student_id()
+    _overdue_loans(2)
+
+    def fail_claim(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE issued_books'):
+            raise RuntimeError('disk full')
+    event.listen(db.engine, 'before_cursor_execute', fail_claim)
+    try:
+        with pytest.raises(RuntimeError, match='disk full'):
+            accrue_fines(NOW)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', fail_claim)
+    db.session.rollback()
+    assert _temp_tables() == ['staged_accruals']
+
+    # The staging table the failed pass left behind is emptied and reused
+    assert accrue_fines(NOW)['amount'] == 20.0
+    assert _balance(student_id) == 20.0 and _temp_tables() == []
+
+
+def test_return_books_the_rest_of_the_fine(app):
+    student_id = _student_id()
+    [loan] = _overdue_loans(3)
+    accrue_fines(NOW - timedelta(days=1))
+    record_payment(student_id, 5, NOW)
+    db.session.commit()
+
+    # The payment is not mistaken for a smaller accrual
+    loan.return_date, loan.fine = NOW, 30.0
+    post_return_fines([(loan.id, student_id, 30.0)], NOW)
+    db.session.commit()
+    assert [(kind, amount) for _, kind, amount, _ in _ledger(student_id)] == \
+        [('accrual', 20.0), ('payment', -5.0), ('return', 10.0)]
+    assert _balance(student_id) == 25.0
+
+
+def test_payments_settle_the_oldest_loans_first(app):
+    student_id = _student_id()
+    first, second, third = _overdue_loans(1, 2, 3)
+    accrue_fines(NOW)
+
+    entries = record_payment(student_id, 25, NOW)
+    db.session.commit()
+    assert [(loan_id, amount) for loan_id, amount in zip(entries['loan_id'], entries['amount'])] == \
+        [(first.id, -10.0), (second.id, -15.0)]
+    assert _balance(student_id) == 35.0 and entries['balance'].tolist() == [50.0, 35.0]
+
+    owed = dict(db.session.query(FineLedgerEntry.loan_id, db.func.sum(FineLedgerEntry.amount)).group_by(
+        FineLedgerEntry.loan_id))
+    assert owed == {first.id: 0.0, second.id: 5.0, third.id: 30.0}
+    # The loans' assessed fines are unchanged
+    assert [loan.fine for loan in (first, second, third)] == [10.0, 20.0, 30.0]
+
+
+@pytest.mark.parametrize('amount', [0, -5, float('nan'), 60.5])
+def test_payments_must_be_positive_and_owed(app, amount):
+    student_id = _student_id()
+    _overdue_loans(2, 4)
+    accrue_fines(NOW)
+    with pytest.raises(PaymentError):
+        record_payment(student_id, amount, NOW)
+    db.session.rollback()
+    assert _balance(student_id) == 60.0
+
+
+def test_payment_route_and_command(make_app):
+    app = make_app()
+    with app.app_context():
+        student_id = _student_id()
+        _overdue_loans(4)
+        accrue_fines(NOW)
+
+    client = login(app, ADMIN)
+    for amount in ('abc', '100', '15'):
+        client.post(f'/fines/pay/{student_id}', data={'amount': amount})
+    with client.session_transaction() as session:
+        assert [message for _, message in session['_flashes']] == [
+            'Enter the amount paid.', 'The payment is more than the outstanding fines (₹40).',
+            'Payment recorded for John Doe.']
+    assert login(app, STUDENT).post(f'/fines/pay/{student_id}', data={'amount': '5'}).status_code == 302
+
+    result = app.test_cli_runner().invoke(args=['record-payment', str(student_id), '5'])
+    assert result.exit_code == 0 and 'the balance is now ₹20' in result.output
+    result = app.test_cli_runner().invoke(args=['record-payment', str(student_id), '50'])
+    assert result.exit_code == 1
+    with app.app_context():
+        assert _balance(student_id) == 20.0
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import ADMIN, login
+from models import db, User, Book, IssuedBook
+
+NOW = datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc)
+IST = timezone(timedelta(hours=5, minutes=30))
+
+# Due dates around NOW: overdue by days, by seconds, due later today,
+# tomorrow's first and last moments, and the day after
+DUE_OFFSETS = [timedelta(days=-3, hours=-2), timedelta(days=-1), timedelta(seconds=-1), timedelta(hours=6),
+               timedelta(hours=12), timedelta(hours=35, minutes=59), timedelta(hours=36), timedelta(days=3)]
+
+
+@pytest.fixture
+def loans(app):
+    book_id = Book.query.first().id
+    users = [User(name=f'Hybrid {index}', email=f'hybrid{index}@example.com', role='student', password_hash='-')
+             for index in range(len(DUE_OFFSETS) + 1)]
+    db.session.add_all(users)
+    db.session.flush()
+    loans = [IssuedBook(user_id=user.id, book_id=book_id, due_date=NOW + offset)
+             for user, offset in zip(users, DUE_OFFSETS)]
+    # A returned overdue loan, with an aware non-UTC due date
+    loans.append(IssuedBook(user_id=users[-1].id, book_id=book_id, due_date=(NOW - timedelta(days=5)).astimezone(IST),
+                            return_date=NOW - timedelta(days=1)))
+    db.session.add_all(loans)
+    db.session.commit()
+    return loans
+
+
+def _matching(predicate):
+    return {loan_id for loan_id, in db.session.query(IssuedBook.id).filter(predicate)}
+
+
+@pytest.mark.parametrize('name', ['is_overdue', 'is_due_tomorrow'])
+def test_sql_predicates_match_python(loans, name):
+    expected = {loan.id for loan in loans if getattr(loan, name)(NOW)}
+    assert expected and _matching(getattr(IssuedBook, name)(NOW)) == expected
+
+
+def test_days_overdue_match_python(loans):
+    in_sql = dict(db.session.query(IssuedBook.id, IssuedBook.days_overdue(NOW)))
+    assert in_sql == {loan.id: loan.days_overdue(NOW) for loan in loans}
+    assert sorted(in_sql.values(), reverse=True)[:3] == [3, 1, 0]
+
+    ordered = [loan_id for loan_id, in db.session.query(IssuedBook.id).filter(IssuedBook.is_overdue(NOW)).order_by(
+        IssuedBook.days_overdue(NOW).desc(), IssuedBook.id)]
+    assert ordered == [loan.id for loan in loans[:3]]
+
+
+def test_due_dates_are_stored_as_utc(loans):
+    returned = db.session.get(IssuedBook, loans[-1].id)
+    db.session.expire(returned)
+    assert returned.due_date == NOW - timedelta(days=5) and returned.due_date.tzinfo == timezone.utc
+    raw = db.session.execute(db.text('SELECT due_date FROM issued_books WHERE id = :id'),
+                             {'id': returned.id}).scalar()
+    assert raw.startswith('2024-02-25 12:00:00')
+
+
+def test_overdue_filter_uses_the_open_loan_index(loans):
+    statement = db.select(IssuedBook.id).where(IssuedBook.is_overdue(NOW)).compile(
+        db.engine, compile_kwargs={'literal_binds': True})
+    plan = ' '.join(row[-1] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {statement}')))
+    assert 'ix_issued_books_open_due' in plan
+
+
+MEMBERSHIPS = [('lifetime', None), ('basic', None), ('3month', NOW + timedelta(days=1)),
+               ('3month', NOW - timedelta(seconds=1)), ('6month', None), ('basic', NOW - timedelta(days=1))]
+
+
+@pytest.fixture
+def members(app):
+    users = [User(name=f'Member {index}', email=f'member{index}@example.com', role='student', password_hash='-',
+                  membership_type=membership_type, membership_expiry=expiry)
+             for index, (membership_type, expiry) in enumerate(MEMBERSHIPS)]
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def test_membership_predicate_matches_python(members):
+    expected = {user.id for user in members if user.is_membership_active(NOW)}
+    assert len(expected) == 3
+    ids = [user.id for user in members]
+    active = {user_id for user_id, in db.session.query(User.id).filter(User.id.in_(ids),
+                                                                      User.is_membership_active(NOW))}
+    assert active == expected
+
+
+def test_memberships_page_filters_in_sql(make_app):
+    app = make_app()
+    with app.app_context():
+        now = datetime.now(timezone.utc)
+        db.session.add_all([
+            User(name='Lapsed Reader', email='lapsed@example.com', role='student', password_hash='-',
+                 membership_type='3month', membership_expiry=now - timedelta(days=1)),
+            User(name='Current Reader', email='current@example.com', role='student', password_hash='-',
+                 membership_type='3month', membership_expiry=now + timedelta(days=1)),
+        ])
+        db.session.commit()
+
+    client = login(app, ADMIN)
+    active = client.get('/memberships', query_string={'status': 'active'}).get_data(as_text=True)
+    expired = client.get('/memberships', query_string={'status': 'expired'}).get_data(as_text=True)
+    assert 'Current Reader' in active and 'Lapsed Reader' not in active
+    assert 'Lapsed Reader' in expired and 'Current Reader' not in expired
@@ -0,0 +1,129 @@
+import sqlite3
+
+import pytest
+
+from conftest import ADMIN, STUDENT, login
+from identity import IdentityCache
+from models import db, User
+
+
+def _student_id():
+    return User.query.filter_by(email=STUDENT[0]).one().id
+
+
+def _logged_in(client):
+    return client.get('/student/dashboard').status_code == 200
+
+
+@pytest.fixture
+def student(make_app):
+    """An app, its identity cache, a logged-in student's client and id"""
+    app = make_app()
+    client = login(app, STUDENT)
+    with app.app_context():
+        student_id = _student_id()
+    assert _logged_in(client)
+    return app, app.extensions['identity_cache'], client, student_id
+
+
+def test_requests_are_served_from_the_cache(student):
+    app, cache, client, student_id = student
+    hits = cache.hits
+    for _ in range(3):
+        assert _logged_in(client)
+    assert cache.hits == hits + 3
+    assert cache.store.get(student_id)['role'] == 'student'
+
+
+def test_membership_update_invalidates(student):
+    app, cache, client, student_id = student
+    login(app, ADMIN).post(f'/memberships/update/{student_id}', data={'membership_type': '3month'})
+    assert cache.store.get(student_id) is None
+    assert _logged_in(client)
+    assert cache.store.get(student_id)['membership_type'] == '3month'
+
+
+def test_bulk_membership_update_invalidates(student):
+    app, cache, client, student_id = student
+    with app.app_context():
+        User.query.filter_by(id=student_id).update({'membership_type': 'lifetime'})
+        db.session.commit()
+    assert cache.store.get(student_id) is None
+    assert _logged_in(client)
+
+
+def test_role_changes_end_other_sessions(student):
+    app, cache, client, student_id = student
+    with app.app_context():
+        db.session.execute(db.update(User).where(User.role == 'student').values(role='admin'))
+        db.session.commit()
+        assert db.session.get(User, student_id).session_version == 2
+    assert cache.store.get(student_id) is None
+    assert not _logged_in(client)
+
+
+def test_password_change_ends_other_sessions(student):
+    app, cache, client, student_id = student
+    with app.app_context():
+        db.session.get(User, student_id).set_password('changed123')
+        db.session.commit()
+    assert not _logged_in(client)
+    assert _logged_in(login(app, (STUDENT[0], 'changed123')))
+
+
+def test_bulk_update_of_other_fields_keeps_sessions(student):
+    app, cache, client, student_id = student
+    with app.app_context():
+        User.query.filter_by(id=student_id).update({'name': 'Jane Doe'})
+        db.session.commit()
+        assert db.session.get(User, student_id).session_version == 1
+    assert _logged_in(client) and cache.store.get(student_id)['name'] == 'Jane Doe'
+
+
+def test_deleted_users_are_logged_out(student):
+    app, cache, client, student_id = student
+    with app.app_context():
+        db.session.execute(db.delete(User).where(User.id == student_id))
+        db.session.commit()
+    assert cache.store.get(student_id) is None
+    assert not _logged_in(client)
+
+
+def test_users_deleted_elsewhere_are_evicted(make_app, tmp_path):
+    path = tmp_path / 'library.db'
+    app = make_app(f'sqlite:///{path}')
+    cache = app.extensions['identity_cache']
+    with app.app_context():
+        student_id = _student_id()
+        snapshot = cache.load(f'{student_id}:1')
+
+        # Another process deletes the user; this one still has the entry
+        with sqlite3.connect(path) as other:
+            other.execute('DELETE FROM users WHERE id = ?', (student_id,))
+        assert cache.store.get(student_id) is not None
+        with pytest.raises(AttributeError, match='no longer exists'):
+            snapshot.fine_balance
+        assert cache.store.get(student_id) is None
+        assert cache.load(f'{student_id}:1') is None
+
+
+def test_loader_evicts_entries_for_missing_users(app):
+    cache = app.extensions['identity_cache']
+    cache.store.set(999, {'id': 999, 'session_version': 1})
+    # A session from another version misses the entry and reads the table
+    assert cache.load('999:2') is None
+    assert cache.store.get(999) is None
+
+
+def test_file_store_is_shared_between_caches(make_app, tmp_path):
+    app = make_app(IDENTITY_CACHE_STORE='file', IDENTITY_CACHE_FOLDER=str(tmp_path / 'identity'))
+    with app.app_context():
+        student_id = _student_id()
+        assert app.extensions['identity_cache'].load(f'{student_id}:1').role == 'student'
+        other = IdentityCache(app)
+        assert other.load(f'{student_id}:1').name == 'John Doe' and other.hits == 1
+
+        User.query.filter_by(id=student_id).update({'role': 'admin'})
+        db.session.commit()
+        assert other.store.get(student_id) is None
+        assert other.load(f'{student_id}:2').role == 'admin'
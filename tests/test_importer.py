@@ -0,0 +1,158 @@
+import io
+import sqlite3
+import time
+
+import pytest
+from openpyxl import Workbook
+from sqlalchemy import event
+
+from conftest import ADMIN, login
+from importer import ImportFileError, import_books
+from jobs import JOB_DONE, JOB_FAILED
+from models import db, Book, IssuedBook
+from stats import reconcile_category_counts, reconcile_stats
+
+
+def _csv(tmp_path, text, name='books.csv'):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def _book(title):
+    return Book.query.filter_by(title=title).one()
+
+
+@pytest.mark.parametrize('text, error', [
+    ('', 'empty'),
+    ('Name,Writer\n', 'Missing required columns: title, author, category'),
+    ('Title,Author\nDune,Frank Herbert\n', 'Missing required columns: category'),
+])
+def test_bad_files_are_rejected_before_any_row(app, tmp_path, text, error):
+    with pytest.raises(ImportFileError, match=error):
+        import_books(_csv(tmp_path, text))
+
+
+def test_header_only_file_imports_nothing(app, tmp_path):
+    result = import_books(_csv(tmp_path, 'Title,Author,Category,Total Copies\n'))
+    assert (result['rows'], result['inserted'], result['failed']) == (0, 0, 0)
+
+
+def test_cli_reports_file_errors_without_a_traceback(make_app, tmp_path):
+    result = make_app().test_cli_runner().invoke(args=['import-books', _csv(tmp_path, '')])
+    assert result.exit_code == 1 and result.output.strip() == 'The file is empty.'
+
+
+def test_rows_are_inserted_updated_and_reported(app, tmp_path):
+    path = _csv(tmp_path, 'Title,Author,Category,Copies\n'
+                          'Dune,Frank Herbert,Space Opera,2\n'
+                          'The Great Gatsby,F. Scott Fitzgerald,Fiction,3\n'
+                          '1984,George Orwell,Fiction,5\n'
+                          ',Nobody,Fiction,1\n'
+                          'Emma,Jane Austen,Romance,lots\n')
+    result = import_books(path, chunk_size=2)
+    assert {key: result[key] for key in ('rows', 'inserted', 'updated', 'unchanged', 'failed',
+                                         'categories_created')} == \
+        {'rows': 5, 'inserted': 1, 'updated': 1, 'unchanged': 1, 'failed': 2, 'categories_created': 1}
+    assert [error['row'] for error in result['errors']] == [5, 6]
+
+    orwell = _book('1984')
+    assert (orwell.category.name, orwell.total_copies, orwell.available_copies) == ('Fiction', 5, 5)
+    assert _book('Dune').available_copies == 2
+    assert reconcile_stats() == {} and reconcile_category_counts() == {}
+
+
+def test_updates_move_available_copies_by_the_change(app, tmp_path):
+    gatsby = _book('The Great Gatsby')
+    db.session.add(IssuedBook(user_id=2, book_id=gatsby.id))
+    gatsby.available_copies -= 1
+    db.session.commit()
+
+    result = import_books(_csv(tmp_path, 'Title,Author,Category,Copies\n'
+                                         'The Great Gatsby,F. Scott Fitzgerald,Fiction,2\n'))
+    assert result['updated'] == 1
+    db.session.refresh(gatsby)
+    assert (gatsby.total_copies, gatsby.available_copies) == (2, 1)
+
+    result = import_books(_csv(tmp_path, 'Title,Author,Category,Copies\n'
+                                         'The Great Gatsby,F. Scott Fitzgerald,Fiction,1\n'
+                                         'Lord of the Flies,William Golding,Fiction,1\n'))
+    # Fine: one copy is on loan and one stays; the other book has none out
+    assert (result['updated'], result['failed']) == (2, 0)
+    db.session.refresh(gatsby)
+    assert (gatsby.total_copies, gatsby.available_copies) == (1, 0)
+
+
+def test_copies_cannot_drop_below_the_loans(app, tmp_path):
+    animal_farm = _book('Animal Farm')
+    for user_id in (1, 2):
+        db.session.add(IssuedBook(user_id=user_id, book_id=animal_farm.id))
+    animal_farm.available_copies -= 2
+    db.session.commit()
+
+    result = import_books(_csv(tmp_path, 'Title,Author,Category,Copies\nAnimal Farm,George Orwell,Fiction,1\n'))
+    assert result['failed'] == 1 and result['errors'][0]['row'] == 2
+    assert 'copies on loan' in result['errors'][0]['error']
+    db.session.refresh(animal_farm)
+    assert (animal_farm.category.name, animal_farm.total_copies, animal_farm.available_copies) == \
+        ('Political Fiction', 3, 1)
+
+
+def test_loans_made_during_the_import_fail_the_chunk(make_app, tmp_path):
+    path = tmp_path / 'library.db'
+    app = make_app(f'sqlite:///{path}')
+    with app.app_context():
+        book_id = _book('Pride and Prejudice').id
+
+        def issue_both_copies(conn, cursor, statement, parameters, context, executemany):
+            # Another connection lends out the copies between the read and the update
+            if statement.startswith('INSERT INTO books'):
+                with sqlite3.connect(path) as other:
+                    other.execute('UPDATE books SET available_copies = 0 WHERE id = ?', (book_id,))
+
+        event.listen(db.engine, 'before_cursor_execute', issue_both_copies)
+        try:
+            result = import_books(_csv(tmp_path, 'Title,Author,Category,Copies\n'
+                                                 'Pride and Prejudice,Jane Austen,Romance,1\n'
+                                                 'Dune,Frank Herbert,Fiction,1\n'))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', issue_both_copies)
+
+        assert (result['inserted'], result['updated'], result['failed']) == (0, 0, 2)
+        assert 'import these rows again' in result['errors'][0]['error']
+        book = db.session.get(Book, book_id)
+        assert (book.total_copies, book.available_copies) == (2, 0)
+        assert Book.query.filter_by(title='Dune').count() == 0
+
+
+def test_xlsx_files_are_imported(app, tmp_path):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['Title', 'Author', 'Category', 'Total Copies'])
+    sheet.append(['Dune', 'Frank Herbert', 'Space Opera', 2])
+    sheet.append([None, None, None, None])
+    sheet.append(['Emma', 'Jane Austen', 'Romance', 1.0])
+    path = str(tmp_path / 'books.xlsx')
+    workbook.save(path)
+
+    result = import_books(path)
+    assert (result['rows'], result['inserted'], result['failed']) == (2, 2, 0)
+    assert _book('Dune').total_copies == 2
+
+
+def test_upload_runs_as_a_job(make_app):
+    app = make_app()
+    client = login(app, ADMIN)
+    data = {'file': (io.BytesIO(b'Title,Author,Category\nDune,Frank Herbert,Space Opera\n'), 'books.csv')}
+    response = client.post('/books/import', data=data, content_type='multipart/form-data')
+    assert response.status_code == 202
+
+    status_url = f"/books/import/jobs/{response.get_json()['id']}"
+    deadline = time.monotonic() + 10
+    while (job := client.get(status_url).get_json())['status'] not in (JOB_DONE, JOB_FAILED):
+        assert time.monotonic() < deadline, 'import job did not finish'
+        time.sleep(0.05)
+    assert job['status'] == JOB_DONE and job['result']['inserted'] == 1
+
+    bad = {'file': (io.BytesIO(b'x'), 'books.txt')}
+    assert client.post('/books/import', data=bad, content_type='multipart/form-data').status_code == 400
@@ -0,0 +1,141 @@
+import io
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from flask import current_app
+from openpyxl import load_workbook
+
+from conftest import ADMIN, login
+from jobs import JOB_DONE, JOB_FAILED, JOB_RUNNING
+
+
+def _wait(runner, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = runner.get(job_id)
+        if job['status'] in (JOB_DONE, JOB_FAILED):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+def _write_output(job_id, progress):
+    path = current_app.extensions['jobs'].file_path(job_id, '.txt')
+    with open(path, 'w') as file:
+        file.write('data')
+    progress(1, 1)
+    return {'file': os.path.basename(path)}
+
+
+def _fail(job_id, progress):
+    raise RuntimeError('boom')
+
+
+@pytest.fixture
+def runner(app):
+    return app.extensions['jobs']
+
+
+def _files(runner):
+    return sorted(os.listdir(runner.folder))
+
+
+def test_jobs_expire_from_the_moment_they_are_queued(runner):
+    job = runner.submit('test', _write_output, {})
+    created_at = datetime.fromisoformat(job['created_at'])
+    assert datetime.fromisoformat(job['expires_at']) == created_at + runner.timeout + runner.retention
+
+    job = _wait(runner, job['id'])
+    assert job['status'] == JOB_DONE
+    assert job['result'] == {'file': f"{job['id']}.txt"}
+    assert job['progress'] == {'current': 1, 'total': 1}
+    finished_at = datetime.fromisoformat(job['finished_at'])
+    assert datetime.fromisoformat(job['expires_at']) == finished_at + runner.retention
+
+
+def test_failed_jobs_record_the_error(runner):
+    job = _wait(runner, runner.submit('test', _fail, {})['id'])
+    assert (job['status'], job['error']) == (JOB_FAILED, 'boom')
+
+
+def test_purge_removes_expired_jobs_and_their_files(runner):
+    old = _wait(runner, runner.submit('test', _write_output, {})['id'])
+    fresh = _wait(runner, runner.submit('test', _write_output, {})['id'])
+    runner.update(old['id'], expires_at=(datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat())
+
+    assert runner.purge_expired() == 1
+    assert runner.get(old['id']) is None
+    assert _files(runner) == [f"{fresh['id']}.json", f"{fresh['id']}.txt"]
+
+
+def test_stale_running_jobs_fail_after_the_timeout_then_are_purged(runner):
+    created_at = datetime.now(timezone.utc) - runner.timeout - timedelta(minutes=1)
+    job_id = 'a' * 32
+    runner._save({'id': job_id, 'kind': 'test', 'status': JOB_RUNNING, 'params': {}, 'created_by': None,
+                  'created_at': created_at.isoformat(), 'started_at': created_at.isoformat(),
+                  'finished_at': None, 'expires_at': None, 'progress': {'current': 0, 'total': None},
+                  'result': None, 'error': None})
+
+    assert runner.purge_expired() == 0
+    job = runner.get(job_id)
+    assert (job['status'], job['error']) == (JOB_FAILED, 'Timed out')
+
+    assert runner.purge_expired(created_at + runner.timeout + runner.retention) == 1
+    assert runner.get(job_id) is None
+
+
+def test_purge_skips_files_another_process_removed(runner, monkeypatch):
+    job = _wait(runner, runner.submit('test', _write_output, {})['id'])
+    gone = _wait(runner, runner.submit('test', _write_output, {})['id'])
+    expired = (datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat()
+    for job_id in (job['id'], gone['id']):
+        runner.update(job_id, expires_at=expired)
+
+    get = runner.get
+
+    def racing_get(job_id):
+        # Another process's purge gets there first: gone's state file
+        # vanishes before it is read, job's output before it is removed
+        if job_id == gone['id']:
+            os.remove(runner.file_path(gone['id'], '.json'))
+            return get(job_id)
+        found = get(job_id)
+        os.remove(runner.file_path(job['id'], '.txt'))
+        return found
+
+    monkeypatch.setattr(runner, 'get', racing_get)
+    monkeypatch.setattr(runner, '_fail_timed_out', lambda found, now: found)
+    assert runner.purge_expired() == 1
+    assert _files(runner) == [f"{gone['id']}.txt"]
+
+
+def test_export_job_round_trip(make_app):
+    app = make_app()
+    client = login(app, ADMIN)
+    response = client.post('/admin/database/export/jobs', data={'tables': ['books', 'categories']})
+    assert response.status_code == 202
+    job = _wait(app.extensions['jobs'], response.get_json()['id'])
+    assert job['status'] == JOB_DONE
+
+    status = client.get(f"/admin/database/export/jobs/{job['id']}").get_json()
+    download = client.get(status['download_url'])
+    workbook = load_workbook(io.BytesIO(download.get_data()), read_only=True)
+    assert workbook.sheetnames == ['Books', 'Categories']
+
+
+@pytest.mark.parametrize('data, error', [({'tables': ['secrets']}, 'Unknown tables'),
+                                         ({'start_date': '01/02/2024'}, 'YYYY-MM-DD')])
+def test_export_job_rejects_bad_parameters(make_app, data, error):
+    response = login(make_app(), ADMIN).post('/admin/database/export/jobs', data=data)
+    assert response.status_code == 400 and error in response.get_json()['error']
+
+
+def test_unknown_job_ids_are_not_found(make_app):
+    app = make_app()
+    client = login(app, ADMIN)
+    assert client.get('/admin/database/export/jobs/../../etc/passwd').status_code == 404
+    assert client.get(f"/admin/database/export/jobs/{'b' * 32}").status_code == 404
+    with app.app_context():
+        assert app.extensions['jobs'].get('../config') is None
@@ -0,0 +1,116 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import inspect
+
+from migrations import MIGRATIONS, HOT_PATH_INDEXES, current_version, upgrade_database
+from models import db, User, Book, Category, IssuedBook, Notification, FineLedgerEntry, SchemaVersion
+
+# The schema and some rows as the application wrote them before versioned
+# migrations: category names on books, no counters, no dedup key
+LEGACY_SCHEMA = """
+CREATE TABLE users (id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, email VARCHAR(120) NOT NULL,
+    mobile VARCHAR(15), password_hash VARCHAR(255) NOT NULL, role VARCHAR(20) NOT NULL,
+    membership_type VARCHAR(20), membership_expiry DATETIME, created_at DATETIME,
+    PRIMARY KEY (id), UNIQUE (email));
+CREATE TABLE books (id INTEGER NOT NULL, title VARCHAR(200) NOT NULL, author VARCHAR(100) NOT NULL,
+    category VARCHAR(50) NOT NULL, total_copies INTEGER NOT NULL, available_copies INTEGER NOT NULL,
+    cover_photo VARCHAR(255), created_at DATETIME, PRIMARY KEY (id));
+CREATE TABLE categories (id INTEGER NOT NULL, name VARCHAR(50) NOT NULL, created_at DATETIME,
+    PRIMARY KEY (id), UNIQUE (name));
+CREATE TABLE issued_books (id INTEGER NOT NULL, user_id INTEGER NOT NULL, book_id INTEGER NOT NULL,
+    issue_date DATETIME, due_date DATETIME NOT NULL, return_date DATETIME, fine FLOAT, PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES users (id), FOREIGN KEY(book_id) REFERENCES books (id));
+CREATE TABLE notifications (id INTEGER NOT NULL, user_id INTEGER NOT NULL, message TEXT NOT NULL,
+    created_at DATETIME, is_read BOOLEAN, notification_type VARCHAR(20), PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES users (id));
+
+INSERT INTO users VALUES (1, 'Admin User', 'admin@library.com', NULL, 'x', 'admin', 'lifetime', NULL,
+    '2024-01-01 00:00:00.000000');
+INSERT INTO users VALUES (2, 'John Doe', 'student@library.com', NULL, 'x', 'student', 'basic', NULL,
+    '2024-01-01 00:00:00.000000');
+INSERT INTO categories VALUES (1, 'Fiction', '2024-01-01 00:00:00.000000');
+INSERT INTO books VALUES (1, '1984', 'George Orwell', 'Fiction', 2, 1, NULL, '2024-01-01 00:00:00.000000');
+INSERT INTO books VALUES (2, 'Dune', 'Frank Herbert', 'Space Opera', 1, 0, NULL, '2024-01-01 00:00:00.000000');
+INSERT INTO issued_books VALUES (1, 2, 1, '2024-02-01 00:00:00.000000', '2024-02-11 00:00:00.000000',
+    NULL, 0.0);
+INSERT INTO issued_books VALUES (2, 2, 2, '2024-01-01 00:00:00.000000', '2024-01-11 00:00:00.000000',
+    '2024-01-15 00:00:00.000000', 40.0);
+INSERT INTO notifications VALUES (1, 2, 'Book ''1984'' is overdue by 2 days. Fine: ₹20',
+    '2024-02-13 09:00:00.000000', 0, 'danger');
+INSERT INTO notifications VALUES (2, 2, 'Welcome to the library', '2024-01-01 00:00:00.000000', 1, 'info');
+"""
+
+
+@pytest.fixture
+def legacy_app(make_app, tmp_path):
+    path = tmp_path / 'legacy.db'
+    with sqlite3.connect(path) as connection:
+        connection.executescript(LEGACY_SCHEMA)
+    app = make_app(f'sqlite:///{path}')
+    with app.app_context():
+        yield app
+
+
+def test_fresh_database_is_stamped_with_every_migration(app):
+    assert current_version() == MIGRATIONS[-1][0]
+    assert [version for version, in db.session.query(SchemaVersion.version).order_by(SchemaVersion.version)] == \
+        [version for version, _, _ in MIGRATIONS]
+
+
+def test_migration_versions_are_unique_and_ascending():
+    versions = [version for version, _, _ in MIGRATIONS]
+    assert versions == sorted(set(versions)) and versions[0] == 1
+
+
+def test_legacy_database_is_upgraded_in_place(legacy_app):
+    assert current_version() == MIGRATIONS[-1][0]
+    assert 'category' not in {column['name'] for column in inspect(db.engine).get_columns('books')}
+
+    # Categories by id, unknown names created, counts maintained
+    assert {book.title: book.category.name for book in Book.query} == {'1984': 'Fiction', 'Dune': 'Space Opera'}
+    assert {category.name: category.book_count for category in Category.query} == {'Fiction': 1, 'Space Opera': 1}
+
+    # Counters and ledger backfilled from the old rows
+    student = db.session.get(User, 2)
+    assert (student.unread_notifications, student.fine_balance, student.session_version) == (1, 40.0, 1)
+    assert [(entry.loan_id, entry.kind, entry.amount) for entry in FineLedgerEntry.query] == \
+        [(2, FineLedgerEntry.KIND_OPENING, 40.0)]
+
+    # Legacy alerts get the structured dedup key
+    overdue = db.session.get(Notification, 1)
+    assert (overdue.loan_id, overdue.kind, str(overdue.day_bucket)) == (1, Notification.KIND_OVERDUE, '2024-02-13')
+    assert db.session.get(Notification, 2).kind is None
+
+    indexes = {index['name'] for table in ('users', 'books', 'issued_books', 'notifications')
+               for index in inspect(db.engine).get_indexes(table)}
+    assert set(HOT_PATH_INDEXES) <= indexes
+    assert {'uq_notifications_loan_kind_day', 'uq_issued_books_open_user_book', 'ix_books_category_id'} <= indexes
+
+
+def test_upgrade_is_a_no_op_when_current(legacy_app):
+    applied = SchemaVersion.query.count()
+    upgrade_database()
+    assert SchemaVersion.query.count() == applied
+    assert FineLedgerEntry.query.count() == 1
+
+
+def test_duplicate_open_loans_stop_the_upgrade(make_app, tmp_path):
+    path = tmp_path / 'duplicates.db'
+    with sqlite3.connect(path) as connection:
+        connection.executescript(LEGACY_SCHEMA)
+        connection.execute("INSERT INTO issued_books VALUES (3, 2, 1, '2024-02-02 00:00:00', '2024-02-12 00:00:00', "
+                           "NULL, 0.0)")
+    with pytest.raises(RuntimeError, match=r'\(user 2, book 1\)'):
+        make_app(f'sqlite:///{path}')
+    with sqlite3.connect(path) as connection:
+        assert connection.execute('SELECT max(version) FROM schema_version').fetchone()[0] == 5
+
+
+def test_loans_have_the_open_loan_partial_index(app):
+    loan = IssuedBook(user_id=2, book_id=1)
+    db.session.add(loan)
+    db.session.commit()
+    plan = ' '.join(row[-1] for row in db.session.execute(db.text(
+        'EXPLAIN QUERY PLAN SELECT id FROM issued_books WHERE return_date IS NULL ORDER BY due_date')))
+    assert 'ix_issued_books_open_due' in plan
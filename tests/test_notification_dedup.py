@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import sweep
+from conftest import STUDENT
+from migrations import _backfill_notification_dedup_keys
+from models import db, User, Book, IssuedBook, Notification
+from sweep import insert_keyed_notifications
+
+
+def _student_and_book(title='1984'):
+    return User.query.filter_by(email=STUDENT[0]).one(), Book.query.filter_by(title=title).one()
+
+
+def _keyed_row(loan, kind=Notification.KIND_OVERDUE, day=None):
+    return {
+        'user_id': loan.user_id, 'message': 'alert', 'notification_type': 'danger',
+        'loan_id': loan.id, 'kind': kind, 'day_bucket': day or datetime.now(timezone.utc).date()
+    }
+
+
+@pytest.fixture
+def loan(app):
+    student, book = _student_and_book()
+    loan = IssuedBook(user_id=student.id, book_id=book.id)
+    db.session.add(loan)
+    db.session.commit()
+    return loan
+
+
+@pytest.mark.parametrize('insert_ignore', [True, False], ids=['on_conflict', 'probe'])
+def test_insert_keyed_notifications_skips_existing_keys(loan, monkeypatch, insert_ignore):
+    if not insert_ignore:
+        monkeypatch.setattr(sweep, '_insert_ignore_sql', lambda: None)
+    today = datetime.now(timezone.utc).date()
+    assert insert_keyed_notifications([_keyed_row(loan)]) == 1
+    rows = [_keyed_row(loan), _keyed_row(loan, day=today + timedelta(days=1)),
+            _keyed_row(loan, kind=Notification.KIND_DUE_TOMORROW)]
+    assert insert_keyed_notifications(rows) == 2
+    db.session.commit()
+    assert Notification.query.count() == 3
+
+
+def test_unique_key_rejects_a_duplicate_alert(loan):
+    db.session.execute(db.insert(Notification), [_keyed_row(loan)])
+    with pytest.raises(IntegrityError):
+        db.session.execute(db.insert(Notification), [_keyed_row(loan)])
+    db.session.rollback()
+
+
+def test_unkeyed_notifications_are_not_deduplicated(loan):
+    for _ in range(2):
+        db.session.add(Notification(user_id=loan.user_id, message='Welcome'))
+    db.session.commit()
+    assert Notification.query.count() == 2
+
+
+def test_backfill_matches_legacy_alerts_to_the_loan_open_at_the_time(app):
+    student, book = _student_and_book()
+    now = datetime.now(timezone.utc)
+    first = IssuedBook(user_id=student.id, book_id=book.id, issue_date=now - timedelta(days=30),
+                       due_date=now - timedelta(days=20), return_date=now - timedelta(days=15))
+    second = IssuedBook(user_id=student.id, book_id=book.id, issue_date=now - timedelta(days=10),
+                        due_date=now - timedelta(days=2))
+    db.session.add_all([first, second])
+    db.session.flush()
+
+    def legacy(message, notification_type, created_at):
+        notification = Notification(user_id=student.id, message=message, notification_type=notification_type,
+                                    created_at=created_at)
+        db.session.add(notification)
+        return notification
+
+    old_overdue = legacy("Book '1984' is overdue by 3 days. Fine: ₹30", 'danger', now - timedelta(days=17))
+    new_overdue = legacy("Book '1984' is overdue by 1 days. Fine: ₹10", 'danger', now - timedelta(days=1))
+    repeat = legacy("Book '1984' is overdue by 1 days. Fine: ₹10", 'danger', now - timedelta(days=1) + timedelta(minutes=5))
+    due = legacy("Book '1984' is due tomorrow!", 'warning', now - timedelta(days=3))
+    unmatched = legacy("Book 'Missing' is due tomorrow!", 'warning', now - timedelta(days=3))
+    db.session.commit()
+
+    _backfill_notification_dedup_keys()
+
+    assert (old_overdue.loan_id, old_overdue.kind) == (first.id, Notification.KIND_OVERDUE)
+    assert (new_overdue.loan_id, new_overdue.day_bucket) == (second.id, (now - timedelta(days=1)).date())
+    assert repeat.loan_id is None  # same (loan, kind, day) as new_overdue
+    assert (due.loan_id, due.kind, due.day_bucket) == (second.id, Notification.KIND_DUE_TOMORROW,
+                                                      second.due_date.date())
+    assert unmatched.loan_id is None
@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from conftest import ADMIN, STUDENT, login
+from models import db, User, Book, Notification
+from outbox import pending_notifications, queue_notification
+from profiler import count_queries
+
+
+def _student():
+    return User.query.filter_by(email=STUDENT[0]).one()
+
+
+@contextmanager
+def count_commits(engine):
+    commits = []
+
+    def record(conn):
+        commits.append(conn)
+    event.listen(engine, 'commit', record)
+    try:
+        yield commits
+    finally:
+        event.remove(engine, 'commit', record)
+
+
+def test_queued_rows_are_written_with_one_insert_at_commit(app):
+    student = _student()
+    before = Notification.query.count()
+    for index in range(3):
+        queue_notification(student.id, f'Message {index}')
+    assert len(pending_notifications()) == 3
+    assert Notification.query.count() == before
+
+    with count_queries() as counter:
+        db.session.commit()
+    assert sum(statement.startswith('INSERT INTO notifications') for statement in counter.statements) == 1
+    assert pending_notifications() == []
+    assert [notification.message for notification in
+            Notification.query.filter_by(user_id=student.id).order_by(Notification.id)][-3:] == \
+        ['Message 0', 'Message 1', 'Message 2']
+    db.session.refresh(student)
+    assert student.unread_notifications == Notification.query.filter_by(user_id=student.id, is_read=False).count()
+
+
+def test_rolled_back_rows_are_dropped(app):
+    student = _student()
+    before = Notification.query.count()
+    queue_notification(student.id, 'Never sent')
+    db.session.rollback()
+    assert pending_notifications() == []
+    db.session.commit()
+    assert Notification.query.count() == before
+
+
+def test_circulation_actions_cost_one_commit(make_app):
+    app = make_app()
+    client = login(app, ADMIN)
+    with app.app_context():
+        student_id = _student().id
+        book_id = Book.query.filter_by(title='Animal Farm').one().id
+        engine = db.engine
+
+    with count_commits(engine) as commits:
+        client.post('/issue-book', data={'student_id': student_id, 'book_id': book_id})
+    assert len(commits) == 1
+    with count_commits(engine) as commits:
+        client.post(f'/memberships/update/{student_id}', data={'membership_type': '3month'})
+    assert len(commits) == 1
+
+    with app.app_context():
+        messages = [notification.message for notification in
+                    Notification.query.filter_by(user_id=student_id).order_by(Notification.id)]
+        assert messages[-2].startswith("Book 'Animal Farm' has been issued to you.")
+        assert messages[-1] == 'Your membership has been updated to 3 Month (₹100).'
@@ -0,0 +1,75 @@
+import base64
+import json
+from datetime import date, datetime, timezone
+
+import pytest
+
+from conftest import ADMIN, login, seed_loans
+from models import db, Book, IssuedBook
+from pagination import decode_cursor, encode_cursor, paginate_keyset
+
+
+def _cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def test_cursor_round_trips_dates_and_scalars():
+    values = [datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc), date(2024, 5, 1), 'title', 7, 1.5, None]
+    assert decode_cursor(encode_cursor(values), len(values)) == values
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!', _cursor({'x': 1}), _cursor([{'x': 1}]), _cursor([[1]]), _cursor([{'dt': 5}]),
+    _cursor([{'d': ['2024-01-01']}]), _cursor([{'dt': 'yesterday'}]), _cursor([1, 2]), _cursor('1'),
+])
+def test_tampered_cursor_decodes_to_none(cursor):
+    assert decode_cursor(cursor, 1) is None
+
+
+@pytest.mark.parametrize('cursor', [_cursor([{'x': 1}]), _cursor([{'dt': 5}]), _cursor([[1, 2]])])
+def test_tampered_cursor_falls_back_to_the_first_page(make_app, cursor):
+    client = login(make_app(), ADMIN)
+    first = client.get('/books')
+    response = client.get('/books', query_string={'cursor': cursor})
+    assert response.status_code == 200
+    assert response.get_data() == first.get_data()
+    assert b'The Great Gatsby' in first.get_data()
+
+
+def test_pages_cover_every_row_once_with_duplicate_sort_values(app):
+    seed_loans(25)
+    sort_keys = [(IssuedBook.due_date, True), (IssuedBook.id, False)]
+    # Several loans share a due date
+    db.session.execute(db.update(IssuedBook).where(IssuedBook.id % 3 == 0).values(
+        due_date=datetime(2030, 1, 1, tzinfo=timezone.utc)))
+    db.session.commit()
+
+    expected = [loan.id for loan in IssuedBook.query.order_by(IssuedBook.due_date.desc(), IssuedBook.id)]
+    seen, cursor = [], None
+    while True:
+        page = paginate_keyset(IssuedBook.query, sort_keys, cursor, per_page=4)
+        assert len(page) <= 4
+        seen.extend(loan.id for loan in page)
+        cursor = page.next_cursor
+        if not page.has_next:
+            break
+    assert seen == expected
+
+
+def test_last_page_has_no_cursor(app):
+    count = Book.query.count()
+    page = paginate_keyset(Book.query, [(Book.id, False)], per_page=count)
+    assert len(page) == count and page.next_cursor is None
+
+
+def test_core_select_pages_return_row_tuples(app):
+    page = paginate_keyset(db.select(Book.title, Book.author), [(Book.id, False)], per_page=2)
+    assert page.items == [('The Great Gatsby', 'F. Scott Fitzgerald'), ('To Kill a Mockingbird', 'Harper Lee')]
+    rest = paginate_keyset(db.select(Book.title, Book.author), [(Book.id, False)], page.next_cursor, per_page=2)
+    assert rest.items[0] == ('1984', 'George Orwell')
+
+
+def test_page_size_is_capped(make_app):
+    app = make_app(MAX_PAGE_SIZE=3)
+    with app.test_request_context('/?per_page=1000'), app.app_context():
+        assert len(paginate_keyset(Book.query, [(Book.id, False)])) == 3
@@ -0,0 +1,56 @@
+import json
+import logging
+
+from conftest import ADMIN, STUDENT, login
+from models import Book
+from profiler import count_queries
+
+
+def test_count_queries_records_statements_on_every_engine(app):
+    with count_queries() as counter:
+        Book.query.count()
+        Book.query.first()
+    assert counter.count == 2
+    assert all(statement.startswith('SELECT') for statement in counter.statements)
+
+    Book.query.count()
+    assert counter.count == 2  # listener removed on exit
+
+
+def test_profiler_is_opt_in(make_app):
+    app = make_app()
+    assert 'sql_profiler' not in app.extensions
+    assert login(app, ADMIN).get('/admin/profiler').status_code == 404
+
+
+def test_profiler_summarises_requests_per_endpoint(make_app):
+    app = make_app(SQL_PROFILER_ENABLED=True)
+    client = login(app, ADMIN)
+    for _ in range(3):
+        client.get('/books')
+
+    data = client.get('/admin/profiler', query_string={'limit': 2}).get_json()
+    assert [record['endpoint'] for record in data['recent_requests']] == ['main.books', 'main.books']
+    books = next(row for row in data['endpoints'] if row['endpoint'] == 'main.books')
+    assert books['requests'] == 3 and books['max_queries'] >= 1
+    record = data['recent_requests'][0]
+    assert len(record['slowest_statements']) == min(record['queries'], app.config['SQL_PROFILER_TOP_STATEMENTS'])
+    assert record['slowest_statements'][0]['sql'].startswith('SELECT')
+    assert login(app, STUDENT).get('/admin/profiler').status_code == 403
+
+
+def test_profile_buffer_is_bounded(make_app):
+    app = make_app(SQL_PROFILER_ENABLED=True, SQL_PROFILER_BUFFER_SIZE=2)
+    client = login(app, ADMIN)
+    for _ in range(5):
+        client.get('/books')
+    assert len(app.extensions['sql_profiler'].recent()) == 2
+
+
+def test_slow_requests_are_logged_as_json(make_app, caplog):
+    app = make_app(SQL_PROFILER_ENABLED=True, SLOW_REQUEST_MS=0)
+    client = login(app, ADMIN)
+    with caplog.at_level(logging.WARNING, logger='library.slow_requests'):
+        client.get('/books')
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record['endpoint'] == 'main.books' and record['status'] == 200
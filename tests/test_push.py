@@ -0,0 +1,160 @@
+import sqlite3
+
+import pytest
+
+from conftest import STUDENT, login
+from models import db, User, Notification
+from outbox import queue_notification
+from profiler import count_queries
+from push import REPLAY_LIMIT, StreamLimitReached, Subscription, notification_stream
+
+
+def _student_id():
+    return User.query.filter_by(email=STUDENT[0]).one().id
+
+
+def _notify(user_ids, message='Hello'):
+    for user_id in user_ids:
+        queue_notification(user_id, message)
+    db.session.commit()
+
+
+def _news(subscription, timeout=5):
+    """Wait for the broker to deliver to `subscription`"""
+    assert subscription.wait(timeout), 'nothing was delivered'
+    return subscription.take()
+
+
+def _events(stream, count):
+    return [next(stream) for _ in range(count)]
+
+
+@pytest.fixture
+def broker(app):
+    return app.extensions['push_broker']
+
+
+def test_streams_are_capped_per_user_and_per_process(make_app):
+    app = make_app(PUSH_MAX_STREAMS=2, PUSH_MAX_STREAMS_PER_USER=1)
+    broker = app.extensions['push_broker']
+    with app.app_context():
+        student_id = _student_id()
+        held = broker.subscribe(student_id)
+        with pytest.raises(StreamLimitReached) as error:
+            broker.subscribe(student_id)
+        assert error.value.per_user
+        admin = broker.subscribe(1)
+
+    client = login(app, STUDENT)
+    response = client.get('/api/notifications/stream')
+    assert response.status_code == 503 and response.headers['Retry-After'] == '30'
+    admin.close()
+    response = client.get('/api/notifications/stream')
+    assert response.status_code == 429
+    held.close()
+
+    app.config['PUSH_STREAM_MAX_SECONDS'] = 0
+    response = client.get('/api/notifications/stream')
+    assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+    assert response.get_data(as_text=True).startswith('retry: 3000')
+    assert broker.subscriber_count() == 0
+
+
+def test_one_shared_poll_serves_every_stream(app, broker):
+    student_id = _student_id()
+    subscriptions = [broker.subscribe(user_id) for user_id in (student_id, student_id, 1)]
+    with count_queries() as counter:
+        _notify([student_id, 1, student_id])
+        news = [_news(subscription) for subscription in subscriptions]
+
+    assert [len(rows) for rows, _, _ in news] == [2, 2, 1]
+    assert [count for _, count, _ in news] == [2, 2, 1]
+    # The max id, the new rows and the counts, however many streams are open
+    assert sum(statement.startswith('SELECT') for statement in counter.statements) == 3
+    for subscription in subscriptions:
+        subscription.close()
+
+
+def test_heartbeats_do_not_query(app, broker):
+    student_id = _student_id()
+    stream = notification_stream(broker.subscribe(student_id), heartbeat=0.01, max_seconds=5)
+    assert _events(stream, 2)[1] == 'event: count\ndata: {"count": 0}\n\n'
+    with count_queries() as counter:
+        assert _events(stream, 3) == [': heartbeat\n\n'] * 3
+    assert counter.count == 0
+    stream.close()
+    assert broker.subscriber_count() == 0
+
+
+def test_stream_replays_then_pushes_new_notifications(app, broker):
+    student_id = _student_id()
+    _notify([student_id], 'Before')
+    first_id = Notification.query.filter_by(user_id=student_id).one().id
+
+    stream = notification_stream(broker.subscribe(student_id), last_event_id=0, heartbeat=5, max_seconds=10)
+    retry, replayed, count = _events(stream, 3)
+    assert replayed.startswith(f'id: {first_id}\nevent: notification\n') and '"Before"' in replayed
+    assert count == 'event: count\ndata: {"count": 1}\n\n'
+
+    _notify([student_id], 'After')
+    pushed, count = _events(stream, 2)
+    assert f'id: {first_id + 1}' in pushed and '"After"' in pushed
+    assert count == 'event: count\ndata: {"count": 2}\n\n'
+    stream.close()
+
+
+def test_overflowing_mailbox_is_re_read_from_the_table(app, broker):
+    student_id = _student_id()
+    stream = notification_stream(broker.subscribe(student_id), heartbeat=5, max_seconds=10)
+    _events(stream, 2)
+
+    # One pass delivers more rows than a mailbox keeps
+    _notify([student_id] * (REPLAY_LIMIT + 5))
+    ids = []
+    while len(ids) < REPLAY_LIMIT + 5:
+        event = next(stream)
+        if event.startswith('id: '):
+            ids.append(int(event.split('\n')[0][4:]))
+    assert ids == [notification_id for notification_id, in db.session.query(Notification.id).filter_by(
+        user_id=student_id).order_by(Notification.id)]
+    stream.close()
+
+
+def test_subscriptions_wake_only_on_news():
+    subscription = Subscription(broker=None, user_id=1)
+    subscription.deliver([], 3)
+    assert subscription.wait(0) and subscription.take() == ([], 3, False)
+    subscription.deliver([], 3)
+    subscription.deliver([], None)
+    assert not subscription.wait(0)
+
+
+def test_poller_stops_with_the_last_stream(app, broker):
+    subscription = broker.subscribe(_student_id())
+    poller = broker._poller
+    assert poller.is_alive()
+    subscription.close()
+    poller.join(5)
+    assert not poller.is_alive() and broker._poller is None
+
+
+def test_database_broker_sees_other_processes(make_app, tmp_path):
+    path = tmp_path / 'library.db'
+    app = make_app(f'sqlite:///{path}', PUSH_BROKER='database', PUSH_POLL_INTERVAL=1)
+    broker = app.extensions['push_broker']
+    with app.app_context():
+        student_id = _student_id()
+        subscription = broker.subscribe(student_id)
+
+    # Another process writes a notification, then the student reads it there
+    with sqlite3.connect(path) as other:
+        other.execute("INSERT INTO notifications (user_id, message, created_at, is_read, notification_type) "
+                      "VALUES (?, 'Elsewhere', '2024-01-01 00:00:00.000000', 0, 'info')", (student_id,))
+        other.execute('UPDATE users SET unread_notifications = 1 WHERE id = ?', (student_id,))
+    rows, count, _ = _news(subscription)
+    assert [row.message for row in rows] == ['Elsewhere'] and count == 1
+
+    with sqlite3.connect(path) as other:
+        other.execute('UPDATE users SET unread_notifications = 0 WHERE id = ?', (student_id,))
+    assert _news(subscription) == ([], 0, False)
+    subscription.close()
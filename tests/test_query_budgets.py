@@ -0,0 +1,23 @@
+import pytest
+from conftest import ADMIN, STUDENT, login
+from profiler import count_queries
+
+# (login, url) -> maximum SQL statements for one request. Budgets do not
+# depend on how many rows a page lists, so a lazy load per row (N+1) blows
+# them as soon as the seeded data has more than a handful of loans.
+QUERY_BUDGETS = {
+    (ADMIN, '/admin/dashboard'): 6,
+    (ADMIN, '/return-book'): 4,
+    (ADMIN, '/recent-issues'): 4,
+    (STUDENT, '/my-books'): 4,
+}
+
+
+@pytest.mark.parametrize('credentials, url', list(QUERY_BUDGETS))
+def test_route_stays_within_query_budget(seeded_app, credentials, url):
+    client = login(seeded_app, credentials)
+    with seeded_app.app_context(), count_queries() as counter:
+        response = client.get(url)
+    assert response.status_code == 200
+    budget = QUERY_BUDGETS[(credentials, url)]
+    assert counter.count <= budget, '\n'.join(counter.statements)
@@ -0,0 +1,41 @@
+import pytest
+from conftest import ADMIN, STUDENT, login
+from models import db
+from profiler import count_queries
+
+# (login, url) -> indexes the route's queries must use on SQLite
+QUERY_PLAN_CHECKS = {
+    (STUDENT, '/my-books'): ['ix_issued_books_user_issue'],
+    (STUDENT, '/notifications'): ['ix_notifications_user_unread', 'ix_notifications_user_created'],
+    (ADMIN, '/student/dashboard?category=Fiction'): ['ix_books_category_id'],
+    (ADMIN, '/admin/dashboard'): ['ix_issued_books_issue_date', 'ix_issued_books_open_due'],
+    (ADMIN, '/recent-issues'): ['ix_issued_books_issue_date'],
+    (ADMIN, '/return-book'): ['ix_issued_books_open_due'],
+    (ADMIN, '/issue-book'): ['ix_users_role_name', 'ix_books_available_title'],
+    (ADMIN, '/memberships'): ['ix_users_role_name'],
+}
+
+
+def explain(statement, parameters):
+    """EXPLAIN QUERY PLAN detail lines for one captured statement"""
+    rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+    return [row[-1] for row in rows]
+
+
+@pytest.mark.parametrize('credentials, url', list(QUERY_PLAN_CHECKS))
+def test_route_uses_expected_indexes(seeded_app, credentials, url):
+    client = login(seeded_app, credentials)
+    with seeded_app.app_context():
+        with count_queries() as counter:
+            response = client.get(url)
+        assert response.status_code == 200
+
+        plan = []
+        for statement, parameters in zip(counter.statements, counter.parameters):
+            if statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                plan.extend(explain(statement, parameters))
+        db.session.rollback()
+
+    missing = [index for index in QUERY_PLAN_CHECKS[(credentials, url)]
+               if not any(index in line for line in plan)]
+    assert not missing, '\n'.join(plan)
@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+from flask import g
+
+from conftest import ADMIN, login
+from models import db, Book, User
+from replica import STICKY_KEY, use_primary, sync_replica
+
+
+@pytest.fixture
+def replicated(make_app, tmp_path):
+    """An app on a primary and a replica file, with the replica's copy of
+    Animal Farm renamed so reads show which database served them"""
+    primary, replica = tmp_path / 'library.db', tmp_path / 'replica.db'
+    app = make_app(f'sqlite:///{primary}', SQLALCHEMY_BINDS={'replica': f'sqlite:///{replica}'},
+                   REPLICA_STICKY_SECONDS=60)
+    with sqlite3.connect(replica) as conn:
+        conn.execute("UPDATE books SET title = 'Animal Farm (replica)' WHERE title = 'Animal Farm'")
+    return app
+
+
+def _served_by_replica(client):
+    page = client.get('/books').get_data(as_text=True)
+    assert 'Animal Farm' in page
+    return 'Animal Farm (replica)' in page
+
+
+def _title(book_id):
+    return db.session.query(Book.title).filter(Book.id == book_id).scalar()
+
+
+def test_get_requests_read_from_the_replica(replicated):
+    client = login(replicated, ADMIN)
+    assert _served_by_replica(client)
+    with replicated.app_context():
+        # Outside a request (commands, jobs) everything uses the primary
+        assert Book.query.filter_by(title='Animal Farm (replica)').count() == 0
+
+
+def test_writes_pin_the_session_to_the_primary(replicated):
+    client = login(replicated, ADMIN)
+    other = login(replicated, ADMIN)
+    with replicated.app_context():
+        student_id = User.query.filter_by(role='student').first().id
+        book_id = Book.query.filter_by(title='Animal Farm').one().id
+    client.post('/issue-book', data={'student_id': student_id, 'book_id': book_id})
+
+    assert not _served_by_replica(client)
+    # Only the browser that wrote is pinned
+    assert _served_by_replica(other)
+
+    with client.session_transaction() as session:
+        session[STICKY_KEY] = 0
+    assert _served_by_replica(client)
+
+
+def test_a_request_reads_its_own_writes(replicated):
+    with replicated.test_request_context('/books'):
+        replicated.preprocess_request()
+        book_id = db.session.query(Book.id).filter(Book.title == 'Animal Farm (replica)').scalar()
+        assert book_id is not None
+        with use_primary():
+            assert _title(book_id) == 'Animal Farm'
+        assert _title(book_id) == 'Animal Farm (replica)'
+
+        db.session.get(Book, book_id).title = 'Animal Farm, 2nd edition'
+        db.session.flush()
+        assert not g.read_replica
+        assert _title(book_id) == 'Animal Farm, 2nd edition'
+        db.session.rollback()
+
+
+def test_other_methods_use_the_primary(replicated):
+    with replicated.test_request_context('/books', method='POST'):
+        replicated.preprocess_request()
+        assert Book.query.filter_by(title='Animal Farm').count() == 1
+
+
+def test_sync_copies_the_primary(replicated):
+    client = login(replicated, ADMIN)
+    with replicated.app_context():
+        sync_replica()
+    assert not _served_by_replica(client)
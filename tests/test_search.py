@@ -0,0 +1,81 @@
+import pytest
+
+from conftest import STUDENT, login
+from models import db, Book, Category
+from pagination import paginate_keyset
+from search import fts_query, has_search_index, search_books
+
+
+def _titles(query_and_keys):
+    query, sort_keys = query_and_keys
+    return [book.title for book in query.order_by(*[column for column, _ in sort_keys])]
+
+
+def _add_book(title, author, category='Fiction'):
+    book = Book(title=title, author=author, category=Category.query.filter_by(name=category).one())
+    db.session.add(book)
+    db.session.commit()
+    return book
+
+
+def test_fts_query_matches_every_word_as_a_prefix():
+    assert fts_query('great gats') == '"great"* "gats"*'
+    assert fts_query('"; DROP TABLE books --') == '"DROP"* "TABLE"* "books"*'
+    assert fts_query('!!!') == ''
+
+
+def test_search_ranks_title_matches_above_author_matches(app):
+    assert has_search_index()
+    _add_book('A Study of Orwell', 'Someone Else')
+    assert _titles(search_books('orwell')) == ['A Study of Orwell', '1984', 'Animal Farm']
+
+
+def test_search_matches_prefixes_categories_and_diacritics(app):
+    _add_book('Les Misérables', 'Victor Hugo', 'History')
+    assert _titles(search_books('gats')) == ['The Great Gatsby']
+    assert 'Les Misérables' in _titles(search_books('miserables'))
+    assert set(_titles(search_books('romance'))) == {'Pride and Prejudice'}
+
+
+def test_search_and_category_filter_combine(app):
+    assert _titles(search_books('orwell', 'Political Fiction')) == ['Animal Farm']
+    assert len(_titles(search_books('', 'Fiction'))) == 4
+
+
+def test_index_follows_book_updates_and_deletes(app):
+    book = Book.query.filter_by(title='1984').one()
+    book.title = 'Nineteen Eighty-Four'
+    db.session.commit()
+    assert _titles(search_books('nineteen')) == ['Nineteen Eighty-Four']
+    assert '1984' not in _titles(search_books('1984'))
+
+    db.session.delete(book)
+    db.session.commit()
+    assert _titles(search_books('nineteen')) == []
+
+
+def test_falls_back_to_substring_search_without_the_index(app):
+    app.extensions['search_index'] = False
+    assert _titles(search_books('Gatsby')) == ['The Great Gatsby']
+    assert _titles(search_books('!!!')) == []
+
+
+@pytest.mark.parametrize('search', ['orwell', ''])
+def test_search_results_page_in_rank_order(app, search):
+    expected = _titles(search_books(search))
+    seen, cursor = [], None
+    while True:
+        page = paginate_keyset(*search_books(search), cursor, per_page=2)
+        seen.extend(book.title for book in page)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def test_student_dashboard_lists_search_results(make_app):
+    app = make_app()
+    response = login(app, STUDENT).get('/student/dashboard', query_string={'search': 'orwell'})
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert '1984' in page and 'Animal Farm' in page and 'Gatsby' not in page
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import inspect
+
+from conftest import ADMIN, STUDENT, login
+from models import db, User, Book, IssuedBook, LibraryStats
+from stats import adjust_stats, compute_stats, overdue_count, reconcile_stats
+
+
+def _stored():
+    db.session.expire_all()
+    stats = LibraryStats.get()
+    return {name: getattr(stats, name) for name in LibraryStats.COUNTERS}
+
+
+def test_fresh_database_stores_only_write_driven_counters(app):
+    columns = {column['name'] for column in inspect(db.engine).get_columns('library_stats')}
+    assert columns == {'id', 'updated_at', *LibraryStats.COUNTERS}
+    assert 'overdue_loans' not in columns
+    assert _stored() == compute_stats() == {
+        'total_books': 8, 'total_copies': 21, 'available_copies': 21, 'students': 1, 'open_loans': 0
+    }
+
+
+def test_students_counts_every_student_account(app):
+    db.session.add(User(name='Lapsed', email='lapsed@example.com', password_hash='x', role='student',
+                        membership_type='3month',
+                        membership_expiry=datetime.now(timezone.utc) - timedelta(days=1)))
+    db.session.commit()
+    assert compute_stats()['students'] == 2
+
+
+def test_routes_keep_the_counters_in_step(make_app):
+    app = make_app()
+    admin = login(app, ADMIN)
+    admin.post('/register', data={'name': 'New', 'email': 'new@example.com', 'password': 'pw'})
+    admin.post('/books/add', data={'title': 'Dune', 'author': 'Frank Herbert', 'category': 'Science Fiction',
+                                   'total_copies': '3'})
+    with app.app_context():
+        dune = Book.query.filter_by(title='Dune').one().id
+        gatsby = Book.query.filter_by(title='The Great Gatsby').one().id
+        student = User.query.filter_by(email=STUDENT[0]).one().id
+    admin.post(f'/books/edit/{dune}', data={'title': 'Dune', 'author': 'Frank Herbert',
+                                            'category': 'Science Fiction', 'total_copies': '5'})
+    admin.post('/issue-book', data={'student_id': student, 'book_id': dune})
+    with app.app_context():
+        loan = IssuedBook.query.filter_by(book_id=dune).one().id
+        assert _stored() == compute_stats()
+        assert _stored()['open_loans'] == 1 and _stored()['students'] == 2
+    admin.post('/return-book', data={'issued_book_id': loan})
+    admin.get(f'/books/delete/{gatsby}')
+    with app.app_context():
+        assert _stored() == compute_stats()
+        assert _stored()['total_books'] == 8 and _stored()['open_loans'] == 0
+
+
+def test_adjust_stats_applies_deltas_in_sql(app):
+    adjust_stats(total_books=2, open_loans=0, available_copies=-1)
+    db.session.commit()
+    assert _stored()['total_books'] == 10 and _stored()['available_copies'] == 20
+
+
+def test_reconcile_reports_and_repairs_drift(app):
+    adjust_stats(total_books=5, students=-1)
+    db.session.commit()
+    assert reconcile_stats() == {'total_books': (13, 8), 'students': (0, 1)}
+    assert _stored() == compute_stats()
+    assert reconcile_stats() == {}
+
+
+def test_overdue_loans_are_counted_live(app):
+    now = datetime.now(timezone.utc)
+    student = User.query.filter_by(email=STUDENT[0]).one()
+    books = Book.query.limit(3).all()
+    db.session.add_all([
+        IssuedBook(user_id=student.id, book_id=books[0].id, due_date=now - timedelta(days=1)),
+        IssuedBook(user_id=student.id, book_id=books[1].id, due_date=now + timedelta(days=1)),
+        IssuedBook(user_id=student.id, book_id=books[2].id, due_date=now - timedelta(days=2), return_date=now),
+    ])
+    db.session.commit()
+    assert overdue_count(now) == 1
+    assert overdue_count(now + timedelta(days=2)) == 2
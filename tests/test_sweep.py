@@ -0,0 +1,68 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from conftest import STUDENT
+from models import db, User, Book, IssuedBook, Notification
+from sweep import sweep_due_notifications
+
+
+def _open_loan(due_date):
+    student = User.query.filter_by(email=STUDENT[0]).one()
+    book = Book.query.filter(~Book.issued_books.any(IssuedBook.user_id == student.id)).first()
+    loan = IssuedBook(user_id=student.id, book_id=book.id, due_date=due_date)
+    db.session.add(loan)
+    db.session.commit()
+    return loan
+
+
+def test_create_app_does_not_start_the_scheduler(make_app):
+    app = make_app()
+    scheduler = app.extensions['scheduler']
+    assert 'notification_sweep' in scheduler.job_names()
+    assert scheduler._thread is None
+    assert not any(thread.name == 'library-scheduler' for thread in threading.enumerate())
+
+
+def test_run_scheduler_command_runs_the_jobs_in_the_foreground(make_app, monkeypatch):
+    app = make_app()
+    scheduler = app.extensions['scheduler']
+    ran = []
+    monkeypatch.setattr(scheduler, 'run_forever', lambda: ran.append(threading.current_thread()))
+    result = app.test_cli_runner().invoke(args=['run-scheduler'])
+    assert result.exit_code == 0, result.output
+    assert ran == [threading.current_thread()]
+    assert 'notification_sweep' in result.output
+
+
+def test_run_forever_runs_due_jobs_until_shutdown(make_app):
+    scheduler = make_app().extensions['scheduler']
+    ran = threading.Event()
+    scheduler.add_job('probe', ran.set, 1)
+    runner = threading.Thread(target=scheduler.run_forever)
+    runner.start()
+    assert ran.wait(5)
+    scheduler.shutdown()
+    runner.join(5)
+    assert not runner.is_alive()
+
+
+def test_sweep_creates_due_and_overdue_alerts_once(app):
+    now = datetime.now(timezone.utc)
+    due = _open_loan(now + timedelta(days=1))
+    overdue = _open_loan(now - timedelta(days=3))
+
+    assert sweep_due_notifications(now) == 2
+    kinds = dict(db.session.query(Notification.loan_id, Notification.kind))
+    assert kinds == {due.id: Notification.KIND_DUE_TOMORROW, overdue.id: Notification.KIND_OVERDUE}
+    assert User.query.filter_by(email=STUDENT[0]).one().unread_notifications == 2
+
+    assert sweep_due_notifications(now) == 0
+    assert Notification.query.count() == 2
+
+
+def test_sweep_skips_returned_loans(app):
+    now = datetime.now(timezone.utc)
+    loan = _open_loan(now - timedelta(days=3))
+    loan.return_date = now
+    db.session.commit()
+    assert sweep_due_notifications(now) == 0
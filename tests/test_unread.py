@@ -0,0 +1,101 @@
+from sqlalchemy import event
+
+from caching import FillGuard, TTLCache
+from conftest import STUDENT, login
+from models import db, User, Notification
+from outbox import queue_notification
+from stats import reconcile_unread_counts
+
+
+def _student_id():
+    return User.query.filter_by(email=STUDENT[0]).one().id
+
+
+def test_ttl_cache_expires_and_evicts_the_least_recent(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('caching.time.monotonic', lambda: now[0])
+    cache = TTLCache(ttl=10, max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)  # 'b' was used least recently
+    assert (cache.get('b'), cache.get('a'), cache.get('c')) == (None, 1, 3)
+
+    now[0] += 10
+    assert cache.get('a', 'expired') == 'expired' and len(cache) == 1
+
+
+def test_fill_guard_rejects_values_read_before_an_invalidation():
+    guard = FillGuard()
+    token = guard.token()
+    assert guard.still_valid(token)
+    guard.invalidate()
+    assert not guard.still_valid(token) and guard.still_valid(guard.token())
+
+
+def test_polls_are_served_from_the_cache(make_app):
+    app = make_app()
+    client = login(app, STUDENT)
+    cache = app.extensions['unread_counts']
+    with app.app_context():
+        expected = Notification.query.filter_by(user_id=_student_id(), is_read=False).count()
+
+    counts = [client.get('/api/notifications/count').get_json()['count'] for _ in range(5)]
+    assert counts == [expected] * 5
+    assert (cache.misses, cache.hits) == (1, 4)
+
+
+def test_commits_invalidate_the_cached_count(make_app):
+    app = make_app()
+    client = login(app, STUDENT)
+    cache = app.extensions['unread_counts']
+    with app.app_context():
+        student_id = _student_id()
+    before = client.get('/api/notifications/count').get_json()['count']
+
+    with app.app_context():
+        queue_notification(student_id, 'One')
+        queue_notification(student_id, 'Two')
+        db.session.commit()
+    assert client.get('/api/notifications/count').get_json()['count'] == before + 2
+
+    # A rolled back notification leaves the entry alone
+    with app.app_context():
+        queue_notification(student_id, 'Dropped')
+        db.session.rollback()
+    misses = cache.misses
+    assert client.get('/api/notifications/count').get_json()['count'] == before + 2
+    assert cache.misses == misses
+
+    client.get('/notifications')
+    assert client.get('/api/notifications/count').get_json()['count'] == 0
+
+
+def test_reads_racing_a_commit_are_not_cached(app):
+    cache = app.extensions['unread_counts']
+    student_id = _student_id()
+
+    def commit_elsewhere(conn, cursor, statement, parameters, context, executemany):
+        cache.invalidate([student_id])
+    event.listen(db.engine, 'before_cursor_execute', commit_elsewhere)
+    try:
+        cache.get(student_id)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', commit_elsewhere)
+
+    cache.get(student_id)
+    assert (cache.misses, cache.hits) == (2, 0)
+    cache.get(student_id)
+    assert cache.hits == 1
+
+
+def test_reconcile_repairs_drifted_counters(app):
+    student_id = _student_id()
+    actual = Notification.query.filter_by(user_id=student_id, is_read=False).count()
+    db.session.execute(db.update(User).where(User.id == student_id).values(unread_notifications=actual + 5))
+    db.session.commit()
+
+    assert reconcile_unread_counts() == {f'unread_notifications[user {student_id}]': (actual + 5, actual)}
+    db.session.commit()
+    assert db.session.get(User, student_id).unread_notifications == actual
+    assert reconcile_unread_counts() == {}
@@ -0,0 +1,60 @@
+from flask import current_app
+from caching import FillGuard, TTLCache
+from commit_hooks import after_commit
+from models import db, User
+from replica import use_primary
+from stats import UNREAD_TOUCHED_KEY
+
+
+class UnreadCountCache:
+    """In-process TTL cache of users' unread notification counters.
+
+    Counts are read from users.unread_notifications and kept for
+    UNREAD_COUNT_CACHE_TTL seconds. Commits that change a user's counter in
+    this process invalidate the entry right away; other processes see the
+    change once their entry expires.
+    """
+
+    def __init__(self, app):
+        self._entries = TTLCache(app.config['UNREAD_COUNT_CACHE_TTL'], app.config['UNREAD_COUNT_CACHE_SIZE'])
+        self._guard = FillGuard()
+        self.hits = self.misses = 0
+        app.extensions['unread_counts'] = self
+
+    def get(self, user_id):
+        count = self._entries.get(user_id)
+        if count is not None:
+            self.hits += 1
+            return count
+        self.misses += 1
+
+        token = self._guard.token()
+        with use_primary():  # a lagging replica would be cached for the TTL
+            count = db.session.query(User.unread_notifications).filter(User.id == user_id).scalar() or 0
+        if self._guard.still_valid(token):
+            self._entries.set(user_id, count)
+        return count
+
+    def invalidate(self, user_ids):
+        self._guard.invalidate()
+        self._entries.delete(user_ids)
+
+    def clear(self):
+        self._guard.invalidate()
+        self._entries.clear()
+
+
+def unread_count(user_id):
+    """A user's unread notification count, from the cache when fresh"""
+    return current_app.extensions['unread_counts'].get(user_id)
+
+
+@after_commit(UNREAD_TOUCHED_KEY)
+def _invalidate_after_commit(touched):
+    cache = current_app.extensions.get('unread_counts')
+    if cache is not None:
+        cache.invalidate(touched)
+    # Wake the users' open notification streams
+    broker = current_app.extensions.get('push_broker')
+    if broker is not None:
+        broker.publish(touched)